@@ -5,6 +5,7 @@ import llm                  # LLMモジュール
 import database             # データベースモジュール
 import metrics              # 評価指標モジュール
 import data                 # データモジュール
+import retention            # データ保持モジュール
 import torch
 from transformers import pipeline
 from config import MODEL_NAME
@@ -23,6 +24,12 @@ database.init_db()
 # データベースが空ならサンプルデータを投入
 data.ensure_initial_data()
 
+# 古い履歴のアーカイブとVACUUMをバックグラウンドで実行（プロセスごとに1回だけ起動）
+@st.cache_resource
+def start_retention_worker():
+    return retention.start_retention_worker()
+start_retention_worker()
+
 # LLMモデルのロード（キャッシュを利用）
 # モデルをキャッシュして再利用
 @st.cache_resource
@@ -78,4 +85,5 @@ elif st.session_state.page == "サンプルデータ管理":
 
 # --- フッターなど（任意） ---
 st.sidebar.markdown("---")
+ui.display_cache_debug_panel()
 st.sidebar.info("開発者: [Your Name]")
\ No newline at end of file
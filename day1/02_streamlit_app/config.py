@@ -1,3 +1,15 @@
 # config.py
 DB_FILE = "chat_feedback.db"
-MODEL_NAME = "google/gemma-2-2b-jpn-it"
\ No newline at end of file
+MODEL_NAME = "google/gemma-2-2b-jpn-it"
+# 推論バックエンド: "hf" (transformersパイプライン, bfloat16) または "cpu-int8" (CPU向け動的int8量子化)
+INFERENCE_BACKEND = "hf"
+
+# 会話コンテキスト設定
+CONTEXT_TOKEN_BUDGET = 2048         # 過去の会話を含めたプロンプトのトークン数の上限
+CONTEXT_SUMMARY_CHARS = 200         # 切り捨てた古い質問の要約の最大文字数（0で要約しない）
+
+# データ保持（リテンション）設定
+RETENTION_DAYS = 90                 # この日数より古い履歴をアーカイブへ移動
+RETENTION_BATCH_SIZE = 500          # 1トランザクションで移動する行数
+RETENTION_INTERVAL_SECONDS = 3600   # バックグラウンドジョブの実行間隔
+ARCHIVE_DIR = "archive"             # 月別アーカイブDBの保存先
@@ -0,0 +1,111 @@
+# context.py
+# 会話履歴からトークン数の上限内に収まるメッセージリストを組み立てる
+import threading
+from collections import OrderedDict
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_SUMMARY_CHARS
+
+# メッセージごとのトークン数キャッシュの上限
+TOKEN_CACHE_SIZE = 4096
+
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+_overhead_cache = {}  # {モデル名: 1メッセージあたりのテンプレートのトークン数}
+
+
+def message_overhead_tokens(backend):
+    """チャットテンプレートで1メッセージごとに追加されるトークン数を求める
+
+    （Gemmaの場合 "<start_of_turn>user\n" ... "<end_of_turn>\n" など）
+    生成開始の区切りも含めて数えるため、やや多めの見積もりになる。
+    """
+    if backend.model_name not in _overhead_cache:
+        probe = "a"
+        overhead = backend.count_tokens([{"role": "user", "content": probe}]) - backend.count_tokens(probe)
+        _overhead_cache[backend.model_name] = max(overhead, 0)
+    return _overhead_cache[backend.model_name]
+
+
+def count_message_tokens(backend, content):
+    """メッセージ本文のトークン数を返す（同じ本文はキャッシュを再利用）"""
+    key = (backend.model_name, content)
+    with _token_cache_lock:
+        if key in _token_cache:
+            _token_cache.move_to_end(key)
+            return _token_cache[key]
+    count = backend.count_tokens(content)
+    with _token_cache_lock:
+        _token_cache[key] = count
+        if len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return count
+
+
+def _split_turns(history):
+    """履歴を (userメッセージ, assistantメッセージ) のターンに分ける"""
+    turns = []
+    pending_user = None
+    for message in history:
+        if message["role"] == "user":
+            pending_user = message
+        elif message["role"] == "assistant" and pending_user is not None:
+            turns.append((pending_user, message))
+            pending_user = None
+    return turns
+
+
+def _summarize(turns, max_chars):
+    """切り捨てたターンの質問を短くまとめる（LLMを呼ばない簡易的な要約）"""
+    questions = [user["content"].replace("\n", " ") for user, _ in turns]
+    summary = " / ".join(questions)
+    if len(summary) > max_chars:
+        summary = summary[:max_chars] + "…"
+    return f"（これまでの会話で扱った質問: {summary}）\n\n"
+
+
+def build_context(backend, user_question, history=None, token_budget=CONTEXT_TOKEN_BUDGET,
+                  summary_chars=CONTEXT_SUMMARY_CHARS):
+    """会話履歴と新しい質問から、トークン数の上限内のメッセージリストを組み立てる
+
+    新しいターンから順に詰め込み、上限を超える古いターンは切り捨てる。
+    summary_chars が0より大きい場合、切り捨てたターンの質問を短い要約として
+    最初のユーザーメッセージの先頭に付ける。
+    ターン単位で扱うため、user / assistant の交互の並びは保たれる。
+
+    Returns:
+        tuple: (メッセージのリスト, 情報の辞書 {"estimated_tokens", "kept_turns", "dropped_turns"})
+    """
+    overhead = message_overhead_tokens(backend)
+    question_tokens = count_message_tokens(backend, user_question) + overhead
+    turns = _split_turns(history or [])
+
+    used = question_tokens
+    kept = []
+    for user, assistant in reversed(turns):
+        turn_tokens = (
+            count_message_tokens(backend, user["content"])
+            + count_message_tokens(backend, assistant["content"])
+            + 2 * overhead
+        )
+        if used + turn_tokens > token_budget:
+            break
+        kept.append((user, assistant))
+        used += turn_tokens
+    kept.reverse()
+    dropped = turns[:len(turns) - len(kept)]
+
+    messages = []
+    for user, assistant in kept:
+        messages.append({"role": "user", "content": user["content"]})
+        messages.append({"role": "assistant", "content": assistant["content"]})
+    messages.append({"role": "user", "content": user_question})
+
+    if dropped and summary_chars > 0:
+        summary = _summarize(dropped, summary_chars)
+        summary_tokens = count_message_tokens(backend, summary)
+        # 要約を入れても上限を超えない場合のみ付ける
+        if used + summary_tokens <= token_budget:
+            messages[0] = {"role": "user", "content": summary + messages[0]["content"]}
+            used += summary_tokens
+
+    info = {"estimated_tokens": used, "kept_turns": len(kept), "dropped_turns": len(dropped)}
+    return messages, info
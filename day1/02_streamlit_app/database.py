@@ -1,5 +1,6 @@
 # database.py
 import sqlite3
+import threading
 import pandas as pd
 from datetime import datetime
 import streamlit as st
@@ -24,12 +25,66 @@ CREATE TABLE IF NOT EXISTS {TABLE_NAME}
  relevance_score REAL)
 '''
 
+# --- 読み取りキャッシュ ---
+# テーブルへの書き込みごとにバージョンを進め、読み取り結果はバージョンをキーにキャッシュする
+# （Streamlitはセッションごとにスレッドを使うため、ロックで保護する）
+_cache_lock = threading.Lock()
+_table_version = 0
+_read_cache = {}  # {(関数名, バージョン): 結果}
+_cache_stats = {"hits": 0, "misses": 0}
+
+def bump_table_version():
+    """テーブルのバージョンを進め、古いキャッシュを破棄する"""
+    global _table_version
+    with _cache_lock:
+        _table_version += 1
+        _read_cache.clear()
+
+def cached_read(name, loader):
+    """現在のテーブルバージョンでキャッシュされた読み取り結果を返す"""
+    with _cache_lock:
+        key = (name, _table_version)
+        if key in _read_cache:
+            _cache_stats["hits"] += 1
+            return _read_cache[key]
+        _cache_stats["misses"] += 1
+    # loaderが例外を送出した場合は何もキャッシュしない
+    value = loader()
+    with _cache_lock:
+        # 読み取り中に書き込みがあった場合はキャッシュしない
+        if key[1] == _table_version:
+            _read_cache[key] = value
+    return value
+
+def get_cache_stats():
+    """キャッシュのヒット率とメモリ使用量を返す"""
+    with _cache_lock:
+        hits = _cache_stats["hits"]
+        misses = _cache_stats["misses"]
+        memory_bytes = 0
+        for value in _read_cache.values():
+            if isinstance(value, pd.DataFrame):
+                memory_bytes += int(value.memory_usage(deep=True).sum())
+            else:
+                memory_bytes += 8
+        total = hits + misses
+        return {
+            "version": _table_version,
+            "entries": len(_read_cache),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "memory_bytes": memory_bytes,
+        }
+
 # --- データベース初期化 ---
 def init_db():
     """データベースとテーブルを初期化する"""
     try:
         conn = sqlite3.connect(DB_FILE)
         c = conn.cursor()
+        # 新規DBではインクリメンタルVACUUMを有効にする（既存DBはretentionモジュールで切り替え）
+        c.execute("PRAGMA auto_vacuum = INCREMENTAL")
         c.execute(SCHEMA)
         conn.commit()
         conn.close()
@@ -59,6 +114,7 @@ def save_to_db(question, answer, feedback, correct_answer, is_correct, response_
         ''', (timestamp, question, answer, feedback, correct_answer, is_correct,
              response_time, bleu_score, similarity_score, word_count, relevance_score))
         conn.commit()
+        bump_table_version()
         print("Data saved to DB successfully.") # デバッグ用
     except sqlite3.Error as e:
         st.error(f"データベースへの保存中にエラーが発生しました: {e}")
@@ -67,7 +123,18 @@ def save_to_db(question, answer, feedback, correct_answer, is_correct, response_
             conn.close()
 
 def get_chat_history():
-    """データベースから全てのチャット履歴を取得する"""
+    """データベースから全てのチャット履歴を取得する（書き込みがあるまでキャッシュを利用）"""
+    try:
+        df = cached_read("chat_history", _load_chat_history)
+    except sqlite3.Error as e:
+        # エラーはキャッシュしない（次の呼び出しで読み直す）
+        st.error(f"履歴の取得中にエラーが発生しました: {e}")
+        return pd.DataFrame() # 空のDataFrameを返す
+    # 呼び出し側で列を追加・変更してもキャッシュが汚れないようコピーを返す
+    return df.copy()
+
+def _load_chat_history():
+    """データベースから全てのチャット履歴を読み込む（エラーは呼び出し側で処理する）"""
     conn = None
     try:
         conn = sqlite3.connect(DB_FILE)
@@ -77,15 +144,21 @@ def get_chat_history():
         if 'is_correct' in df.columns:
              df['is_correct'] = pd.to_numeric(df['is_correct'], errors='coerce') # 数値に変換、失敗したらNaN
         return df
-    except sqlite3.Error as e:
-        st.error(f"履歴の取得中にエラーが発生しました: {e}")
-        return pd.DataFrame() # 空のDataFrameを返す
     finally:
         if conn:
             conn.close()
 
 def get_db_count():
-    """データベース内のレコード数を取得する"""
+    """データベース内のレコード数を取得する（書き込みがあるまでキャッシュを利用）"""
+    try:
+        return cached_read("db_count", _load_db_count)
+    except sqlite3.Error as e:
+        # エラーはキャッシュしない（次の呼び出しで読み直す）
+        st.error(f"レコード数の取得中にエラーが発生しました: {e}")
+        return 0
+
+def _load_db_count():
+    """データベース内のレコード数を読み込む（エラーは呼び出し側で処理する）"""
     conn = None
     try:
         conn = sqlite3.connect(DB_FILE)
@@ -93,9 +166,6 @@ def get_db_count():
         c.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}")
         count = c.fetchone()[0]
         return count
-    except sqlite3.Error as e:
-        st.error(f"レコード数の取得中にエラーが発生しました: {e}")
-        return 0
     finally:
         if conn:
             conn.close()
@@ -115,6 +185,7 @@ def clear_db():
         c = conn.cursor()
         c.execute(f"DELETE FROM {TABLE_NAME}")
         conn.commit()
+        bump_table_version()
         st.success("データベースが正常にクリアされました。")
         st.session_state.confirm_clear = False # 確認状態をリセット
         return True # 削除成功
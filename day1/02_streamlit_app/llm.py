@@ -1,12 +1,17 @@
 # llm.py
 import os
-import torch
-from transformers import pipeline
+import sys
 import streamlit as st
 import time
-from config import MODEL_NAME
+from config import MODEL_NAME, INFERENCE_BACKEND
 from huggingface_hub import login
 
+# 03_FastAPIと共有する推論バックエンド（day1/llm_common）を読み込めるようにする
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from llm_common.backends import create_backend
+from llm_common.generation import GenerationResult
+from context import build_context
+
 # モデルをキャッシュして再利用
 @st.cache_resource
 def load_model():
@@ -16,72 +21,54 @@ def load_model():
         # アクセストークンを保存
         hf_token = st.secrets["huggingface"]["token"]
         
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        st.info(f"Using device: {device}") # 使用デバイスを表示
-        pipe = pipeline(
-            "text-generation",
-            model=MODEL_NAME,
-            model_kwargs={"torch_dtype": torch.bfloat16},
-            device=device
-        )
+        backend = create_backend(INFERENCE_BACKEND)
+        st.info(f"Using device: {backend.device} (backend: {backend.name})") # 使用デバイスを表示
+        backend.load(MODEL_NAME)
         st.success(f"モデル '{MODEL_NAME}' の読み込みに成功しました。")
-        return pipe
+        return backend
     except Exception as e:
         st.error(f"モデル '{MODEL_NAME}' の読み込みに失敗しました: {e}")
         st.error("GPUメモリ不足の可能性があります。不要なプロセスを終了するか、より小さいモデルの使用を検討してください。")
         return None
 
-def generate_response(pipe, user_question):
-    """LLMを使用して質問に対する回答を生成する"""
+def generate_response(pipe, user_question, history=None):
+    """LLMを使用して質問に対する回答を生成する（pipeはllm_common.backendsの推論バックエンド）
+
+    history にこれまでの会話（st.session_state.chat_history）を渡すと、
+    トークン数の上限内で過去のやり取りも含めて回答を生成する。
+
+    Returns:
+        tuple: (回答, 応答時間[秒], トークン数の辞書)
+    """
     if pipe is None:
-        return "モデルがロードされていないため、回答を生成できません。", 0
+        return "モデルがロードされていないため、回答を生成できません。", 0, GenerationResult("").usage()
 
     try:
         start_time = time.time()
-        messages = [
-            {"role": "user", "content": user_question},
-        ]
+        # 過去の会話を古いものから切り捨て、上限内に収める
+        messages, context_info = build_context(pipe, user_question, history)
+        # 生成された部分のトークンだけをデコードして回答を取得する
         # max_new_tokensを調整可能にする（例）
-        outputs = pipe(messages, max_new_tokens=512, do_sample=True, temperature=0.7, top_p=0.9)
-
-        # Gemmaの出力形式に合わせて調整が必要な場合がある
-        # 最後のassistantのメッセージを取得
-        assistant_response = ""
-        if outputs and isinstance(outputs, list) and outputs[0].get("generated_text"):
-           if isinstance(outputs[0]["generated_text"], list) and len(outputs[0]["generated_text"]) > 0:
-               # messages形式の場合
-               last_message = outputs[0]["generated_text"][-1]
-               if last_message.get("role") == "assistant":
-                   assistant_response = last_message.get("content", "").strip()
-           elif isinstance(outputs[0]["generated_text"], str):
-               # 単純な文字列の場合（古いtransformers？） - プロンプト部分を除く処理が必要かも
-               # この部分はモデルやtransformersのバージョンによって調整が必要
-               full_text = outputs[0]["generated_text"]
-               # 簡単な方法：ユーザーの質問以降の部分を取得
-               prompt_end = user_question
-               response_start_index = full_text.find(prompt_end) + len(prompt_end)
-               # 応答部分のみを抽出（より堅牢な方法が必要な場合あり）
-               possible_response = full_text[response_start_index:].strip()
-               # 特定の開始トークンを探すなど、モデルに合わせた調整
-               if "<start_of_turn>model" in possible_response:
-                    assistant_response = possible_response.split("<start_of_turn>model\n")[-1].strip()
-               else:
-                    assistant_response = possible_response # フォールバック
+        result = pipe.generate_text(messages, max_new_tokens=512, do_sample=True, temperature=0.7, top_p=0.9)
+        assistant_response = result.text
 
         if not assistant_response:
-             # 上記で見つからない場合のフォールバックやデバッグ
-             print("Warning: Could not extract assistant response. Full output:", outputs)
+             # 回答が空の場合のフォールバックやデバッグ
+             print("Warning: Could not extract assistant response. Result:", result)
              assistant_response = "回答の抽出に失敗しました。"
 
-
         end_time = time.time()
         response_time = end_time - start_time
-        print(f"Generated response in {response_time:.2f}s") # デバッグ用
-        return assistant_response, response_time
+        print(f"Generated response in {response_time:.2f}s "
+              f"(prompt: {result.prompt_tokens} tokens, completion: {result.completion_tokens} tokens, "
+              f"turns kept: {context_info['kept_turns']}, dropped: {context_info['dropped_turns']})") # デバッグ用
+        usage = result.usage()
+        usage.update(context_info)
+        return assistant_response, response_time, usage
 
     except Exception as e:
         st.error(f"回答生成中にエラーが発生しました: {e}")
         # エラーの詳細をログに出力
         import traceback
         traceback.print_exc()
-        return f"エラーが発生しました: {str(e)}", 0
\ No newline at end of file
+        return f"エラーが発生しました: {str(e)}", 0, GenerationResult("").usage()
@@ -0,0 +1,210 @@
+# loadtest.py
+# 複数ユーザーの同時利用をシミュレートする負荷試験スクリプト
+# GPUやモデルのダウンロードなしで実行できるよう、LLMはスタブに置き換える
+#
+# 使用例:
+#   python loadtest.py --sessions 50 --questions 5 --llm-latency 0.05
+import argparse
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+import database
+import llm
+from llm_common.backends import InferenceBackend
+
+# --- スタブのLLMバックエンド ---
+class StubPipeline(InferenceBackend):
+    """transformersのtext-generationパイプラインと同じ形式で固定の回答を返すスタブ"""
+
+    name = "stub"
+
+    def __init__(self, latency=0.05, jitter=0.5):
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+
+    def count_tokens(self, inputs):
+        if isinstance(inputs, list):
+            inputs = "".join(message["content"] for message in inputs)
+        return len(inputs)
+
+    def generate(self, messages, **kwargs):
+        # 実際の推論時間の代わりにスリープする（GILを解放するので並行性の検証になる）
+        time.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+        question = messages[-1]["content"]
+        answer = f"「{question}」に対するスタブの回答です。" * 3
+        return [{"generated_text": messages + [{"role": "assistant", "content": answer}]}]
+
+# --- SQLiteのロック待ち計測 ---
+class LockStats:
+    """SQLiteのロック待ち（busy）の回数と合計時間を記録する"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def record(self, seconds):
+        with self.lock:
+            self.waits += 1
+            self.wait_time += seconds
+
+lock_stats = LockStats()
+BUSY_TIMEOUT = 30.0  # sqlite3.connectのtimeoutと同等の上限
+BUSY_SLEEP = 0.001
+
+def _retry_on_busy(func, *args, **kwargs):
+    """SQLiteのbusyハンドラと同様に、ロック中はスリープしながら再試行し、待ち時間を記録する"""
+    start = None
+    while True:
+        try:
+            result = func(*args, **kwargs)
+            if start is not None:
+                lock_stats.record(time.perf_counter() - start)
+            return result
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise
+            if start is None:
+                start = time.perf_counter()
+            elif time.perf_counter() - start > BUSY_TIMEOUT:
+                raise
+            time.sleep(BUSY_SLEEP)
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, *args, **kwargs):
+        return _retry_on_busy(super().execute, *args, **kwargs)
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        return _retry_on_busy(super().commit)
+
+_original_connect = sqlite3.connect
+
+def instrumented_connect(path, *args, **kwargs):
+    """ロック待ちを自前で計測するため、timeout=0で接続する"""
+    kwargs["timeout"] = 0
+    kwargs["factory"] = InstrumentedConnection
+    return _original_connect(path, *args, **kwargs)
+
+# --- セッションのシミュレーション ---
+QUESTIONS = [
+    "Pythonのリスト内包表記とは何ですか？",
+    "機械学習における過学習とは？",
+    "Streamlitとは何ですか？",
+    "SQLインジェクションとは何ですか？",
+    "コンテナ技術とは何ですか？",
+]
+
+def timed(latencies, action, func, *args, **kwargs):
+    """関数を実行し、アクションごとの処理時間を記録する"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    latencies[action].append(time.perf_counter() - start)
+    return result
+
+def run_session(session_id, pipe, questions, think_time, latencies, sessions, barrier):
+    """1ユーザー分の操作（質問→フィードバック→履歴閲覧）を繰り返す"""
+    rng = random.Random(session_id)
+    # st.session_stateに相当するセッションごとの状態
+    state = {"chat_history": []}
+    sessions[session_id] = state
+    barrier.wait()  # 全セッションを同時に開始する
+
+    for _ in range(questions):
+        question = rng.choice(QUESTIONS)
+        answer, response_time, _ = timed(latencies, "ask", llm.generate_response, pipe, question, state["chat_history"])
+        state["chat_history"].append({"role": "user", "content": question})
+        state["chat_history"].append({"role": "assistant", "content": answer})
+        time.sleep(think_time * rng.random())
+
+        is_correct = rng.choice([1.0, 0.5, 0.0])
+        timed(latencies, "feedback", database.save_to_db,
+              question, answer, "負荷試験", QUESTIONS[0], is_correct, response_time)
+        time.sleep(think_time * rng.random())
+
+        history_df = timed(latencies, "history", database.get_chat_history)
+        timed(latencies, "count", database.get_db_count)
+        state["last_history_rows"] = len(history_df)
+
+# --- レポート ---
+def percentile(values, p):
+    """最近傍法でパーセンタイルを求める"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def print_report(latencies, wall_time, sessions, mem_per_session, peak_mem):
+    print(f"\n=== 負荷試験結果 ({sessions} セッション, {wall_time:.2f}秒) ===")
+    print(f"{'action':<10}{'count':>8}{'mean(ms)':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for action, values in latencies.items():
+        print(
+            f"{action:<10}{len(values):>8}"
+            f"{statistics.mean(values) * 1000:>10.1f}"
+            f"{percentile(values, 50) * 1000:>10.1f}"
+            f"{percentile(values, 95) * 1000:>10.1f}"
+            f"{percentile(values, 99) * 1000:>10.1f}"
+            f"{max(values) * 1000:>10.1f}"
+        )
+    print(f"\nSQLiteロック待ち: {lock_stats.waits} 回, 合計 {lock_stats.wait_time * 1000:.1f} ms")
+    print(f"セッションあたりの保持メモリ: {mem_per_session / 1024:.1f} KB (ピーク: {peak_mem / 1024 / 1024:.1f} MB)")
+    cache = database.get_cache_stats()
+    print(f"読み取りキャッシュ: ヒット率 {cache['hit_rate']:.1%} ({cache['hits']} / {cache['hits'] + cache['misses']})")
+
+def main():
+    parser = argparse.ArgumentParser(description="フィードバックアプリの同時利用負荷試験")
+    parser.add_argument("--sessions", type=int, default=50, help="同時セッション数")
+    parser.add_argument("--questions", type=int, default=5, help="セッションあたりの質問数")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="スタブLLMの平均応答時間（秒）")
+    parser.add_argument("--think-time", type=float, default=0.01, help="操作間の最大待ち時間（秒）")
+    parser.add_argument("--db", default=None, help="使用するDBファイル（省略時は一時ファイル）")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), "loadtest.db")
+    database.DB_FILE = db_path
+    sqlite3.connect = instrumented_connect
+
+    latencies = defaultdict(list)
+    sessions = {}
+    barrier = threading.Barrier(args.sessions)
+    pipe = StubPipeline(latency=args.llm_latency)
+
+    # アプリのデバッグ出力は結果の表示を妨げるので抑制する
+    with contextlib.redirect_stdout(io.StringIO()):
+        database.init_db()
+        tracemalloc.start()
+        baseline_mem, _ = tracemalloc.get_traced_memory()
+        threads = [
+            threading.Thread(
+                target=run_session,
+                args=(i, pipe, args.questions, args.think_time, latencies, sessions, barrier),
+            )
+            for i in range(args.sessions)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_time = time.perf_counter() - start
+        current_mem, peak_mem = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    mem_per_session = max(0, current_mem - baseline_mem) / args.sessions
+    print(f"DB: {db_path}")
+    print_report(latencies, wall_time, args.sessions, mem_per_session, peak_mem)
+
+if __name__ == "__main__":
+    main()
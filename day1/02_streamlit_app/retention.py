@@ -0,0 +1,205 @@
+# retention.py
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from config import DB_FILE, RETENTION_DAYS, RETENTION_BATCH_SIZE, RETENTION_INTERVAL_SECONDS, ARCHIVE_DIR
+from database import TABLE_NAME, SCHEMA, bump_table_version, cached_read
+
+# 1バッチあたりのインクリメンタルVACUUMで解放するページ数
+VACUUM_PAGES_PER_STEP = 1000
+
+# バックグラウンドジョブの状態（UI表示用）
+_worker_lock = threading.Lock()
+_worker_thread = None
+_maintenance_requested = threading.Event()
+_last_run = {"finished_at": None, "moved_rows": 0, "error": None}
+
+# --- ヘルパー関数 ---
+def _cutoff_timestamp(retention_days):
+    """保持期間の境界となるタイムスタンプ文字列を返す（timestampはテキストで保存されている）"""
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    return cutoff.strftime("%Y-%m-%d %H:%M:%S")
+
+def _archive_path(month):
+    """月別アーカイブDBのパスを返す (例: archive/chat_feedback_2025-01.db)"""
+    base = os.path.splitext(os.path.basename(DB_FILE))[0]
+    return os.path.join(ARCHIVE_DIR, f"{base}_{month}.db")
+
+def _row_bytes_sql():
+    """1行あたりのおおよそのバイト数を求めるSQL式"""
+    text_columns = ["timestamp", "question", "answer", "feedback", "correct_answer"]
+    # テキスト列は実長、数値列は固定8バイトとして概算する
+    parts = [f"COALESCE(LENGTH(CAST({col} AS BLOB)), 0)" for col in text_columns]
+    return " + ".join(parts) + " + 8 * 7"
+
+# --- ドライラン ---
+def plan_retention(retention_days=RETENTION_DAYS):
+    """アーカイブ対象の行数とおおよそのバイト数を月別に集計する（データは変更しない）"""
+    cutoff = _cutoff_timestamp(retention_days)
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        c = conn.cursor()
+        c.execute(f'''
+        SELECT substr(timestamp, 1, 7) AS month, COUNT(*), SUM({_row_bytes_sql()})
+        FROM {TABLE_NAME}
+        WHERE timestamp < ?
+        GROUP BY month
+        ORDER BY month
+        ''', (cutoff,))
+        months = [
+            {"month": month, "rows": rows, "bytes": int(size or 0), "archive": _archive_path(month)}
+            for month, rows, size in c.fetchall()
+        ]
+        page_size = c.execute("PRAGMA page_size").fetchone()[0]
+        freelist = c.execute("PRAGMA freelist_count").fetchone()[0]
+        return {
+            "cutoff": cutoff,
+            "rows": sum(m["rows"] for m in months),
+            "bytes": sum(m["bytes"] for m in months),
+            "months": months,
+            "db_file_bytes": os.path.getsize(DB_FILE) if os.path.exists(DB_FILE) else 0,
+            "reclaimable_bytes": page_size * freelist,
+        }
+    finally:
+        conn.close()
+
+def get_retention_plan(retention_days=RETENTION_DAYS):
+    """plan_retention の結果を返す（書き込みがあるか日付が変わるまでキャッシュを利用）"""
+    today = datetime.now().strftime("%Y-%m-%d")
+    return cached_read(("retention_plan", retention_days, today), lambda: plan_retention(retention_days))
+
+# --- アーカイブ処理 ---
+def _move_batch(conn, cutoff, batch_size):
+    """最も古い月の行を最大batch_size件アーカイブDBへ移動し、移動件数を返す"""
+    c = conn.cursor()
+    row = c.execute(
+        f"SELECT substr(timestamp, 1, 7) FROM {TABLE_NAME} WHERE timestamp < ? ORDER BY timestamp LIMIT 1",
+        (cutoff,)
+    ).fetchone()
+    if row is None:
+        return 0
+    month = row[0]
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    c.execute("ATTACH DATABASE ? AS archive", (_archive_path(month),))
+    try:
+        c.execute(SCHEMA.replace(f"EXISTS {TABLE_NAME}", f"EXISTS archive.{TABLE_NAME}"))
+        # 移動対象のidを固定してから、コピーと削除を同じトランザクションで行う
+        c.execute("CREATE TEMP TABLE IF NOT EXISTS retention_batch (id INTEGER PRIMARY KEY, in_archive INTEGER)")
+        c.execute("DELETE FROM retention_batch")
+        c.execute(f'''
+        INSERT INTO retention_batch (id)
+        SELECT id FROM {TABLE_NAME}
+        WHERE timestamp < ? AND substr(timestamp, 1, 7) = ?
+        ORDER BY timestamp LIMIT ?
+        ''', (cutoff, month, batch_size))
+        batch_rows = c.execute("SELECT COUNT(*) FROM retention_batch").fetchone()[0]
+        # DBを作り直すとidが1から振り直されるため、アーカイブに同じidがあるかをコピーの前に調べておく
+        c.execute(f"UPDATE retention_batch SET in_archive = id IN (SELECT id FROM archive.{TABLE_NAME})")
+        # idがアーカイブにまだない行はidごとコピーする
+        c.execute(f'''
+        INSERT INTO archive.{TABLE_NAME}
+        SELECT * FROM main.{TABLE_NAME}
+        WHERE id IN (SELECT id FROM retention_batch WHERE in_archive = 0)
+        ''')
+        copied = c.rowcount
+        # アーカイブに同じidがある行は新しいidでコピーする
+        columns = ", ".join(
+            name for _, name, *_ in c.execute(f"PRAGMA main.table_info({TABLE_NAME})") if name != "id"
+        )
+        c.execute(f'''
+        INSERT INTO archive.{TABLE_NAME} ({columns})
+        SELECT {columns} FROM main.{TABLE_NAME}
+        WHERE id IN (SELECT id FROM retention_batch WHERE in_archive = 1)
+        ''')
+        copied += c.rowcount
+        if copied != batch_rows:
+            # コピーできなかった行を削除しないよう、バッチ全体を取り消す
+            raise sqlite3.IntegrityError(f"{batch_rows} 件中 {copied} 件しかアーカイブにコピーできませんでした")
+        c.execute(f"DELETE FROM main.{TABLE_NAME} WHERE id IN (SELECT id FROM retention_batch)")
+        moved = c.rowcount
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        c.execute("DETACH DATABASE archive")
+    return moved
+
+def _ensure_incremental_vacuum(conn):
+    """auto_vacuumをINCREMENTALに設定する（既存DBでは一度だけフルVACUUMが必要）
+
+    Returns:
+        bool: フルVACUUMを実行した場合はTrue
+    """
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if mode != 2:  # 2 = INCREMENTAL
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    return False
+
+def run_maintenance(conn):
+    """インクリメンタルVACUUMとANALYZEを実行し、DBファイルを縮小した場合はTrueを返す"""
+    shrunk = _ensure_incremental_vacuum(conn)
+    # 空きページを少しずつ解放し、他の接続の書き込みを長時間ブロックしないようにする
+    while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+        conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP})").fetchall()
+        conn.commit()
+        shrunk = True
+    conn.execute("ANALYZE")
+    conn.commit()
+    return shrunk
+
+def run_retention(retention_days=RETENTION_DAYS, batch_size=RETENTION_BATCH_SIZE):
+    """保持期間を過ぎた行を小さなバッチで月別アーカイブへ移動し、DBをメンテナンスする"""
+    cutoff = _cutoff_timestamp(retention_days)
+    moved_total = 0
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    try:
+        while True:
+            moved = _move_batch(conn, cutoff, batch_size)
+            if moved == 0:
+                break
+            moved_total += moved
+            bump_table_version()
+        if run_maintenance(conn):
+            # ファイルサイズが変わったので、キャッシュしたドライラン結果を破棄する
+            bump_table_version()
+    finally:
+        conn.close()
+    print(f"Retention: moved {moved_total} rows older than {cutoff}.")  # デバッグ用
+    return moved_total
+
+# --- バックグラウンドジョブ ---
+def _worker_loop(interval_seconds):
+    """一定間隔、またはメンテナンス要求があったときにリテンション処理を実行する"""
+    while True:
+        try:
+            moved = run_retention()
+            _last_run.update(finished_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), moved_rows=moved, error=None)
+        except Exception as e:
+            print(f"Retention job failed: {e}")
+            _last_run.update(finished_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), moved_rows=0, error=str(e))
+        _maintenance_requested.wait(timeout=interval_seconds)
+        _maintenance_requested.clear()
+
+def start_retention_worker(interval_seconds=RETENTION_INTERVAL_SECONDS):
+    """リテンション処理のバックグラウンドスレッドを起動する（プロセスごとに1つ）"""
+    global _worker_thread
+    with _worker_lock:
+        if _worker_thread is None or not _worker_thread.is_alive():
+            _worker_thread = threading.Thread(
+                target=_worker_loop, args=(interval_seconds,), name="retention-worker", daemon=True
+            )
+            _worker_thread.start()
+    return _worker_thread
+
+def request_maintenance():
+    """次のリテンション処理をすぐに実行するようバックグラウンドスレッドに依頼する"""
+    _maintenance_requested.set()
+
+def get_last_run():
+    """直近のリテンション処理の結果を返す"""
+    return dict(_last_run)
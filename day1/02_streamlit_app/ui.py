@@ -1,10 +1,12 @@
 import streamlit as st
 import pandas as pd
 import time
-from database import save_to_db, get_chat_history, get_db_count, clear_db
+from database import save_to_db, get_chat_history, get_db_count, clear_db, get_cache_stats
 from llm import generate_response
 from data import create_sample_evaluation_data
 from metrics import get_metrics_descriptions
+from retention import get_retention_plan, request_maintenance, get_last_run
+from config import RETENTION_DAYS
 import random
 
 # カスタムCSS
@@ -96,6 +98,7 @@ def display_chat_page(pipe):
                 st.session_state.current_question = ""
                 st.session_state.current_answer = ""
                 st.session_state.response_time = 0.0
+                st.session_state.token_usage = {}
                 st.session_state.feedback_given = False
                 st.rerun()
 
@@ -106,6 +109,8 @@ def display_chat_page(pipe):
         st.session_state.current_answer = ""
     if "response_time" not in st.session_state:
         st.session_state.response_time = 0.0
+    if "token_usage" not in st.session_state:
+        st.session_state.token_usage = {}
     if "feedback_given" not in st.session_state:
         st.session_state.feedback_given = False
     if "chat_history" not in st.session_state:
@@ -118,9 +123,10 @@ def display_chat_page(pipe):
         st.session_state.feedback_given = False
 
         with st.spinner("🤔 モデルが回答を生成中..."):
-            answer, response_time = generate_response(pipe, user_question)
+            answer, response_time, token_usage = generate_response(pipe, user_question, st.session_state.chat_history)
             st.session_state.current_answer = answer
             st.session_state.response_time = response_time
+            st.session_state.token_usage = token_usage
             
             # チャット履歴に追加
             st.session_state.chat_history.append({
@@ -149,7 +155,11 @@ def display_chat_page(pipe):
         
         # 最新の回答に対するフィードバック（まだフィードバックされていない場合）
         if not st.session_state.feedback_given and st.session_state.current_answer:
-            st.markdown(f'<p style="font-size:0.8em; color:gray;">応答時間: {st.session_state.response_time:.2f}秒</p>', unsafe_allow_html=True)
+            usage = st.session_state.token_usage
+            usage_text = f" / トークン数: 入力 {usage['prompt_tokens']}・出力 {usage['completion_tokens']}" if usage else ""
+            if usage.get("dropped_turns"):
+                usage_text += f" (古い会話 {usage['dropped_turns']} 往復を省略)"
+            st.markdown(f'<p style="font-size:0.8em; color:gray;">応答時間: {st.session_state.response_time:.2f}秒{usage_text}</p>', unsafe_allow_html=True)
             st.markdown("---")
             st.markdown("### フィードバック")
             st.write("この回答は役に立ちましたか？")
@@ -589,7 +599,11 @@ def display_data_page():
         # 確認ステップ付きのクリアボタン
         if st.button("🗑️ データベースをクリア", key="clear_db_button", use_container_width=True):
             if clear_db():
+                request_maintenance()  # ファイルサイズの縮小はバックグラウンドで行う
                 st.rerun()
+
+    # データ保持（アーカイブ）セクション
+    display_retention_section()
     
     # 評価指標の説明セクション
     st.markdown("### 評価指標の説明")
@@ -626,4 +640,45 @@ def display_data_page():
     3. **データ管理**: テスト用のサンプルデータを追加したり、データベースをクリアできます。
     
     それぞれの評価指標は、回答の品質を異なる視点から測定します。正確性、応答時間、単語数などの指標を組み合わせることで、AIの性能を総合的に評価できます。
-    """)
\ No newline at end of file
+    """)
+
+def display_retention_section():
+    """古い履歴のアーカイブ状況とドライラン結果を表示する"""
+    st.markdown("### データ保持（アーカイブ）")
+    retention_days = st.number_input("保持日数", min_value=1, value=RETENTION_DAYS, step=1, key="retention_days")
+
+    try:
+        report = get_retention_plan(retention_days)
+    except Exception as e:
+        st.error(f"アーカイブ対象の集計中にエラーが発生しました: {e}")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("移動対象の行数", f"{report['rows']} 件")
+    col2.metric("移動対象のサイズ", f"{report['bytes'] / 1024:.1f} KB")
+    col3.metric("DBファイルサイズ", f"{report['db_file_bytes'] / 1024:.1f} KB")
+    st.caption(f"{report['cutoff']} より前の履歴が月別アーカイブへ移動されます（解放可能な空き領域: {report['reclaimable_bytes'] / 1024:.1f} KB）")
+
+    if report["months"]:
+        st.dataframe(pd.DataFrame(report["months"]), use_container_width=True)
+
+    if st.button("🗄️ アーカイブとVACUUMを今すぐ実行", key="run_retention"):
+        request_maintenance()
+        st.info(f"バックグラウンドで実行を開始しました（保持日数は設定値の {RETENTION_DAYS} 日を使用）。")
+
+    last_run = get_last_run()
+    if last_run["finished_at"]:
+        if last_run["error"]:
+            st.warning(f"前回の実行 ({last_run['finished_at']}) は失敗しました: {last_run['error']}")
+        else:
+            st.caption(f"前回の実行: {last_run['finished_at']} ({last_run['moved_rows']} 件を移動)")
+
+# --- デバッグ用サイドバーパネル ---
+def display_cache_debug_panel():
+    """読み取りキャッシュの状態をサイドバーに表示する"""
+    stats = get_cache_stats()
+    with st.sidebar.expander("🛠️ デバッグ: DBキャッシュ"):
+        st.metric("ヒット率", f"{stats['hit_rate']:.1%}")
+        st.caption(f"ヒット: {stats['hits']} / ミス: {stats['misses']}")
+        st.caption(f"エントリ数: {stats['entries']} (テーブルバージョン: {stats['version']})")
+        st.caption(f"メモリ使用量: {stats['memory_bytes'] / 1024:.1f} KB")
@@ -1,27 +1,88 @@
 import os
-import torch
-from transformers import pipeline
+import sys
+import hmac
 import time
 import traceback
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+import asyncio
+import json
+import math
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Header, UploadFile, File, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 import uvicorn
 import nest_asyncio
 from pyngrok import ngrok
 
+# 02_streamlit_appと共有する推論バックエンド（day1/llm_common）を読み込めるようにする
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from llm_common.backends import create_backend
+from llm_common.cancellation import CancellationToken, STOP_DEADLINE
+from model_registry import ModelRegistry, RoutingPolicy
+from model_manager import STATE_NOT_LOADED
+from rate_limit import ClientRateLimiter, WeightedFairQueue, RateLimitExceeded, RequestTooLarge
+from batch_jobs import BatchJobStore, BatchWorker, PriorityGate, JOB_CANCELLED
+
 # --- 設定 ---
 # モデル名を設定
 MODEL_NAME = "google/gemma-2-2b-jpn-it"  # お好みのモデルに変更可能です
 print(f"モデル名を設定: {MODEL_NAME}")
+# 推論バックエンド: "hf" (transformersパイプライン, bfloat16) または "cpu-int8" (CPU向け動的int8量子化)
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "hf")
+# 投機的デコーディング用のドラフトモデル（メインモデルと同じ語彙の小さなモデル）。未設定なら無効
+DRAFT_MODEL_NAME = os.environ.get("DRAFT_MODEL_NAME") or None
+# 管理用エンドポイント（/admin/*）のトークン。未設定なら管理用エンドポイントは無効（503）
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN") or None
+# モデルの準備ができていないときにクライアントへ返す再試行までの秒数
+MODEL_RETRY_AFTER_SECONDS = 10
+# 短いプロンプトを処理する小さなモデル。未設定ならすべてメインモデルで処理する
+SMALL_MODEL_NAME = os.environ.get("SMALL_MODEL_NAME") or None
+# この文字数以下のプロンプトを小さなモデルに送る
+SHORT_PROMPT_CHARS = int(os.environ.get("SHORT_PROMPT_CHARS", "200"))
+# リクエストで指定できる追加のモデル（カンマ区切り）
+EXTRA_MODEL_NAMES = [name.strip() for name in os.environ.get("MODEL_NAMES", "").split(",") if name.strip()]
+# 同時に読み込んでおくモデルのメモリ予算（GB）。未設定なら上限なし
+MODEL_MEMORY_BUDGET_GB = float(os.environ.get("MODEL_MEMORY_BUDGET_GB", "0")) or None
+# バッチジョブの進捗を保存するSQLiteファイル
+BATCH_DB_PATH = os.environ.get("BATCH_DB_PATH", "batch_jobs.db")
+# バッチジョブで1回にまとめて生成するプロンプト数
+BATCH_SIZE = int(os.environ.get("BATCH_SIZE", "8"))
+# 1つのバッチジョブに含められるプロンプトの最大数
+MAX_BATCH_PROMPTS = 100000
+# クライアント（X-API-KeyヘッダーまたはIPアドレス）ごとの生成トークン数の制限
+RATE_LIMIT_TOKENS_PER_MINUTE = int(os.environ.get("RATE_LIMIT_TOKENS_PER_MINUTE", "6000"))
+RATE_LIMIT_BURST_TOKENS = int(os.environ.get("RATE_LIMIT_BURST_TOKENS", "2048"))
+# 1回のリクエストで指定できる max_new_tokens の上限
+MAX_NEW_TOKENS_LIMIT = int(os.environ.get("MAX_NEW_TOKENS_LIMIT", "1024"))
+# 同時に実行する推論の数（これを超えるリクエストは公平キューで待つ）
+INFERENCE_CONCURRENCY = int(os.environ.get("INFERENCE_CONCURRENCY", "1"))
+# リクエストの締め切り（秒）。リクエストで指定がない場合に使う。0なら締め切りなし
+DEFAULT_REQUEST_TIMEOUT_SECONDS = float(os.environ.get("DEFAULT_REQUEST_TIMEOUT_SECONDS", "0"))
+# クライアントの切断を確認する間隔（秒）
+DISCONNECT_POLL_SECONDS = 0.1
+# 取り消しの理由（llm_common.cancellation の STOP_DEADLINE / STOP_CANCELLED に加えて）
+STOP_DISCONNECTED = "disconnected"
+STOP_QUEUE_TIMEOUT = "queue_timeout"
+# クライアントごとの公平キューの重み（例: "team-a:2,team-b:1"）。未指定のクライアントは1
+CLIENT_WEIGHTS = {
+    key.strip(): float(weight)
+    for key, weight in (item.split(":") for item in os.environ.get("CLIENT_WEIGHTS", "").split(",") if ":" in item)
+}
 
 # --- モデル設定クラス ---
 class Config:
-    def __init__(self, model_name=MODEL_NAME):
+    def __init__(self, model_name=MODEL_NAME, backend=INFERENCE_BACKEND, draft_model_name=DRAFT_MODEL_NAME,
+                 small_model_name=SMALL_MODEL_NAME, extra_model_names=EXTRA_MODEL_NAMES):
         self.MODEL_NAME = model_name
+        self.BACKEND = backend
+        self.DRAFT_MODEL_NAME = draft_model_name
+        self.SMALL_MODEL_NAME = small_model_name
+        # リクエストで指定できるモデル（任意のモデルを読み込ませないよう、設定したものに限る）
+        self.AVAILABLE_MODELS = [name for name in [model_name, small_model_name, *extra_model_names] if name]
 
-config = Config(MODEL_NAME)
+config = Config(MODEL_NAME, INFERENCE_BACKEND, DRAFT_MODEL_NAME, SMALL_MODEL_NAME, EXTRA_MODEL_NAMES)
 
 # --- FastAPIアプリケーション定義 ---
 app = FastAPI(
@@ -51,94 +112,111 @@ class SimpleGenerationRequest(BaseModel):
     do_sample: Optional[bool] = True
     temperature: Optional[float] = 0.7
     top_p: Optional[float] = 0.9
+    speculative: Optional[bool] = False  # ドラフトモデルによる投機的デコーディングを使うか
+    model: Optional[str] = None  # 使用するモデル名。未指定ならプロンプトの長さで自動的に選ぶ
+    timeout_seconds: Optional[float] = Field(None, gt=0)  # 受信からの締め切り（秒）。過ぎると途中までの結果を返す
 
 class GenerationResponse(BaseModel):
     generated_text: str
+    model: Optional[str] = None  # 応答を生成したモデル
     response_time: float
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    speculative_stats: Optional[Dict[str, Any]] = None  # 受理率や実効スループット（投機的デコーディング時のみ）
+    truncated: bool = False  # 締め切りにより途中までの結果になっているか
+    stop_reason: Optional[str] = None  # 途中で止まった理由
+
+class BatchGenerationRequest(BaseModel):
+    prompts: List[str]
+    max_new_tokens: Optional[int] = 512
+    do_sample: Optional[bool] = True
+    temperature: Optional[float] = 0.7
+    top_p: Optional[float] = 0.9
+    model: Optional[str] = None  # 使用するモデル名。未指定ならデフォルトモデル
 
-# --- モデル関連の関数 ---
-# モデルのグローバル変数
-model = None
+class ReloadRequest(BaseModel):
+    model_name: str  # 読み込むモデル名
+    set_default: Optional[bool] = True  # 読み込み完了後にデフォルトモデルとして使うか
 
-def load_model():
+# --- モデル関連の関数 ---
+def load_model(model_name=None):
     """推論用のLLMモデルを読み込む"""
-    global model  # グローバル変数を更新するために必要
+    model_name = model_name or config.MODEL_NAME
     try:
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        print(f"使用デバイス: {device}")
-        pipe = pipeline(
-            "text-generation",
-            model=config.MODEL_NAME,
-            model_kwargs={"torch_dtype": torch.bfloat16},
-            device=device
-        )
-        print(f"モデル '{config.MODEL_NAME}' の読み込みに成功しました")
-        model = pipe  # グローバル変数を更新
+        pipe = create_backend(config.BACKEND)
+        print(f"使用デバイス: {pipe.device} (バックエンド: {pipe.name})")
+        pipe.load(model_name)
+        print(f"モデル '{model_name}' の読み込みに成功しました")
+        if config.DRAFT_MODEL_NAME and model_name != config.SMALL_MODEL_NAME:
+            try:
+                pipe.load_draft(config.DRAFT_MODEL_NAME)
+                print(f"ドラフトモデル '{config.DRAFT_MODEL_NAME}' の読み込みに成功しました")
+            except Exception as e:
+                # ドラフトモデルがなくても通常の生成は行えるので続行する
+                print(f"ドラフトモデル '{config.DRAFT_MODEL_NAME}' の読み込みに失敗: {e}")
         return pipe
     except Exception as e:
-        error_msg = f"モデル '{config.MODEL_NAME}' の読み込みに失敗: {e}"
+        error_msg = f"モデル '{model_name}' の読み込みに失敗: {e}"
         print(error_msg)
         traceback.print_exc()  # 詳細なエラー情報を出力
         return None
 
-def extract_assistant_response(outputs, user_prompt):
-    """モデルの出力からアシスタントの応答を抽出する"""
-    assistant_response = ""
-    try:
-        if outputs and isinstance(outputs, list) and len(outputs) > 0 and outputs[0].get("generated_text"):
-            generated_output = outputs[0]["generated_text"]
-            
-            if isinstance(generated_output, list):
-                # メッセージフォーマットの場合
-                if len(generated_output) > 0:
-                    last_message = generated_output[-1]
-                    if isinstance(last_message, dict) and last_message.get("role") == "assistant":
-                        assistant_response = last_message.get("content", "").strip()
-                    else:
-                        # 予期しないリスト形式の場合は最後の要素を文字列として試行
-                        print(f"警告: 最後のメッセージの形式が予期しないリスト形式です: {last_message}")
-                        assistant_response = str(last_message).strip()
-
-            elif isinstance(generated_output, str):
-                # 文字列形式の場合
-                full_text = generated_output
-                
-                # 単純なプロンプト入力の場合、プロンプト後の全てを抽出
-                if user_prompt:
-                    prompt_end_index = full_text.find(user_prompt)
-                    if prompt_end_index != -1:
-                        prompt_end_pos = prompt_end_index + len(user_prompt)
-                        assistant_response = full_text[prompt_end_pos:].strip()
-                    else:
-                        # 元のプロンプトが見つからない場合は、生成されたテキストをそのまま返す
-                        assistant_response = full_text
-                else:
-                    assistant_response = full_text
-            else:
-                print(f"警告: 予期しない出力タイプ: {type(generated_output)}")
-                assistant_response = str(generated_output).strip()  # 文字列に変換
+# 複数モデルの読み込み・切り替えを管理する（単一読み込み、ウォームアップ、ホットリロード、LRU追い出し）
+# デフォルトモデルの切り替えが完了した時点で設定のモデル名も更新する
+model_registry = ModelRegistry(
+    load_model,
+    default_model=config.MODEL_NAME,
+    memory_budget_bytes=int(MODEL_MEMORY_BUDGET_GB * 1024**3) if MODEL_MEMORY_BUDGET_GB else None,
+    on_default_switch=lambda name: setattr(config, "MODEL_NAME", name),
+)
+routing_policy = RoutingPolicy(small_model=config.SMALL_MODEL_NAME, short_prompt_chars=SHORT_PROMPT_CHARS)
+
+# バッチジョブ（SQLiteに進捗を保存し、対話リクエストがない間に処理する）
+priority_gate = PriorityGate()
+batch_store = BatchJobStore(BATCH_DB_PATH)
+
+# 生成トークン数によるレート制限と、推論の前段の重み付き公平キュー
+rate_limiter = ClientRateLimiter(RATE_LIMIT_TOKENS_PER_MINUTE, RATE_LIMIT_BURST_TOKENS, MAX_NEW_TOKENS_LIMIT)
+fair_queue = WeightedFairQueue(concurrency=INFERENCE_CONCURRENCY, weights=CLIENT_WEIGHTS)
+# バッチジョブも /generate と同じレート制限と公平キューを通す
+batch_worker = BatchWorker(
+    batch_store, model_registry, priority_gate, batch_size=BATCH_SIZE, rate_limiter=rate_limiter, fair_queue=fair_queue
+)
 
-    except Exception as e:
-        print(f"応答の抽出中にエラーが発生しました: {e}")
-        traceback.print_exc()
-        assistant_response = "応答の抽出に失敗しました。"  # エラーメッセージを設定
+def client_identity(http_request: Request, x_api_key: Optional[str] = Header(default=None)):
+    """レート制限と公平キューで使うクライアントの識別子（APIキー、なければIPアドレス）"""
+    if x_api_key:
+        return f"key:{x_api_key}"
+    return f"ip:{http_request.client.host if http_request.client else 'unknown'}"
+
+def default_manager():
+    """デフォルトモデルのModelManager"""
+    return model_registry.ensure_loaded(model_registry.default_model)
+
+def peek_default_manager():
+    """デフォルトモデルのModelManager（状態を見るだけで、読み込みは始めない。未登録ならNone）
 
-    if not assistant_response:
-        print("警告: アシスタントの応答を抽出できませんでした。完全な出力:", outputs)
-        # デフォルトまたはエラー応答を返す
-        assistant_response = "応答を生成できませんでした。"
+    ヘルスチェックなどからモデルの読み込みや他のモデルの解放が起きないようにする。
+    """
+    return model_registry.get(model_registry.default_model)
 
-    return assistant_response
+def verify_admin_token(x_admin_token: Optional[str] = Header(default=None)):
+    """管理用エンドポイントの認証（ADMIN_TOKENが未設定なら誰にも使わせない）"""
+    # ngrokで公開されるため、トークンが設定されていない場合は開放せずに拒否する
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="管理用エンドポイントは無効です。環境変数ADMIN_TOKENを設定してください。")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="管理用トークンが正しくありません。")
 
 # --- FastAPIエンドポイント定義 ---
 @app.on_event("startup")
 async def startup_event():
-    """起動時にモデルを初期化"""
-    load_model_task()  # バックグラウンドではなく同期的に読み込む
-    if model is None:
-        print("警告: 起動時にモデルの初期化に失敗しました")
-    else:
-        print("起動時にモデルの初期化が完了しました。")
+    """起動時にモデルの読み込みをバックグラウンドで開始"""
+    # 読み込み中もサーバーは応答できる（準備状態は /health/ready で確認）
+    model_registry.ensure_loaded(config.MODEL_NAME)
+    print("起動時にモデルの読み込みを開始しました。")
+    # 前回の実行で終わっていないバッチジョブがあれば再開する
+    batch_worker.start(loop=asyncio.get_running_loop())
 
 @app.get("/")
 async def root():
@@ -148,42 +226,281 @@ async def root():
 @app.get("/health")
 async def health_check():
     """ヘルスチェックエンドポイント"""
-    global model
+    model_manager = peek_default_manager()
+    model = model_manager.get() if model_manager is not None else None
     if model is None:
-        return {"status": "error", "message": "No model loaded"}
-
-    return {"status": "ok", "model": config.MODEL_NAME}
+        state = model_manager.state if model_manager is not None else STATE_NOT_LOADED
+        return {"status": "error", "message": "No model loaded", "model_state": state}
+
+    return {
+        "status": "ok",
+        "model": model_manager.model_name,
+        "backend": config.BACKEND,
+        "speculative": model.supports_speculative,
+        "model_state": model_manager.state,
+        "available_models": config.AVAILABLE_MODELS,
+    }
+
+@app.get("/health/live")
+async def liveness_check():
+    """プロセスが応答できるかどうか（モデルの状態に関係なく200を返す）"""
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """リクエストを処理できるかどうか（デフォルトモデルの読み込みとウォームアップが完了していれば200）"""
+    model_manager = peek_default_manager()
+    if model_manager is None:
+        status = {"state": STATE_NOT_LOADED, "model": model_registry.default_model}
+        return JSONResponse(status_code=503, content={"status": "not_ready", **status})
+    status = model_manager.status()
+    if not model_manager.is_ready:
+        return JSONResponse(status_code=503, content={"status": "not_ready", **status})
+    return {"status": "ready", **status}
+
+@app.get("/admin/model", dependencies=[Depends(verify_admin_token)])
+async def model_status():
+    """デフォルトモデルの読み込み状態を返す"""
+    model_manager = peek_default_manager()
+    if model_manager is None:
+        return {"state": STATE_NOT_LOADED, "model": model_registry.default_model}
+    return model_manager.status()
+
+@app.get("/models")
+async def list_models():
+    """各モデルの状態と統計（読み込み時間・メモリ使用量・レイテンシ）を返す"""
+    return {"available_models": config.AVAILABLE_MODELS, **model_registry.status()}
+
+@app.get("/usage")
+async def usage(client_id: str = Depends(client_identity)):
+    """呼び出し元のクライアントのレート制限と利用状況を返す"""
+    return {"client": client_id, "limits": rate_limiter.limits(), "usage": rate_limiter.usage(client_id)[client_id]}
+
+@app.get("/admin/usage", dependencies=[Depends(verify_admin_token)])
+async def usage_all():
+    """全クライアントの利用状況と公平キューの状態を返す"""
+    return {"limits": rate_limiter.limits(), "queue": fair_queue.status(), "clients": rate_limiter.usage()}
+
+@app.post("/admin/reload", status_code=202, dependencies=[Depends(verify_admin_token)])
+async def reload_model(request: ReloadRequest):
+    """設定済みのモデルをバックグラウンドで読み込み直し、完了後に切り替える"""
+    # 任意のモデルをダウンロードさせないよう、設定したモデル（MODEL_NAMESなど）に限る
+    if request.model_name not in config.AVAILABLE_MODELS:
+        raise HTTPException(status_code=400, detail=f"未知のモデルです: {request.model_name} (利用可能: {', '.join(config.AVAILABLE_MODELS)})")
+    if not model_registry.reload(request.model_name, set_default=request.set_default):
+        raise HTTPException(status_code=409, detail="このモデルは読み込み中です。完了後に再度お試しください。")
+    # 切り替えが完了するまでは現在のモデルでリクエストを処理する
+    return {"status": "loading", **model_registry.get(request.model_name).status()}
 
 # 簡略化されたエンドポイント
+async def watch_disconnect(http_request, cancel_token):
+    """クライアントが切断したら生成を取り消す"""
+    while not cancel_token.cancelled:
+        if await http_request.is_disconnected():
+            cancel_token.cancel(STOP_DISCONNECTED)
+            return
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
 @app.post("/generate", response_model=GenerationResponse)
-async def generate_simple(request: SimpleGenerationRequest):
-    """単純なプロンプト入力に基づいてテキストを生成"""
-    global model
+async def generate_simple(
+    request: SimpleGenerationRequest,
+    http_request: Request,
+    client_id: str = Depends(client_identity),
+    x_request_timeout: Optional[float] = Header(default=None, gt=0),
+):
+    """単純なプロンプト入力に基づいてテキストを生成
+
+    締め切りはリクエストの timeout_seconds または X-Request-Timeout ヘッダー（秒）で指定する
+    （両方ある場合は短い方）。締め切りを過ぎると生成を止めて途中までの結果を truncated=true で返す。
+    クライアントが切断した場合も生成を止め、推論の枠をすぐに空ける。
+    """
+    timeouts = [t for t in (request.timeout_seconds, x_request_timeout, DEFAULT_REQUEST_TIMEOUT_SECONDS) if t]
+    cancel_token = CancellationToken.with_timeout(min(timeouts) if timeouts else None)
+    if request.model:
+        if request.model not in config.AVAILABLE_MODELS:
+            raise HTTPException(status_code=400, detail=f"未知のモデルです: {request.model} (利用可能: {', '.join(config.AVAILABLE_MODELS)})")
+        model_name = request.model
+    else:
+        model_name = routing_policy.route(request.prompt, model_registry.default_model)
+
+    # 読み込みはバックグラウンドで1回だけ行い、リクエストはブロックしない
+    model_manager = model_registry.ensure_loaded(model_name)
+    if not model_manager.is_ready:
+        print(f"generateエンドポイント: モデル '{model_name}' は読み込み中です。")
+        raise HTTPException(
+            status_code=503,
+            detail=f"モデル '{model_name}' を読み込み中です。後でもう一度お試しください。",
+            headers={"Retry-After": str(MODEL_RETRY_AFTER_SECONDS)},
+        )
 
-    if model is None:
-        print("generateエンドポイント: モデルが読み込まれていません。読み込みを試みます...")
-        load_model_task()  # 再度読み込みを試みる
-        if model is None:
-            print("generateエンドポイント: モデルの読み込みに失敗しました。")
-            raise HTTPException(status_code=503, detail="モデルが利用できません。後でもう一度お試しください。")
+    # 生成トークン数の見積もり（max_new_tokens）でレート制限を確認し、モデルに届く前に拒否する
+    if not request.max_new_tokens or request.max_new_tokens < 1:
+        raise HTTPException(status_code=400, detail="max_new_tokens は1以上を指定してください。")
+    try:
+        rate_limiter.admit(client_id, request.max_new_tokens)
+    except RequestTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+    generated_tokens = 0
+    watcher = asyncio.create_task(watch_disconnect(http_request, cancel_token))
+    try:
+        # 公平キューで順番を待ってから推論する（締め切りまでに順番が来なければ504）
+        async with fair_queue.slot(client_id, request.max_new_tokens, timeout=cancel_token.remaining()):
+            # 待っている間に切断された、または締め切りを過ぎた場合は推論せずに枠を返す
+            reason = cancel_token.should_stop()
+            if reason is not None:
+                model_registry.record_cancellation(model_name, reason)
+                raise HTTPException(status_code=504, detail=f"推論を開始する前に取り消されました ({reason})。")
+            # 対話リクエストの処理中はバッチジョブの処理を待たせる
+            with priority_gate.interactive(), model_manager.acquire() as model:
+                if model is None:
+                    raise HTTPException(
+                        status_code=503,
+                        detail=f"モデル '{model_name}' を読み込み中です。後でもう一度お試しください。",
+                        headers={"Retry-After": str(MODEL_RETRY_AFTER_SECONDS)},
+                    )
+                # 推論はスレッドプールで実行し、その間もヘルスチェックなどに応答できるようにする
+                response = await run_in_threadpool(run_generation, model, request, cancel_token)
+        generated_tokens = response.completion_tokens or 0
+    except asyncio.TimeoutError:
+        model_registry.record_cancellation(model_name, STOP_QUEUE_TIMEOUT)
+        raise HTTPException(status_code=504, detail="締め切りまでに推論を開始できませんでした。")
+    finally:
+        watcher.cancel()
+        # 実際に生成しなかった分のトークンを戻す
+        rate_limiter.settle(client_id, request.max_new_tokens, generated_tokens)
+    model_registry.record(model_name, response.response_time, generated_tokens, stop_reason=response.stop_reason)
+    if response.stop_reason == STOP_DISCONNECTED:
+        print(f"generateエンドポイント: クライアントが切断したため生成を中止しました ({generated_tokens}トークン)")
+    response.model = model_name
+    return response
+
+def create_batch_job(prompts, request, client_id):
+    """バッチジョブを作成し、ワーカーに通知する
+
+    max_new_tokens は /generate と同じ上限で確認し、クライアントがレート制限を超えていれば拒否する。
+    生成トークン数はワーカーがチャンクごとにクライアントのバケットから消費する。
+    """
+    if not prompts:
+        raise HTTPException(status_code=400, detail="プロンプトが空です。")
+    if len(prompts) > MAX_BATCH_PROMPTS:
+        raise HTTPException(status_code=413, detail=f"プロンプトは最大{MAX_BATCH_PROMPTS}件までです。")
+    if request.model and request.model not in config.AVAILABLE_MODELS:
+        raise HTTPException(status_code=400, detail=f"未知のモデルです: {request.model}")
+    if not request.max_new_tokens or request.max_new_tokens < 1:
+        raise HTTPException(status_code=400, detail="max_new_tokens は1以上を指定してください。")
+    try:
+        rate_limiter.check(client_id, request.max_new_tokens)
+    except RequestTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    params = {
+        "max_new_tokens": request.max_new_tokens,
+        "do_sample": request.do_sample,
+        "temperature": request.temperature,
+        "top_p": request.top_p,
+    }
+    job_id = batch_store.create_job(prompts, params, model=request.model, client=client_id)
+    batch_worker.notify()
+    print(f"バッチジョブ {job_id} を作成しました ({len(prompts)}件)")
+    return batch_store.get_job(job_id)
+
+@app.post("/generate/batch", status_code=202)
+async def generate_batch(request: BatchGenerationRequest, client_id: str = Depends(client_identity)):
+    """プロンプトのリストをバッチジョブとして登録し、ジョブIDを返す"""
+    return create_batch_job(request.prompts, request, client_id)
+
+@app.post("/generate/batch/upload", status_code=202)
+async def generate_batch_upload(
+    file: UploadFile = File(...),
+    max_new_tokens: int = 512,
+    do_sample: bool = True,
+    temperature: float = 0.7,
+    top_p: float = 0.9,
+    model: Optional[str] = None,
+    client_id: str = Depends(client_identity),
+):
+    """JSONLファイル（1行に {"prompt": ...} または文字列）をバッチジョブとして登録する"""
+    prompts = []
+    for line_no, line in enumerate((await file.read()).decode("utf-8").splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail=f"{line_no}行目がJSONとして読み込めません。")
+        prompt = item.get("prompt") if isinstance(item, dict) else item
+        if not isinstance(prompt, str):
+            raise HTTPException(status_code=400, detail=f"{line_no}行目にプロンプト（文字列）がありません。")
+        prompts.append(prompt)
+    request = BatchGenerationRequest(
+        prompts=[], max_new_tokens=max_new_tokens, do_sample=do_sample, temperature=temperature, top_p=top_p, model=model
+    )
+    return create_batch_job(prompts, request, client_id)
+
+def get_batch_job_or_404(job_id):
+    job = batch_store.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"ジョブが見つかりません: {job_id}")
+    return job
+
+@app.get("/generate/batch/{job_id}")
+async def batch_job_status(job_id: str):
+    """バッチジョブの状態と進捗を返す"""
+    return get_batch_job_or_404(job_id)
+
+@app.get("/generate/batch/{job_id}/results")
+async def batch_job_results(job_id: str):
+    """処理済みの結果をJSONLでストリーミングする（処理中のジョブでは途中までの結果）"""
+    get_batch_job_or_404(job_id)
+    lines = (json.dumps(row, ensure_ascii=False) + "\n" for row in batch_store.iter_results(job_id))
+    return StreamingResponse(
+        lines,
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{job_id}.jsonl"'},
+    )
+
+@app.delete("/generate/batch/{job_id}")
+async def cancel_batch_job(job_id: str):
+    """バッチジョブを取り消す（処理済みの結果は残る）"""
+    get_batch_job_or_404(job_id)
+    # 待機中・実行中のジョブだけを取り消す（完了したジョブはそのまま）
+    batch_store.set_status(job_id, JOB_CANCELLED)
+    return batch_store.get_job(job_id)
+
+def run_generation(model, request, cancel_token=None):
+    """取得済みのモデルでテキストを生成する（cancel_token で途中で止められる）"""
+    if request.speculative and not model.supports_speculative:
+        raise HTTPException(status_code=400, detail="ドラフトモデルが読み込まれていないため、投機的デコーディングを使用できません。")
 
     try:
         start_time = time.time()
         print(f"シンプルなリクエストを受信: prompt={request.prompt[:100]}..., max_new_tokens={request.max_new_tokens}")  # 長いプロンプトは切り捨て
 
-        # プロンプトテキストで直接応答を生成
+        # プロンプトテキストで直接応答を生成（生成されたトークンのみをデコード）
         print("モデル推論を開始...")
-        outputs = model(
+        result = model.generate_text(
             request.prompt,
             max_new_tokens=request.max_new_tokens,
             do_sample=request.do_sample,
             temperature=request.temperature,
             top_p=request.top_p,
+            speculative=request.speculative,
+            cancel_token=cancel_token,
         )
-        print("モデル推論が完了しました。")
-
-        # アシスタント応答を抽出
-        assistant_response = extract_assistant_response(outputs, request.prompt)
+        if result.truncated:
+            print(f"生成を途中で止めました (理由: {result.stop_reason})")
+        if result.stats:
+            print(f"投機的デコーディング: 受理率 {result.stats['acceptance_rate']:.1%}, {result.stats['tokens_per_sec']:.1f} tokens/sec")
+        print(f"モデル推論が完了しました。(入力: {result.prompt_tokens}トークン, 出力: {result.completion_tokens}トークン)")
+
+        assistant_response = result.text
+        if not assistant_response and not result.truncated:
+            print("警告: アシスタントの応答を抽出できませんでした。生成結果:", result)
+            assistant_response = "応答を生成できませんでした。"
         print(f"抽出されたアシスタント応答: {assistant_response[:100]}...")  # 長い場合は切り捨て
 
         end_time = time.time()
@@ -192,7 +509,12 @@ async def generate_simple(request: SimpleGenerationRequest):
 
         return GenerationResponse(
             generated_text=assistant_response,
-            response_time=response_time
+            response_time=response_time,
+            prompt_tokens=result.prompt_tokens,
+            completion_tokens=result.completion_tokens,
+            speculative_stats=result.stats or None,
+            truncated=result.truncated,
+            stop_reason=result.stop_reason,
         )
 
     except Exception as e:
@@ -200,18 +522,6 @@ async def generate_simple(request: SimpleGenerationRequest):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"応答の生成中にエラーが発生しました: {str(e)}")
 
-def load_model_task():
-    """モデルを読み込むバックグラウンドタスク"""
-    global model
-    print("load_model_task: モデルの読み込みを開始...")
-    # load_model関数を呼び出し、結果をグローバル変数に設定
-    loaded_pipe = load_model()
-    if loaded_pipe:
-        model = loaded_pipe  # グローバル変数を更新
-        print("load_model_task: モデルの読み込みが完了しました。")
-    else:
-        print("load_model_task: モデルの読み込みに失敗しました。")
-
 print("FastAPIエンドポイントを定義しました。")
 
 # --- ngrokでAPIサーバーを実行する関数 ---
@@ -0,0 +1,359 @@
+# batch_jobs.py
+# オフライン向けのバッチ生成ジョブ（SQLiteへの進捗保存・再起動時の再開・対話リクエストの優先）
+import json
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+
+# ジョブの状態
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_CANCELLED = "cancelled"
+
+# クライアントが記録されていないジョブ（以前のバージョンで作られたもの）のレート制限の単位
+DEFAULT_CLIENT = "batch"
+
+# 各プロンプトの状態
+ITEM_PENDING = "pending"
+ITEM_DONE = "done"
+ITEM_FAILED = "failed"
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS batch_jobs
+(id TEXT PRIMARY KEY,
+ status TEXT,
+ model TEXT,
+ params TEXT,          -- 生成パラメータ（JSON）
+ total INTEGER,
+ created_at TEXT,
+ updated_at TEXT,
+ client TEXT);         -- レート制限と公平キューの単位（X-API-KeyまたはIPアドレス）
+CREATE TABLE IF NOT EXISTS batch_items
+(job_id TEXT,
+ idx INTEGER,
+ prompt TEXT,
+ status TEXT,
+ generated_text TEXT,
+ prompt_tokens INTEGER,
+ completion_tokens INTEGER,
+ error TEXT,
+ PRIMARY KEY (job_id, idx));
+'''
+
+
+def _now():
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class BatchJobStore:
+    """バッチジョブとプロンプトごとの結果をSQLiteに保存する
+
+    プロンプトは処理したチャンクごとにコミットするため、プロセスが再起動しても
+    未処理（pending）のプロンプトから再開できる。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(batch_jobs)")]
+            if "client" not in columns:  # client 列がなかったころのデータベース
+                conn.execute("ALTER TABLE batch_jobs ADD COLUMN client TEXT")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create_job(self, prompts, params, model=None, client=None):
+        """ジョブを作成してIDを返す"""
+        job_id = uuid.uuid4().hex
+        now = _now()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO batch_jobs (id, status, model, params, total, created_at, updated_at, client) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, JOB_QUEUED, model, json.dumps(params), len(prompts), now, now, client),
+            )
+            conn.executemany(
+                "INSERT INTO batch_items (job_id, idx, prompt, status) VALUES (?, ?, ?, ?)",
+                [(job_id, i, prompt, ITEM_PENDING) for i, prompt in enumerate(prompts)],
+            )
+        return job_id
+
+    def get_job(self, job_id):
+        """ジョブの状態と進捗を返す（存在しなければNone）"""
+        with self._connect() as conn:
+            job = conn.execute("SELECT * FROM batch_jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM batch_items WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+            tokens = conn.execute(
+                "SELECT COALESCE(SUM(completion_tokens), 0) FROM batch_items WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+        done = counts.get(ITEM_DONE, 0)
+        failed = counts.get(ITEM_FAILED, 0)
+        return {
+            "job_id": job["id"],
+            "status": job["status"],
+            "model": job["model"],
+            "client": job["client"],
+            "params": json.loads(job["params"]),
+            "total": job["total"],
+            "completed": done,
+            "failed": failed,
+            "pending": counts.get(ITEM_PENDING, 0),
+            "progress": (done + failed) / job["total"] if job["total"] else 1.0,
+            "completion_tokens": tokens,
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+        }
+
+    def set_status(self, job_id, status, from_statuses=(JOB_QUEUED, JOB_RUNNING)):
+        """ジョブが from_statuses のどれかの状態のときだけ状態を変え、変えたかどうかを返す
+
+        状態の確認と更新を1つのUPDATEで行うため、ワーカーの更新が同時に届いた取り消しを上書きしない。
+        """
+        placeholders = ", ".join("?" * len(from_statuses))
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE batch_jobs SET status = ?, updated_at = ? WHERE id = ? AND status IN ({placeholders})",
+                (status, _now(), job_id, *from_statuses),
+            )
+        return cursor.rowcount > 0
+
+    def is_active(self, job_id):
+        """ジョブが待機中または実行中か（取り消されていないか）"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT status FROM batch_jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is not None and row["status"] in (JOB_QUEUED, JOB_RUNNING)
+
+    def next_active_job(self, exclude=()):
+        """処理すべきジョブ（実行中を優先し、次に古い順）を (ID, モデル, パラメータ, クライアント) で返す
+
+        exclude に含まれるジョブ（レート制限の回復待ちなど）は飛ばす。
+        """
+        placeholders = ", ".join("?" * len(exclude))
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, model, params, client FROM batch_jobs WHERE status IN (?, ?) "
+                f"AND id NOT IN ({placeholders}) "
+                "ORDER BY status = ? DESC, created_at, rowid LIMIT 1",
+                (JOB_RUNNING, JOB_QUEUED, *exclude, JOB_RUNNING),
+            ).fetchone()
+        if row is None:
+            return None
+        return row["id"], row["model"], json.loads(row["params"]), row["client"] or DEFAULT_CLIENT
+
+    def pending_items(self, job_id, limit):
+        """未処理のプロンプトを (idx, prompt) のリストで返す"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT idx, prompt FROM batch_items WHERE job_id = ? AND status = ? ORDER BY idx LIMIT ?",
+                (job_id, ITEM_PENDING, limit),
+            ).fetchall()
+        return [(row["idx"], row["prompt"]) for row in rows]
+
+    def save_results(self, job_id, results):
+        """チャンクの結果をまとめて保存する
+
+        Args:
+            results (list): (idx, GenerationResult または None, エラーメッセージ) のリスト
+        """
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE batch_items SET status = ?, generated_text = ?, prompt_tokens = ?, "
+                "completion_tokens = ?, error = ? WHERE job_id = ? AND idx = ?",
+                [
+                    (
+                        ITEM_DONE if result is not None else ITEM_FAILED,
+                        result.text if result is not None else None,
+                        result.prompt_tokens if result is not None else None,
+                        result.completion_tokens if result is not None else None,
+                        error,
+                        job_id,
+                        idx,
+                    )
+                    for idx, result, error in results
+                ],
+            )
+            conn.execute("UPDATE batch_jobs SET updated_at = ? WHERE id = ?", (_now(), job_id))
+
+    def iter_results(self, job_id, chunk_size=500):
+        """処理済みのプロンプトの結果を idx 順に少しずつ読み出す"""
+        last_idx = -1
+        while True:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT idx, prompt, status, generated_text, prompt_tokens, completion_tokens, error "
+                    "FROM batch_items WHERE job_id = ? AND idx > ? AND status != ? ORDER BY idx LIMIT ?",
+                    (job_id, last_idx, ITEM_PENDING, chunk_size),
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+            last_idx = rows[-1]["idx"]
+
+
+class PriorityGate:
+    """対話リクエスト（/generate）をバッチ処理より優先させる
+
+    対話リクエストは interactive() の間を処理中として数える。バッチ処理は各チャンクの前に
+    wait_for_idle() を呼び、対話リクエストがなくなるまで待つ。負荷が続いてもバッチ処理が
+    止まり続けないよう、待ち時間には上限を設ける。
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._active = 0
+
+    @contextmanager
+    def interactive(self):
+        with self._condition:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active -= 1
+                self._condition.notify_all()
+
+    def wait_for_idle(self, timeout):
+        """対話リクエストがなくなるまで最大 timeout 秒待つ。待った秒数を返す"""
+        start = time.perf_counter()
+        with self._condition:
+            self._condition.wait_for(lambda: self._active == 0, timeout=timeout)
+        return time.perf_counter() - start
+
+
+class BatchWorker:
+    """バックグラウンドスレッドでバッチジョブを順に処理する
+
+    プロンプトは batch_size 件ずつまとめて生成し（backend.generate_batch）、チャンクごとに保存する。
+    rate_limiter（rate_limit.ClientRateLimiter）を指定すると、各チャンクの生成トークン数の見積もり
+    （件数 × max_new_tokens）をジョブのクライアントのバケットから消費する。足りない場合はそのジョブを
+    回復するまで後回しにして、他のジョブを処理する。1チャンクの見積もりがバケットの容量
+    （1回の /generate の上限）を超えないよう、チャンクの件数を減らす。
+    fair_queue（rate_limit.WeightedFairQueue）を指定すると、各チャンクは /generate と同じ
+    公平キューで実行枠を待つ。
+    """
+
+    def __init__(self, store, registry, gate, batch_size=8, max_yield_seconds=30.0, poll_interval=1.0,
+                 rate_limiter=None, fair_queue=None):
+        self.store = store
+        self.registry = registry  # ModelRegistry
+        self.gate = gate
+        self.batch_size = batch_size
+        self.max_yield_seconds = max_yield_seconds
+        self.poll_interval = poll_interval
+        self.rate_limiter = rate_limiter
+        self.fair_queue = fair_queue
+        self._loop = None  # 公平キューを操作するイベントループ
+        self._deferred = {}  # {ジョブID: 再開できる時刻（time.monotonic）} レート制限の回復待ち
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self, loop=None):
+        """ワーカーを起動する（前回の実行で残ったジョブも再開される）
+
+        公平キューを使う場合は、それを使うイベントループ（loop）を渡す。
+        """
+        self._loop = loop
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="batch-worker", daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        """新しいジョブが追加されたことを知らせる"""
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                now = time.monotonic()
+                self._deferred = {job_id: t for job_id, t in self._deferred.items() if t > now}
+                job = self.store.next_active_job(exclude=list(self._deferred))
+                if job is None:
+                    wait = min([self.poll_interval, *(t - now for t in self._deferred.values())])
+                    self._wakeup.wait(wait)
+                    self._wakeup.clear()
+                    continue
+                self._process_chunk(*job)
+            except Exception as e:
+                print(f"バッチ処理中にエラーが発生しました: {e}")
+                traceback.print_exc()
+                time.sleep(self.poll_interval)
+
+    @contextmanager
+    def _slot(self, client, cost):
+        """公平キューの実行枠（公平キューを使わない場合は何もしない）"""
+        if self.fair_queue is None or self._loop is None:
+            yield
+            return
+        with self.fair_queue.slot_from_thread(self._loop, client, cost):
+            yield
+
+    def _process_chunk(self, job_id, model_name, params, client=DEFAULT_CLIENT):
+        """ジョブの未処理のプロンプトを1チャンク分処理する"""
+        max_new_tokens = params.get("max_new_tokens", 0)
+        chunk_size = self.batch_size
+        if self.rate_limiter is not None and max_new_tokens:
+            # 1チャンクの見積もりを1回の /generate の上限（バケットの容量）以下にする
+            chunk_size = max(1, min(chunk_size, self.rate_limiter.burst_tokens // max_new_tokens))
+        items = self.store.pending_items(job_id, chunk_size)
+        if not items:
+            if self.store.set_status(job_id, JOB_COMPLETED):
+                print(f"バッチジョブ {job_id} が完了しました")
+            return
+        if not self.store.set_status(job_id, JOB_RUNNING):
+            return  # next_active_job の後に取り消された
+
+        manager = self.registry.ensure_loaded(model_name or self.registry.default_model)
+        if not manager.wait_until_ready(timeout=self.poll_interval * 10):
+            return  # 読み込みが終わるまで次のループで再試行する
+
+        self.gate.wait_for_idle(self.max_yield_seconds)
+        prompts = [prompt for _, prompt in items]
+        # 生成トークン数の見積もり。レート制限と公平キューのコストに使う
+        reserved = len(items) * max_new_tokens
+        if self.rate_limiter is not None:
+            retry_after = self.rate_limiter.reserve(client, reserved)
+            if retry_after:
+                # 待たずに他のジョブを処理し、バケットが回復したら再開する
+                self._deferred[job_id] = time.monotonic() + retry_after
+                return
+        results = []
+        try:
+            with self._slot(client, reserved), manager.acquire() as model:
+                if model is None:
+                    return
+                if not self.store.is_active(job_id):
+                    return  # 公平キューの順番を待っている間に取り消された
+                start = time.perf_counter()
+                try:
+                    generated = model.generate_batch(prompts, **params)
+                    results = [(idx, result, None) for (idx, _), result in zip(items, generated)]
+                except Exception as e:
+                    # まとめて生成できなかった場合は1件ずつ生成し、失敗したものだけを記録する
+                    print(f"バッチ生成に失敗したため1件ずつ生成します: {e}")
+                    results = []
+                    for idx, prompt in items:
+                        try:
+                            results.append((idx, model.generate_text(prompt, **params), None))
+                        except Exception as item_error:
+                            results.append((idx, None, str(item_error)))
+                elapsed = time.perf_counter() - start
+        finally:
+            tokens = sum(result.completion_tokens for _, result, _ in results if result is not None)
+            if self.rate_limiter is not None:
+                # 実際に生成しなかった分のトークンを戻す
+                self.rate_limiter.settle(client, reserved, tokens)
+        self.store.save_results(job_id, results)
+        print(f"バッチジョブ {job_id}: {len(items)}件を処理 ({tokens / elapsed if elapsed else 0:.1f} tokens/sec)")
@@ -0,0 +1,163 @@
+# model_manager.py
+# モデルのライフサイクル管理（単一読み込み・ウォームアップ・準備状態・ホットリロード）
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+# モデルの状態
+STATE_NOT_LOADED = "not_loaded"
+STATE_LOADING = "loading"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+WARMUP_PROMPT = "こんにちは"
+
+
+class ModelManager:
+    """推論モデルの読み込みと切り替えを管理する
+
+    - 読み込みはロックで保護し、同時に複数の読み込みが走らないようにする（single-flight）
+    - 読み込み後にウォームアップ生成を行い、カーネルやキャッシュを初期化してから公開する
+    - ホットリロードでは新しいモデルをバックグラウンドで読み込み、完了後に参照を差し替える。
+      処理中のリクエストは取得済みの古いモデルで最後まで処理される
+    """
+
+    def __init__(self, loader, warmup_tokens=8, on_switch=None):
+        self._loader = loader  # loader(model_name) -> 推論バックエンド
+        self._on_switch = on_switch  # on_switch(model_name): 切り替え完了時に呼ばれる
+        self._warmup_tokens = warmup_tokens
+        self._lock = threading.Lock()
+        self._loading_thread = None
+        self._ready_event = threading.Event()
+        self._backend = None
+        self._in_flight = 0
+        self.model_name = None
+        self.state = STATE_NOT_LOADED
+        self.loading_model_name = None
+        self.last_error = None
+        self.load_time = None
+        self.loaded_at = None
+        self.memory_bytes = None
+
+    # --- 読み込み ---
+    def _warmup(self, backend):
+        """ダミーの生成を1回行い、初回リクエストの遅延をなくす"""
+        start = time.time()
+        backend.generate_text(WARMUP_PROMPT, max_new_tokens=self._warmup_tokens, do_sample=False)
+        print(f"ウォームアップ生成が完了しました ({time.time() - start:.2f}秒)")
+
+    def _load(self, model_name):
+        """モデルを読み込み、ウォームアップしてから差し替える（バックグラウンドスレッドで実行）"""
+        start = time.time()
+        try:
+            backend = self._loader(model_name)
+            if backend is None:
+                raise RuntimeError(f"モデル '{model_name}' の読み込みに失敗しました")
+            self._warmup(backend)
+        except Exception as e:
+            traceback.print_exc()
+            with self._lock:
+                self.last_error = str(e)
+                self.loading_model_name = None
+                # 既存のモデルがあればそれを使い続ける
+                self.state = STATE_READY if self._backend is not None else STATE_FAILED
+            self._ready_event.set()
+            return
+
+        with self._lock:
+            # 参照の差し替えはロック内で一度に行う（アトミックな切り替え）
+            self._backend = backend
+            self.model_name = model_name
+            self.loading_model_name = None
+            self.state = STATE_READY
+            self.last_error = None
+            self.load_time = time.time() - start
+            self.loaded_at = time.strftime("%Y-%m-%d %H:%M:%S")
+            self.memory_bytes = backend.memory_bytes()
+        self._ready_event.set()
+        if self._on_switch is not None:
+            self._on_switch(model_name)
+        print(f"モデル '{model_name}' を公開しました (読み込み+ウォームアップ: {self.load_time:.2f}秒)")
+
+    def start_loading(self, model_name):
+        """バックグラウンドでモデルの読み込みを開始する
+
+        すでに読み込み中の場合は新しい読み込みを開始せず False を返す。
+        """
+        with self._lock:
+            if self._loading_thread is not None and self._loading_thread.is_alive():
+                return False
+            self.loading_model_name = model_name
+            if self._backend is None:
+                self.state = STATE_LOADING
+                self._ready_event.clear()
+            self._loading_thread = threading.Thread(
+                target=self._load, args=(model_name,), name="model-loader", daemon=True
+            )
+            self._loading_thread.start()
+            return True
+
+    def unload(self):
+        """処理中のリクエストがなければモデルを解放する（LRUによる追い出しで使う）
+
+        読み込み中または処理中のリクエストがある場合は何もせず False を返す。
+        """
+        with self._lock:
+            if self._backend is None or self._in_flight > 0 or self.is_loading:
+                return False
+            backend = self._backend
+            self._backend = None
+            self.state = STATE_NOT_LOADED
+            self._ready_event.clear()
+        backend.unload()
+        print(f"モデル '{self.model_name}' を解放しました")
+        return True
+
+    def wait_until_ready(self, timeout=None):
+        """モデルが利用可能になるまで待つ"""
+        self._ready_event.wait(timeout)
+        return self.is_ready
+
+    # --- 状態 ---
+    @property
+    def is_ready(self):
+        return self.state == STATE_READY and self._backend is not None
+
+    @property
+    def is_loading(self):
+        return self.loading_model_name is not None
+
+    def get(self):
+        """現在のモデルを返す（未準備ならNone）"""
+        return self._backend
+
+    @contextmanager
+    def acquire(self):
+        """リクエスト処理中に使うモデルを取得する
+
+        取得した参照はリクエストの終了まで有効なため、途中でホットリロードが
+        完了しても処理中のリクエストは中断されない。
+        """
+        with self._lock:
+            backend = self._backend
+            self._in_flight += 1
+        try:
+            yield backend
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def status(self):
+        """状態を辞書で返す"""
+        with self._lock:
+            return {
+                "state": self.state,
+                "model": self.model_name,
+                "loading_model": self.loading_model_name,
+                "in_flight_requests": self._in_flight,
+                "load_time": self.load_time,
+                "loaded_at": self.loaded_at,
+                "memory_bytes": self.memory_bytes,
+                "last_error": self.last_error,
+            }
@@ -0,0 +1,200 @@
+# model_registry.py
+# 複数モデルの管理（メモリ予算内でのLRU追い出し・ルーティング・モデルごとの統計）
+import gc
+import statistics
+import threading
+from collections import OrderedDict, deque
+from model_manager import ModelManager
+
+# モデルごとに保持するレイテンシの件数（パーセンタイル計算用）
+LATENCY_WINDOW = 1000
+
+
+class RoutingPolicy:
+    """モデル名の指定がないリクエストの送り先を決める
+
+    短いプロンプトは小さなモデルに、長いプロンプトはメインモデルに送る。
+    モデルを読み込む前でも判定できるよう、プロンプトの長さは文字数で測る。
+    """
+
+    def __init__(self, small_model=None, short_prompt_chars=200):
+        self.small_model = small_model
+        self.short_prompt_chars = short_prompt_chars
+
+    def route(self, prompt, default_model):
+        if self.small_model and len(prompt) <= self.short_prompt_chars:
+            return self.small_model
+        return default_model
+
+
+class ModelRegistry:
+    """複数のモデルを ModelManager ごとに保持し、メモリ予算を超えたら古いものから解放する
+
+    - 各モデルは要求されたときにバックグラウンドで読み込まれる（解放後も同様に再読み込み）
+    - 読み込み済みモデルの合計メモリが memory_budget_bytes を超えると、最近使われていない
+      モデルから解放する。デフォルトモデルと処理中のリクエストがあるモデルは解放しない
+    - モデルごとに読み込み時間・メモリ使用量・レイテンシを記録する
+    """
+
+    def __init__(self, loader, default_model, memory_budget_bytes=None, on_default_switch=None):
+        self._loader = loader  # loader(model_name) -> 推論バックエンド
+        self._on_default_switch = on_default_switch  # on_default_switch(model_name)
+        self._lock = threading.Lock()
+        self._managers = OrderedDict()  # {モデル名: ModelManager}（末尾ほど最近使われた）
+        self._stats = {}
+        self._pending_default = None
+        self.default_model = default_model
+        self.memory_budget_bytes = memory_budget_bytes
+
+    # --- 内部処理 ---
+    def _get_or_create(self, model_name):
+        """ModelManagerを取得する（なければ作成）。ロックを取得した状態で呼ぶ"""
+        if model_name not in self._managers:
+            self._managers[model_name] = ModelManager(self._loader, on_switch=self._on_loaded)
+            self._stats[model_name] = {
+                "loads": 0,
+                "evictions": 0,
+                "requests": 0,
+                "completion_tokens": 0,
+                "generation_time": 0.0,
+                "latencies": deque(maxlen=LATENCY_WINDOW),
+                "memory_bytes": None,  # 最後に読み込んだときの値（再読み込み前の追い出し判定に使う）
+                "cancellations": {},  # {理由: 件数}（締め切り・切断などで途中で止めたリクエスト）
+            }
+        return self._managers[model_name]
+
+    def _loaded_bytes(self):
+        """読み込み済み（または読み込み中）のモデルの合計メモリ。ロックを取得した状態で呼ぶ"""
+        return sum(
+            self._stats[name]["memory_bytes"] or 0
+            for name, manager in self._managers.items()
+            if manager.get() is not None or manager.is_loading
+        )
+
+    def _evict(self, extra_bytes=0, exclude=None):
+        """合計メモリ + extra_bytes が予算内に収まるまで、古いモデルから解放する"""
+        if not self.memory_budget_bytes:
+            return []
+        evicted = []
+        with self._lock:
+            for name, manager in list(self._managers.items()):
+                if self._loaded_bytes() + extra_bytes <= self.memory_budget_bytes:
+                    break
+                if name in (exclude, self.default_model):
+                    continue
+                if manager.unload():
+                    self._stats[name]["evictions"] += 1
+                    evicted.append(name)
+        if evicted:
+            gc.collect()
+            print(f"メモリ予算を超えたため解放したモデル: {', '.join(evicted)}")
+        return evicted
+
+    def _on_loaded(self, model_name):
+        """読み込み完了時に ModelManager から呼ばれる"""
+        with self._lock:
+            manager = self._managers[model_name]
+            stats = self._stats[model_name]
+            stats["loads"] += 1
+            stats["memory_bytes"] = manager.memory_bytes
+            switch_default = self._pending_default == model_name
+            if switch_default:
+                self.default_model = model_name
+                self._pending_default = None
+        self._evict(exclude=model_name)
+        if switch_default and self._on_default_switch is not None:
+            self._on_default_switch(model_name)
+
+    # --- 公開API ---
+    def get(self, model_name):
+        """ModelManagerを返す（未登録ならNone）"""
+        with self._lock:
+            return self._managers.get(model_name)
+
+    def ensure_loaded(self, model_name):
+        """モデルを最近使ったものとして記録し、未読み込みなら読み込みを開始する
+
+        Returns:
+            ModelManager: 準備できているかは is_ready で確認する
+        """
+        with self._lock:
+            manager = self._get_or_create(model_name)
+            self._managers.move_to_end(model_name)
+            needs_load = manager.get() is None and not manager.is_loading
+            expected_bytes = self._stats[model_name]["memory_bytes"] or 0
+        if needs_load:
+            # 以前に読み込んだことがあり大きさが分かっている場合は、先に空きを作る
+            if expected_bytes:
+                self._evict(extra_bytes=expected_bytes, exclude=model_name)
+            manager.start_loading(model_name)
+        return manager
+
+    def reload(self, model_name, set_default=True):
+        """モデルをバックグラウンドで（再）読み込みする
+
+        set_default が True の場合、読み込み完了後にデフォルトモデルを切り替える。
+        すでに読み込み中の場合は False を返す。
+        """
+        with self._lock:
+            manager = self._get_or_create(model_name)
+            self._managers.move_to_end(model_name)
+            if set_default and model_name != self.default_model:
+                self._pending_default = model_name
+        if not manager.start_loading(model_name):
+            with self._lock:
+                if self._pending_default == model_name:
+                    self._pending_default = None
+            return False
+        return True
+
+    def record(self, model_name, latency, completion_tokens=0, stop_reason=None):
+        """リクエストのレイテンシと生成トークン数を記録する（途中で止まった場合はその理由も）"""
+        with self._lock:
+            stats = self._stats[model_name]
+            stats["requests"] += 1
+            stats["completion_tokens"] += completion_tokens
+            stats["generation_time"] += latency
+            stats["latencies"].append(latency)
+        if stop_reason is not None:
+            self.record_cancellation(model_name, stop_reason)
+
+    def record_cancellation(self, model_name, reason):
+        """取り消されたリクエストを理由ごとに数える"""
+        with self._lock:
+            cancellations = self._stats[model_name]["cancellations"]
+            cancellations[reason] = cancellations.get(reason, 0) + 1
+
+    def status(self):
+        """各モデルの状態と統計を辞書で返す"""
+        with self._lock:
+            items = list(self._managers.items())
+            stats = {
+                name: {**self._stats[name], "cancellations": dict(self._stats[name]["cancellations"])}
+                for name, _ in items
+            }
+            loaded_bytes = self._loaded_bytes()
+        models = {}
+        for name, manager in items:
+            s = stats[name]
+            latencies = sorted(s.pop("latencies"))
+            generation_time = s.pop("generation_time")
+            latency = None
+            if latencies:
+                latency = {
+                    "mean": statistics.fmean(latencies),
+                    "p50": latencies[len(latencies) // 2],
+                    "p95": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+                    "max": latencies[-1],
+                }
+            models[name] = {
+                **manager.status(),
+                **s,
+                "latency": latency,
+                "tokens_per_sec": s["completion_tokens"] / generation_time if generation_time else None,
+            }
+        return {
+            "default_model": self.default_model,
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "loaded_bytes": loaded_bytes,
+            "models": models,
+        }
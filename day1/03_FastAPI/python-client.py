@@ -1,7 +1,12 @@
 # python_client.py
 # このコードは、ngrokで公開されたAPIにアクセスするPythonクライアントの例です
 
+import argparse
+import asyncio
+import random
+import statistics
 import requests
+import httpx
 import json
 import time
 
@@ -64,24 +69,254 @@ class LLMClient:
         else:
             raise Exception(f"API error: {response.status_code} - {response.text}")
 
+# 再試行する HTTP ステータス（モデル読み込み中・レート制限）
+RETRY_STATUS_CODES = (429, 503)
+
+
+class AsyncLLMClient:
+    """asyncio 版の LLM API クライアント
+
+    - httpx.AsyncClient のコネクションプールで接続を再利用する
+    - 同時に送るリクエスト数を concurrency で制限する
+    - 503/429 と接続エラーは指数バックオフ（Retry-After ヘッダーがあればその秒数）で再試行する
+    - 各リクエストのクライアント側のレイテンシ内訳を結果の "latency" に付ける
+
+    使用例:
+        async with AsyncLLMClient(url, concurrency=8) as client:
+            results = await client.generate_many(["質問1", "質問2"])
+    """
+
+    def __init__(self, api_url, concurrency=8, max_retries=3, backoff_base=0.5, backoff_max=10.0, timeout=300.0):
+        """
+        初期化
+
+        Args:
+            api_url (str): API のベース URL（ngrok URL または http://localhost:8501 など）
+            concurrency (int, optional): 同時に送るリクエストの最大数（コネクションプールの大きさ）
+            max_retries (int, optional): 503/429・接続エラー時の最大再試行回数
+            backoff_base (float, optional): 再試行の待ち時間の基準（秒）。試行ごとに2倍になる
+            backoff_max (float, optional): 再試行の待ち時間の上限（秒）
+            timeout (float, optional): 1回のリクエストのタイムアウト（秒）
+        """
+        self.api_url = api_url.rstrip('/')
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=self.api_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """コネクションプールを閉じる"""
+        await self._client.aclose()
+
+    async def health_check(self):
+        """
+        ヘルスチェック
+
+        Returns:
+            dict: ヘルスチェック結果
+        """
+        response = await self._client.get("/health")
+        return response.json()
+
+    def _backoff(self, attempt, response=None):
+        """再試行までの待ち時間（秒）"""
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return min(float(response.headers["Retry-After"]), self.backoff_max)
+        # 同時に失敗したリクエストが一斉に再試行しないよう、ゆらぎを加える
+        return min(self.backoff_base * (2 ** attempt), self.backoff_max) * random.uniform(0.5, 1.0)
+
+    async def _post_with_trace(self, payload, latency):
+        """1回分のリクエストを送り、接続・送信・最初の応答までの時間を latency に加算する"""
+        marks = {}
+
+        async def trace(event_name, info):
+            # httpcore のイベント名（例: "connection.connect_tcp.complete", "http11.send_request_body.complete"）
+            marks[event_name.split(".", 1)[-1]] = time.perf_counter()
+
+        start = time.perf_counter()
+        response = await self._client.post("/generate", json=payload, extensions={"trace": trace})
+        end = time.perf_counter()
+
+        connect_start = marks.get("connect_tcp.started")
+        connect_end = marks.get("start_tls.complete") or marks.get("connect_tcp.complete")
+        sent = marks.get("send_request_body.complete", start)
+        first_byte = marks.get("receive_response_headers.complete", end)
+        if connect_start and connect_end:
+            latency["connect"] += connect_end - connect_start
+        latency["ttfb"] += first_byte - sent
+        latency["download"] += end - first_byte
+        return response
+
+    async def generate(self, prompt, max_new_tokens=512, temperature=0.7, top_p=0.9, do_sample=True, **extra):
+        """
+        テキスト生成（503/429 の場合は再試行する）
+
+        Args:
+            prompt (str): プロンプト文字列
+            max_new_tokens (int, optional): 生成する最大トークン数
+            temperature (float, optional): 温度パラメータ
+            top_p (float, optional): top-p サンプリングのパラメータ
+            do_sample (bool, optional): サンプリングを行うかどうか
+            **extra: model や speculative など、その他のリクエストパラメータ
+
+        Returns:
+            dict: 生成結果。"latency" にクライアント側のレイテンシ内訳（秒）を含む
+                queue: 同時実行数の空きを待った時間
+                connect: TCP/TLS 接続の時間（接続を再利用した場合は0）
+                ttfb: リクエスト送信完了から応答ヘッダー受信までの時間（サーバーの処理時間を含む）
+                server: サーバーが報告した生成時間（response_time）
+                overhead: ttfb - server（ネットワークとサーバーのキューイング）
+                download: 応答本文の受信時間
+                backoff: 再試行の待ち時間の合計
+                total: generate の呼び出しから結果が返るまでの時間
+        """
+        payload = {
+            "prompt": prompt,
+            "max_new_tokens": max_new_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "do_sample": do_sample,
+            **extra,
+        }
+        latency = dict.fromkeys(["queue", "connect", "ttfb", "download", "backoff"], 0.0)
+
+        start_time = time.perf_counter()
+        attempt = 0
+        while True:
+            response = None
+            queued = time.perf_counter()
+            async with self._semaphore:
+                latency["queue"] += time.perf_counter() - queued
+                try:
+                    response = await self._post_with_trace(payload, latency)
+                except httpx.TransportError:
+                    if attempt >= self.max_retries:
+                        raise
+            if response is not None and (response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries):
+                break
+            # 待っている間は同時実行数の枠を他のリクエストに譲る
+            wait = self._backoff(attempt, response)
+            latency["backoff"] += wait
+            attempt += 1
+            await asyncio.sleep(wait)
+        latency["total"] = time.perf_counter() - start_time
+
+        if response.status_code == 200:
+            result = response.json()
+            latency["server"] = result.get("response_time", 0.0)
+            latency["overhead"] = latency["ttfb"] - latency["server"]
+            result["latency"] = latency
+            result["retries"] = attempt
+            result["total_request_time"] = latency["total"]
+            return result
+        else:
+            raise Exception(f"API error: {response.status_code} - {response.text}")
+
+    async def generate_many(self, prompts, return_exceptions=False, **params):
+        """
+        複数のプロンプトを同時実行数の範囲で並行に送る
+
+        Args:
+            prompts (list[str]): プロンプトのリスト
+            return_exceptions (bool, optional): True の場合、失敗したリクエストは例外オブジェクトを結果に入れる
+            **params: generate に渡すパラメータ
+
+        Returns:
+            list: prompts と同じ順序の生成結果
+        """
+        tasks = [self.generate(prompt, **params) for prompt in prompts]
+        return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+
+
+def _percentile(values, q):
+    """値のリストの q パーセンタイル（0〜100）"""
+    values = sorted(values)
+    return values[min(int(len(values) * q / 100), len(values) - 1)]
+
+
+async def run_benchmark(api_url, prompts, num_requests, concurrency, **params):
+    """サーバーに負荷をかけ、スループットとレイテンシ内訳を表示する"""
+    requests_prompts = [prompts[i % len(prompts)] for i in range(num_requests)]
+    async with AsyncLLMClient(api_url, concurrency=concurrency) as client:
+        start = time.perf_counter()
+        results = await client.generate_many(requests_prompts, return_exceptions=True, **params)
+        elapsed = time.perf_counter() - start
+
+    succeeded = [r for r in results if isinstance(r, dict)]
+    failed = [r for r in results if not isinstance(r, dict)]
+    tokens = sum(r.get("completion_tokens") or 0 for r in succeeded)
+    print(f"\n=== ベンチマーク結果 ({api_url}, 同時実行数 {concurrency}) ===")
+    print(f"リクエスト: {len(results)} 件 (成功 {len(succeeded)}, 失敗 {len(failed)}), 経過時間 {elapsed:.2f}s")
+    print(f"スループット: {len(succeeded) / elapsed:.2f} req/s, {tokens / elapsed:.1f} tokens/s")
+    print(f"再試行: {sum(r['retries'] for r in succeeded)} 回")
+    if succeeded:
+        print(f"{'latency(s)':<12}{'p50':>10}{'p95':>10}{'p99':>10}{'mean':>10}")
+        for key in ["total", "queue", "connect", "ttfb", "server", "overhead", "download", "backoff"]:
+            values = [r["latency"][key] for r in succeeded]
+            print(f"{key:<12}{_percentile(values, 50):>10.3f}{_percentile(values, 95):>10.3f}"
+                  f"{_percentile(values, 99):>10.3f}{statistics.fmean(values):>10.3f}")
+    for error in failed[:5]:
+        print(f"エラー: {error}")
+
+
 # 使用例
 if __name__ == "__main__":
     # ngrok URLを設定（実際のURLに置き換えてください）
     NGROK_URL = "https://your-ngrok-url.ngrok.url"
-    
-    # クライアントの初期化
-    client = LLMClient(NGROK_URL)
-    
-    # ヘルスチェック
-    print("Health check:")
-    print(client.health_check())
-    print()
-    
-    # 単一の質問
-    print("Simple question:")
-    result = client.generate([
-        {"prompt": "AIについて100文字で教えてください"}
-    ])
-    print(f"Response: {result['generated_text']}")
-    print(f"Model processing time: {result['response_time']:.2f}s")
-    print(f"Total request time: {result['total_request_time']:.2f}s")    
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description="LLM API クライアント")
+    parser.add_argument("--url", default=NGROK_URL, help="API のベース URL（例: http://localhost:8501）")
+    parser.add_argument("--bench", action="store_true", help="負荷をかけてスループットとレイテンシを計測する")
+    parser.add_argument("--requests", type=int, default=32, help="ベンチマークで送るリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時に送るリクエスト数")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    prompts = [
+        "AIについて100文字で教えてください",
+        "Pythonのリスト内包表記とは何ですか？",
+        "機械学習における過学習とは？",
+    ]
+
+    if args.bench:
+        asyncio.run(run_benchmark(args.url, prompts, args.requests, args.concurrency,
+                                  max_new_tokens=args.max_new_tokens))
+    else:
+        # クライアントの初期化
+        client = LLMClient(args.url)
+
+        # ヘルスチェック
+        print("Health check:")
+        print(client.health_check())
+        print()
+
+        # 単一の質問
+        print("Simple question:")
+        result = client.generate(prompts[0])
+        print(f"Response: {result['generated_text']}")
+        print(f"Model processing time: {result['response_time']:.2f}s")
+        print(f"Total request time: {result['total_request_time']:.2f}s")
+        print()
+
+        # 複数の質問を並行に送る
+        print("Concurrent questions:")
+
+        async def ask_all():
+            async with AsyncLLMClient(args.url, concurrency=args.concurrency) as async_client:
+                return await async_client.generate_many(prompts, max_new_tokens=args.max_new_tokens)
+
+        for prompt, result in zip(prompts, asyncio.run(ask_all())):
+            print(f"Q: {prompt}")
+            print(f"A: {result['generated_text']}")
+            print(f"   total {result['latency']['total']:.2f}s (server {result['latency']['server']:.2f}s)")
@@ -0,0 +1,262 @@
+# rate_limit.py
+# クライアントごとのトークン数によるレート制限と、推論の前段に置く重み付き公平キュー
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+# この数を超えたら、上限まで回復していて待ちのないクライアントの記録を削除する
+MAX_TRACKED_CLIENTS = 10000
+
+
+class TokenBucket:
+    """トークンバケット（1秒あたり rate 個ずつ、capacity 個まで回復する）"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_consume(self, amount):
+        """amount 個を消費する。足りない場合は消費せず、使えるようになるまでの秒数を返す
+
+        Returns:
+            tuple: (消費できたか, 再試行までの秒数)
+        """
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True, 0.0
+        return False, (amount - self.tokens) / self.rate
+
+    def refund(self, amount):
+        """使わなかった分を戻す"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    @property
+    def available(self):
+        self._refill()
+        return self.tokens
+
+
+class RateLimitExceeded(Exception):
+    """レート制限を超えた（retry_after 秒後に再試行できる）"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RequestTooLarge(Exception):
+    """1回のリクエストが上限を超えていて、待っても処理できない"""
+
+
+class ClientRateLimiter:
+    """クライアント（APIキーまたはIPアドレス）ごとの、生成トークン数によるレート制限
+
+    リクエストの受け付け時に max_new_tokens 分を見積もりとして消費し、生成後に
+    実際に生成しなかった分を戻す。
+    """
+
+    def __init__(self, tokens_per_minute, burst_tokens, max_new_tokens_limit):
+        self.tokens_per_minute = tokens_per_minute
+        self.burst_tokens = burst_tokens
+        self.max_new_tokens_limit = max_new_tokens_limit
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._usage = {}
+
+    def _client(self, client_id):
+        """バケットと利用状況を取得する（なければ作成）。ロックを取得した状態で呼ぶ"""
+        if client_id not in self._buckets:
+            if len(self._buckets) >= MAX_TRACKED_CLIENTS:
+                self._prune()
+            self._buckets[client_id] = TokenBucket(self.tokens_per_minute / 60.0, self.burst_tokens)
+            self._usage[client_id] = {"requests": 0, "rejected": 0, "reserved_tokens": 0, "generated_tokens": 0}
+        return self._buckets[client_id], self._usage[client_id]
+
+    def _prune(self):
+        for client_id, bucket in list(self._buckets.items()):
+            if bucket.available >= bucket.capacity and self._usage[client_id]["reserved_tokens"] == 0:
+                del self._buckets[client_id]
+                del self._usage[client_id]
+
+    def check_request(self, max_new_tokens):
+        """1回のリクエストの max_new_tokens が上限内か確認する
+
+        Raises:
+            RequestTooLarge: max_new_tokens が1回の上限またはバケットの容量を超える
+        """
+        if max_new_tokens > self.max_new_tokens_limit:
+            raise RequestTooLarge(f"max_new_tokens は {self.max_new_tokens_limit} 以下にしてください。")
+        if max_new_tokens > self.burst_tokens:
+            raise RequestTooLarge(f"max_new_tokens がレート制限の容量 ({self.burst_tokens}) を超えています。")
+
+    def check(self, client_id, max_new_tokens):
+        """admit と同じ確認を、トークンを消費せずに行う（バッチジョブの受け付け用）"""
+        self.check_request(max_new_tokens)
+        with self._lock:
+            bucket, usage = self._client(client_id)
+            if bucket.available < max_new_tokens:
+                usage["rejected"] += 1
+                retry_after = (max_new_tokens - bucket.available) / bucket.rate
+                raise RateLimitExceeded("生成トークン数のレート制限を超えました。", retry_after)
+
+    def admit(self, client_id, max_new_tokens):
+        """リクエストを受け付け、見積もりのトークン数を消費する
+
+        Raises:
+            RequestTooLarge: max_new_tokens が1回の上限またはバケットの容量を超える
+            RateLimitExceeded: 現在のバケットの残りが足りない
+        """
+        self.check_request(max_new_tokens)
+        with self._lock:
+            bucket, usage = self._client(client_id)
+            ok, retry_after = bucket.try_consume(max_new_tokens)
+            if not ok:
+                usage["rejected"] += 1
+                raise RateLimitExceeded("生成トークン数のレート制限を超えました。", retry_after)
+            usage["requests"] += 1
+            usage["reserved_tokens"] += max_new_tokens
+
+    def reserve(self, client_id, tokens):
+        """tokens 個を待たずに消費する（バッチジョブのワーカースレッドから呼ぶ）
+
+        足りない場合は消費せず、使えるようになるまでの秒数を返す。ワーカーはその間
+        他のジョブを処理できる。tokens はバケットの容量以下にすること。生成後に settle を呼ぶ。
+
+        Returns:
+            float: 消費できた場合は0、足りない場合は再試行までの秒数
+        """
+        with self._lock:
+            bucket, usage = self._client(client_id)
+            ok, retry_after = bucket.try_consume(tokens)
+            if not ok:
+                return retry_after
+            usage["requests"] += 1
+            usage["reserved_tokens"] += tokens
+            return 0.0
+
+    def settle(self, client_id, reserved_tokens, generated_tokens):
+        """生成後に、実際に生成しなかった分をバケットに戻す"""
+        with self._lock:
+            bucket, usage = self._client(client_id)
+            bucket.refund(max(reserved_tokens - generated_tokens, 0))
+            usage["reserved_tokens"] -= reserved_tokens
+            usage["generated_tokens"] += generated_tokens
+
+    def limits(self):
+        return {
+            "tokens_per_minute": self.tokens_per_minute,
+            "burst_tokens": self.burst_tokens,
+            "max_new_tokens_per_request": self.max_new_tokens_limit,
+        }
+
+    def usage(self, client_id=None):
+        """クライアントごとの利用状況（client_id を指定するとそのクライアントのみ）"""
+        with self._lock:
+            client_ids = [client_id] if client_id is not None else list(self._buckets)
+            result = {}
+            for cid in client_ids:
+                bucket, usage = self._client(cid)
+                result[cid] = {"available_tokens": int(bucket.available), **usage}
+        return result
+
+
+class WeightedFairQueue:
+    """推論の同時実行数を制限し、待っているリクエストをクライアント間で公平に割り当てる
+
+    重み付き公平キューイング（WFQ）: 各リクエストに「コスト / クライアントの重み」だけ進んだ
+    仮想終了時刻を付け、空きができたら仮想終了時刻が最も小さいリクエストから実行する。
+    大量に送るクライアントのリクエストは仮想時刻が先に進むため、他のクライアントの
+    リクエストが後ろで待たされ続けることがない。
+    イベントループのスレッドからのみ使う（ロックは不要）。
+    """
+
+    def __init__(self, concurrency=1, weights=None, default_weight=1.0):
+        self.concurrency = concurrency
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self._running = 0
+        self._heap = []  # (仮想終了時刻, 到着順, Future)
+        self._counter = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish = {}  # {クライアント: 最後に割り当てた仮想終了時刻}
+        self._waiting = {}  # {クライアント: 待っているリクエスト数}
+
+    def weight(self, client_id):
+        return self.weights.get(client_id, self.default_weight)
+
+    def _dispatch(self):
+        while self._running < self.concurrency and self._heap:
+            finish, _, future = heapq.heappop(self._heap)
+            if future.done():  # 待っている間に取り消された
+                continue
+            self._virtual_time = max(self._virtual_time, finish)
+            self._running += 1
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, client_id, cost, timeout=None):
+        """実行枠を取得する（順番が来るまで待つ）
+
+        timeout 秒以内に順番が来なければ asyncio.TimeoutError を送出する。
+        """
+        start = max(self._virtual_time, self._last_finish.get(client_id, 0.0))
+        finish = start + cost / self.weight(client_id)
+        self._last_finish[client_id] = finish
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (finish, next(self._counter), future))
+        self._waiting[client_id] = self._waiting.get(client_id, 0) + 1
+        try:
+            self._dispatch()
+            if timeout is not None:
+                await asyncio.wait_for(future, max(timeout, 0))
+            else:
+                await future
+        except BaseException:
+            # 待っている間に取り消された場合、すでに枠を割り当てていれば返す
+            if future.done() and not future.cancelled():
+                self._running -= 1
+                self._dispatch()
+            future.cancel()
+            raise
+        finally:
+            self._waiting[client_id] -= 1
+            if not self._waiting[client_id]:
+                del self._waiting[client_id]
+        try:
+            yield
+        finally:
+            self._running -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot_from_thread(self, loop, client_id, cost):
+        """slot() を別のスレッド（バッチジョブのワーカーなど）から使う
+
+        キューの操作はすべて loop（イベントループ）のスレッドで実行される。
+        """
+        context = self.slot(client_id, cost)
+        asyncio.run_coroutine_threadsafe(context.__aenter__(), loop).result()
+        try:
+            yield
+        finally:
+            asyncio.run_coroutine_threadsafe(context.__aexit__(None, None, None), loop).result()
+
+    def status(self):
+        return {
+            "concurrency": self.concurrency,
+            "running": self._running,
+            "waiting": dict(self._waiting),
+            "weights": self.weights,
+        }
@@ -0,0 +1,19 @@
+# llm_common
+# 02_streamlit_app と 03_FastAPI で共有するLLM関連のモジュール
+from .backends import (
+    InferenceBackend,
+    HFPipelineBackend,
+    QuantizedCPUBackend,
+    BACKENDS,
+    create_backend,
+    load_backend,
+)
+from .generation import (
+    GenerationResult,
+    encode_prompt,
+    generate_batch,
+    generate_new_tokens,
+    extract_assistant_response,
+)
+from .speculative import generate_speculative
+from .cancellation import CancellationToken, STOP_CANCELLED, STOP_DEADLINE
@@ -0,0 +1,232 @@
+# backends.py
+# 推論バックエンドの抽象化
+# Streamlitアプリ（02_streamlit_app）とFastAPIアプリ（03_FastAPI）の両方から利用する
+import threading
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, TextIteratorStreamer, pipeline
+from .cancellation import add_cancellation
+from .generation import GenerationResult, extract_assistant_response, generate_batch, generate_new_tokens
+from .speculative import check_draft_compatible, generate_speculative
+
+
+class InferenceBackend:
+    """推論バックエンドの共通インターフェース
+
+    各バックエンドは load / generate / stream / count_tokens を実装する。
+    generate の戻り値は transformers の text-generation パイプラインと同じ形式
+    （[{"generated_text": ...}]）とする。アプリからは応答テキストとトークン数を
+    まとめて返す generate_text を使う。
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self.model_name = None
+        self.device = "cpu"
+
+    def load(self, model_name):
+        """モデルを読み込む"""
+        raise NotImplementedError
+
+    def generate(self, inputs, **generate_kwargs):
+        """プロンプト文字列またはメッセージのリストから応答を生成する"""
+        raise NotImplementedError
+
+    def load_draft(self, draft_model_name):
+        """投機的デコーディング用のドラフトモデルを読み込む"""
+        raise NotImplementedError(f"バックエンド '{self.name}' は投機的デコーディングに対応していません")
+
+    @property
+    def supports_speculative(self):
+        """ドラフトモデルが読み込まれていて投機的デコーディングを使えるか"""
+        return False
+
+    def generate_text(self, inputs, cancel_token=None, **generate_kwargs):
+        """応答テキストとトークン数を GenerationResult で返す
+
+        cancel_token（CancellationToken）を渡すと、締め切りや取り消しで途中で生成を止める。
+        """
+        if generate_kwargs.pop("speculative", False):
+            raise ValueError(f"バックエンド '{self.name}' は投機的デコーディングに対応していません")
+        add_cancellation(generate_kwargs, cancel_token)
+        outputs = self.generate(inputs, return_full_text=False, **generate_kwargs)
+        text = extract_assistant_response(outputs)
+        return GenerationResult(
+            text=text,
+            prompt_tokens=self.count_tokens(inputs),
+            completion_tokens=self.count_tokens(text) if text else 0,
+            stop_reason=cancel_token.stop_reason if cancel_token is not None else None,
+        )
+
+    def generate_batch(self, inputs_list, **generate_kwargs):
+        """複数の入力をまとめて生成し、GenerationResult のリストを返す"""
+        # まとめて生成できないバックエンドは1件ずつ生成する
+        return [self.generate_text(inputs, **generate_kwargs) for inputs in inputs_list]
+
+    def stream(self, inputs, **generate_kwargs):
+        """生成されたテキストを逐次返すイテレータ"""
+        # ストリーミングに対応しないバックエンドは一括生成した結果を1回で返す
+        outputs = self.generate(inputs, return_full_text=False, **generate_kwargs)
+        yield outputs[0]["generated_text"]
+
+    def count_tokens(self, inputs):
+        """プロンプト文字列またはメッセージのリストのトークン数を返す"""
+        raise NotImplementedError
+
+    def memory_bytes(self):
+        """読み込んだモデルの重みが使うメモリ量（バイト）の見積もり。不明な場合は0"""
+        return 0
+
+    def unload(self):
+        """モデルへの参照を解放する"""
+        self.model_name = None
+
+    def __call__(self, inputs, **generate_kwargs):
+        # パイプラインと同じ呼び出し方もできるようにする
+        return self.generate(inputs, **generate_kwargs)
+
+
+class HFPipelineBackend(InferenceBackend):
+    """transformersのtext-generationパイプラインを使うバックエンド（従来の実装）"""
+
+    name = "hf"
+
+    def __init__(self, torch_dtype=torch.bfloat16, device=None):
+        super().__init__()
+        self.torch_dtype = torch_dtype
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.pipe = None
+        self.draft_model = None
+        self.draft_model_name = None
+
+    def load(self, model_name):
+        self.pipe = pipeline(
+            "text-generation",
+            model=model_name,
+            model_kwargs={"torch_dtype": self.torch_dtype},
+            device=self.device
+        )
+        self.model_name = model_name
+        return self
+
+    @property
+    def tokenizer(self):
+        return self.pipe.tokenizer
+
+    def generate(self, inputs, **generate_kwargs):
+        return self.pipe(inputs, **generate_kwargs)
+
+    def load_draft(self, draft_model_name):
+        draft_tokenizer = AutoTokenizer.from_pretrained(draft_model_name)
+        check_draft_compatible(self.tokenizer, draft_tokenizer)
+        draft_model = AutoModelForCausalLM.from_pretrained(draft_model_name, torch_dtype=self.torch_dtype)
+        self.draft_model = draft_model.to(self.pipe.model.device).eval()
+        self.draft_model_name = draft_model_name
+        return self
+
+    @property
+    def supports_speculative(self):
+        return self.draft_model is not None
+
+    def generate_text(self, inputs, speculative=False, cancel_token=None, **generate_kwargs):
+        # パイプラインを通さずに生成し、新しいトークンだけをデコードする
+        if speculative:
+            if self.draft_model is None:
+                raise ValueError("ドラフトモデルが読み込まれていないため、投機的デコーディングを使用できません")
+            return generate_speculative(
+                self.pipe.model, self.draft_model, self.tokenizer, inputs, cancel_token=cancel_token, **generate_kwargs
+            )
+        return generate_new_tokens(self.pipe.model, self.tokenizer, inputs, cancel_token=cancel_token, **generate_kwargs)
+
+    def generate_batch(self, inputs_list, **generate_kwargs):
+        return generate_batch(self.pipe.model, self.tokenizer, inputs_list, **generate_kwargs)
+
+    def stream(self, inputs, **generate_kwargs):
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        worker = threading.Thread(
+            target=self.pipe, args=(inputs,), kwargs={"streamer": streamer, **generate_kwargs}, daemon=True
+        )
+        worker.start()
+        for text in streamer:
+            yield text
+        worker.join()
+
+    def count_tokens(self, inputs):
+        if isinstance(inputs, list):
+            # メッセージ形式の場合はチャットテンプレート適用後のトークン数を数える
+            encoded = self.tokenizer.apply_chat_template(inputs, tokenize=True, add_generation_prompt=True)
+            # transformersのバージョンによってはBatchEncodingが返る
+            if hasattr(encoded, "keys"):
+                encoded = encoded["input_ids"]
+            return len(encoded)
+        return len(self.tokenizer(inputs, add_special_tokens=True)["input_ids"])
+
+    def memory_bytes(self):
+        total = 0
+        for model in (self.pipe.model if self.pipe else None, self.draft_model):
+            if model is not None:
+                total += _state_dict_bytes(model.state_dict())
+        return total
+
+    def unload(self):
+        self.pipe = None
+        self.draft_model = None
+        self.draft_model_name = None
+        super().unload()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+def _state_dict_bytes(value):
+    """state_dictに含まれるテンソルの合計バイト数（量子化層のパック済み重みも含む）"""
+    if isinstance(value, torch.Tensor):
+        return value.nelement() * value.element_size()
+    if isinstance(value, dict):
+        return sum(_state_dict_bytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_state_dict_bytes(v) for v in value)
+    return 0
+
+
+class QuantizedCPUBackend(HFPipelineBackend):
+    """Linear層をtorchの動的int8量子化で置き換えたCPU向けバックエンド
+
+    重みをint8で保持し、行列積をint8で計算するため、bfloat16演算の遅いCPUのみの環境で
+    メモリ使用量を抑えつつスループットを向上させる。
+    """
+
+    name = "cpu-int8"
+
+    def __init__(self, num_threads=None):
+        super().__init__(torch_dtype=torch.float32, device="cpu")
+        self.num_threads = num_threads
+
+    def load(self, model_name):
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32)
+        model.eval()
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.pipe = pipeline("text-generation", model=model, tokenizer=tokenizer, device="cpu")
+        self.model_name = model_name
+        return self
+
+
+# バックエンド名とクラスの対応
+BACKENDS = {
+    HFPipelineBackend.name: HFPipelineBackend,
+    QuantizedCPUBackend.name: QuantizedCPUBackend,
+}
+
+
+def create_backend(name="hf", **kwargs):
+    """名前からバックエンドのインスタンスを作成する"""
+    if name not in BACKENDS:
+        raise ValueError(f"未知のバックエンドです: {name} (利用可能: {', '.join(BACKENDS)})")
+    return BACKENDS[name](**kwargs)
+
+
+def load_backend(model_name, name="hf", **kwargs):
+    """バックエンドを作成してモデルを読み込む"""
+    return create_backend(name, **kwargs).load(model_name)
@@ -0,0 +1,116 @@
+# benchmark_backends.py
+# 推論バックエンドごとのスループット（tokens/sec）とメモリ使用量（RSS）を比較する
+#
+# 使用例（day1ディレクトリで実行）:
+#   python -m llm_common.benchmark_backends --model google/gemma-2-2b-jpn-it --backends hf cpu-int8
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import time
+
+DEFAULT_PROMPTS = [
+    "AIについて100文字で教えてください",
+    "Pythonのリスト内包表記とは何ですか？",
+    "機械学習における過学習とは？",
+]
+
+
+def current_rss_bytes():
+    """現在のRSS（常駐メモリ）をバイト単位で返す"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # /procがない環境ではピークRSSで代用する（macOSはバイト、Linuxはキロバイト単位）
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_backend(backend_name, model_name, prompts, max_new_tokens, repeats, result_queue):
+    """1つのバックエンドを計測する（RSSを分離するため子プロセスで実行）"""
+    try:
+        from llm_common.backends import load_backend
+
+        rss_before = current_rss_bytes()
+        start = time.perf_counter()
+        backend = load_backend(model_name, backend_name)
+        load_time = time.perf_counter() - start
+        rss_loaded = current_rss_bytes()
+
+        # ウォームアップ（初回のカーネル初期化などを計測から除外する）
+        backend.generate(prompts[0], max_new_tokens=4, do_sample=False)
+
+        generated_tokens = 0
+        elapsed = 0.0
+        for _ in range(repeats):
+            for prompt in prompts:
+                start = time.perf_counter()
+                # 貪欲法で生成し、バックエンド間で同じ長さの出力になるようにする
+                outputs = backend.generate(
+                    prompt, max_new_tokens=max_new_tokens, do_sample=False, return_full_text=False
+                )
+                elapsed += time.perf_counter() - start
+                generated_tokens += backend.count_tokens(outputs[0]["generated_text"])
+
+        result_queue.put({
+            "backend": backend_name,
+            "load_time_s": load_time,
+            "generated_tokens": generated_tokens,
+            "generation_time_s": elapsed,
+            "tokens_per_sec": generated_tokens / elapsed if elapsed else 0.0,
+            "rss_model_mb": (rss_loaded - rss_before) / 1024 / 1024,
+            "rss_peak_mb": peak_rss_bytes() / 1024 / 1024,
+        })
+    except Exception as e:
+        result_queue.put({"backend": backend_name, "error": str(e)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推論バックエンドの比較ベンチマーク")
+    parser.add_argument("--model", default="google/gemma-2-2b-jpn-it", help="比較に使うモデル名")
+    parser.add_argument("--backends", nargs="+", default=["hf", "cpu-int8"], help="比較するバックエンド")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=2, help="各プロンプトの繰り返し回数")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for backend_name in args.backends:
+        queue = ctx.Queue()
+        proc = ctx.Process(
+            target=run_backend,
+            args=(backend_name, args.model, DEFAULT_PROMPTS, args.max_new_tokens, args.repeats, queue),
+        )
+        proc.start()
+        results.append(queue.get())
+        proc.join()
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"\n=== バックエンド比較 ({args.model}, max_new_tokens={args.max_new_tokens}) ===")
+    print(f"{'backend':<12}{'load(s)':>10}{'tokens':>10}{'tok/s':>10}{'model RSS(MB)':>16}{'peak RSS(MB)':>15}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['backend']:<12}エラー: {r['error']}")
+            continue
+        print(
+            f"{r['backend']:<12}{r['load_time_s']:>10.1f}{r['generated_tokens']:>10}"
+            f"{r['tokens_per_sec']:>10.1f}{r['rss_model_mb']:>16.1f}{r['rss_peak_mb']:>15.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
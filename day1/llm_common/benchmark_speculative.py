@@ -0,0 +1,123 @@
+# benchmark_speculative.py
+# 通常の自己回帰デコーディングと投機的デコーディングの速度・受理率を比較する
+#
+# 使用例（day1ディレクトリで実行）:
+#   # 小さなランダムモデルをその場で作成して比較（ダウンロード不要・CI向け）
+#   python -m llm_common.benchmark_speculative --tiny
+#   # 実際のモデルで比較
+#   python -m llm_common.benchmark_speculative --model google/gemma-2-2b-jpn-it --draft-model <同じ語彙の小さなモデル>
+import argparse
+import os
+import tempfile
+import time
+import torch
+
+from .backends import load_backend
+from .generation import generate_new_tokens
+
+DEFAULT_PROMPTS = [
+    "AIについて100文字で教えてください",
+    "Pythonのリスト内包表記とは何ですか？",
+    "機械学習における過学習とは？",
+]
+
+
+def build_tiny_models(out_dir, seed=0):
+    """ベンチマーク用に、同じ語彙を持つ小さなメインモデルとドラフトモデルを作成する
+
+    ドラフトモデルはメインモデルの埋め込みと先頭の層をコピーしたもので、
+    ランダムな重みでもある程度メインモデルと同じトークンを提案する。
+    """
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+    chars = sorted(set("".join(DEFAULT_PROMPTS)) | {chr(c) for c in range(32, 127)})
+    vocab = {"<unk>": 0, "<eos>": 1}
+    for ch in chars:
+        vocab.setdefault(ch, len(vocab))
+    tokenizer_model = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer_model.pre_tokenizer = pre_tokenizers.Split("", "isolated")
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer_model, unk_token="<unk>", eos_token="<eos>", pad_token="<eos>"
+    )
+
+    torch.manual_seed(seed)
+    config = dict(vocab_size=len(vocab), n_positions=1024, n_embd=128, n_head=4,
+                  bos_token_id=1, eos_token_id=1, pad_token_id=1)
+    main_model = GPT2LMHeadModel(GPT2Config(n_layer=8, **config))
+    draft_model = GPT2LMHeadModel(GPT2Config(n_layer=1, **config))
+    draft_state = draft_model.state_dict()
+    for name, tensor in main_model.state_dict().items():
+        if name in draft_state:
+            draft_state[name] = tensor.clone()
+    draft_model.load_state_dict(draft_state)
+
+    paths = {}
+    for name, model in [("main", main_model), ("draft", draft_model)]:
+        path = os.path.join(out_dir, name)
+        model.save_pretrained(path)
+        tokenizer.save_pretrained(path)
+        paths[name] = path
+    return paths["main"], paths["draft"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="投機的デコーディングのベンチマーク")
+    parser.add_argument("--model", help="メインモデル名")
+    parser.add_argument("--draft-model", help="ドラフトモデル名（メインモデルと同じ語彙）")
+    parser.add_argument("--tiny", action="store_true", help="小さなランダムモデルを作成して比較する")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=2)
+    args = parser.parse_args()
+
+    tmp_dir = None
+    if args.tiny:
+        tmp_dir = tempfile.TemporaryDirectory()
+        args.model, args.draft_model = build_tiny_models(tmp_dir.name)
+    elif not (args.model and args.draft_model):
+        parser.error("--tiny または --model と --draft-model の両方を指定してください")
+
+    backend = load_backend(args.model, "hf").load_draft(args.draft_model)
+    model = backend.pipe.model
+    # 貪欲法では投機的デコーディングでも出力が通常のデコーディングと一致する
+    gen_kwargs = dict(max_new_tokens=args.max_new_tokens, do_sample=False)
+
+    # ウォームアップ
+    generate_new_tokens(model, backend.tokenizer, DEFAULT_PROMPTS[0], max_new_tokens=4, do_sample=False)
+    backend.generate_text(DEFAULT_PROMPTS[0], speculative=True, max_new_tokens=4, do_sample=False)
+
+    totals = {"baseline": [0, 0.0], "speculative": [0, 0.0]}
+    accepted = proposed = 0
+    mismatches = 0
+    for _ in range(args.repeats):
+        for prompt in DEFAULT_PROMPTS:
+            start = time.perf_counter()
+            baseline = generate_new_tokens(model, backend.tokenizer, prompt, **gen_kwargs)
+            totals["baseline"][0] += baseline.completion_tokens
+            totals["baseline"][1] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            speculative = backend.generate_text(prompt, speculative=True, **gen_kwargs)
+            totals["speculative"][0] += speculative.completion_tokens
+            totals["speculative"][1] += time.perf_counter() - start
+            accepted += speculative.stats["accepted_tokens"]
+            proposed += speculative.stats["proposed_tokens"]
+            if speculative.text != baseline.text:
+                mismatches += 1
+
+    print(f"\n=== 投機的デコーディングの比較 ({args.model} + {args.draft_model}) ===")
+    print(f"{'mode':<14}{'tokens':>10}{'time(s)':>10}{'tok/s':>10}")
+    for mode, (tokens, elapsed) in totals.items():
+        print(f"{mode:<14}{tokens:>10}{elapsed:>10.2f}{tokens / elapsed if elapsed else 0:>10.1f}")
+    baseline_tps = totals["baseline"][0] / totals["baseline"][1]
+    speculative_tps = totals["speculative"][0] / totals["speculative"][1]
+    print(f"\n受理率: {accepted / proposed if proposed else 0:.1%} ({accepted} / {proposed} トークン)")
+    print(f"実効スループットの比: {speculative_tps / baseline_tps:.2f}x")
+    print(f"通常のデコーディングと出力が異なったプロンプト: {mismatches} 件")
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# cancellation.py
+# 生成の締め切り（デッドライン）と途中での取り消し
+#
+# model.generate の stopping_criteria としてトークンを1つ生成するごとに確認するため、
+# 締め切りを過ぎたり呼び出し元から取り消されたりすると、次のステップで生成が止まる。
+import threading
+import time
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+# 生成を止めた理由
+STOP_DEADLINE = "deadline"
+STOP_CANCELLED = "cancelled"
+
+
+class CancellationToken:
+    """生成の締め切りと取り消しの状態を、リクエスト処理と生成スレッドの間で共有する"""
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline  # time.monotonic() 基準の締め切り（Noneなら締め切りなし）
+        self.reason = None  # cancel() で指定された理由
+        self.stop_reason = None  # 実際にこのトークンによって生成が止まった場合の理由
+        self._cancelled = threading.Event()
+
+    @classmethod
+    def with_timeout(cls, seconds):
+        """今から seconds 秒後を締め切りとするトークン（Noneまたは0なら締め切りなし）"""
+        return cls(time.monotonic() + seconds if seconds else None)
+
+    def cancel(self, reason=STOP_CANCELLED):
+        """生成の取り消しを要求する"""
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def remaining(self):
+        """締め切りまでの残り秒数（締め切りなしならNone）"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def should_stop(self):
+        """生成を止めるべき理由を返す（続けてよい場合はNone）"""
+        if self._cancelled.is_set():
+            return self.reason
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return STOP_DEADLINE
+        return None
+
+
+class CancellationCriteria(StoppingCriteria):
+    """トークンの生成ごとに CancellationToken を確認する stopping criterion"""
+
+    def __init__(self, token):
+        self.token = token
+
+    def __call__(self, input_ids, scores, **kwargs):
+        reason = self.token.should_stop()
+        if reason is not None:
+            self.token.stop_reason = reason
+        return torch.full((input_ids.shape[0],), reason is not None, dtype=torch.bool, device=input_ids.device)
+
+
+def add_cancellation(generate_kwargs, cancel_token):
+    """generate の引数に取り消し用の stopping criterion を追加する（cancel_token が None なら何もしない）"""
+    if cancel_token is not None:
+        criteria = StoppingCriteriaList(generate_kwargs.get("stopping_criteria") or [])
+        criteria.append(CancellationCriteria(cancel_token))
+        generate_kwargs["stopping_criteria"] = criteria
+    return generate_kwargs
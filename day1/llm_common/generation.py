@@ -0,0 +1,164 @@
+# generation.py
+# 生成結果（アシスタントの応答とトークン数）の取り出し
+# 02_streamlit_app と 03_FastAPI で同じ処理を使う
+from dataclasses import dataclass, field
+from typing import Optional
+import torch
+from .cancellation import add_cancellation
+
+
+@dataclass
+class GenerationResult:
+    """生成されたテキストとトークン数"""
+    text: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    stats: dict = field(default_factory=dict)  # 投機的デコーディングの受理率など、生成方式ごとの追加情報
+    stop_reason: Optional[str] = None  # 締め切りや取り消しで途中で止まった場合の理由
+
+    @property
+    def truncated(self):
+        """締め切りや取り消しで途中までの結果になっているか"""
+        return self.stop_reason is not None
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    def usage(self):
+        """APIレスポンスやログ用のトークン数の辞書"""
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+        }
+
+
+def encode_prompt(tokenizer, inputs):
+    """プロンプト文字列またはメッセージのリストをトークンIDのテンソル (1, n) に変換する"""
+    if isinstance(inputs, list):
+        encoded = tokenizer.apply_chat_template(
+            inputs, tokenize=True, add_generation_prompt=True, return_tensors="pt"
+        )
+        # transformersのバージョンによってはBatchEncodingが返る
+        if hasattr(encoded, "keys"):
+            encoded = encoded["input_ids"]
+        return encoded
+    return tokenizer(inputs, return_tensors="pt")["input_ids"]
+
+
+def generate_new_tokens(model, tokenizer, inputs, cancel_token=None, **generate_kwargs):
+    """model.generateを直接呼び出し、新しく生成されたトークンだけをデコードする
+
+    パイプライン経由ではプロンプトを含む全文をデコードしてから文字列検索でプロンプトを
+    取り除くため、プロンプト長に比例する処理が毎回発生する。ここでは出力のトークンIDを
+    プロンプト長で切り出し、生成部分のみを1回だけデコードする。
+    cancel_token（CancellationToken）を渡すと、締め切りや取り消しで途中で生成を止める。
+    """
+    input_ids = encode_prompt(tokenizer, inputs).to(model.device)
+    attention_mask = torch.ones_like(input_ids)
+    generate_kwargs.pop("return_full_text", None)
+    if tokenizer.pad_token_id is not None:
+        generate_kwargs.setdefault("pad_token_id", tokenizer.pad_token_id)
+    else:
+        generate_kwargs.setdefault("pad_token_id", tokenizer.eos_token_id)
+    add_cancellation(generate_kwargs, cancel_token)
+
+    with torch.inference_mode():
+        output_ids = model.generate(input_ids=input_ids, attention_mask=attention_mask, **generate_kwargs)
+
+    prompt_tokens = input_ids.shape[-1]
+    new_ids = output_ids[0, prompt_tokens:]
+    text = tokenizer.decode(new_ids, skip_special_tokens=True).strip()
+    return GenerationResult(
+        text=text,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=int(new_ids.shape[-1]),
+        stop_reason=cancel_token.stop_reason if cancel_token is not None else None,
+    )
+
+
+def _eos_token_ids(model, tokenizer, generate_kwargs):
+    """生成を終えるトークンIDの集合
+
+    チャットモデルはターンの終わりに tokenizer.eos_token_id 以外のトークン
+    （Gemmaの <end_of_turn> など）を使うため、generation_config の eos_token_id
+    （リストの場合もある）もまとめる。
+    """
+    ids = set()
+    generation_config = getattr(model, "generation_config", None)
+    for value in (
+        generate_kwargs.get("eos_token_id"),
+        getattr(generation_config, "eos_token_id", None),
+        tokenizer.eos_token_id,
+    ):
+        if value is None:
+            continue
+        ids.update(value if isinstance(value, (list, tuple, set)) else [value])
+    return ids
+
+
+def generate_batch(model, tokenizer, prompts, cancel_token=None, **generate_kwargs):
+    """複数のプロンプトを左パディングでまとめて1回の model.generate で生成する
+
+    1件ずつ生成するよりも行列演算の効率が上がり、スループットが向上する。
+    プロンプト文字列とメッセージのリストのどちらも受け付ける。
+
+    Returns:
+        list[GenerationResult]: prompts と同じ順序の生成結果
+    """
+    encoded = [encode_prompt(tokenizer, inputs)[0] for inputs in prompts]
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    max_len = max(ids.shape[-1] for ids in encoded)
+    input_ids = torch.full((len(encoded), max_len), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(encoded), max_len), dtype=torch.long)
+    for row, ids in enumerate(encoded):
+        # デコーダーモデルは末尾から生成を続けるため、パディングは左側に入れる
+        input_ids[row, max_len - ids.shape[-1]:] = ids
+        attention_mask[row, max_len - ids.shape[-1]:] = 1
+    generate_kwargs.pop("return_full_text", None)
+    generate_kwargs.setdefault("pad_token_id", pad_token_id)
+    add_cancellation(generate_kwargs, cancel_token)
+
+    with torch.inference_mode():
+        output_ids = model.generate(
+            input_ids=input_ids.to(model.device), attention_mask=attention_mask.to(model.device), **generate_kwargs
+        )
+
+    results = []
+    eos_token_ids = torch.tensor(sorted(_eos_token_ids(model, tokenizer, generate_kwargs)), dtype=torch.long)
+    for row, ids in enumerate(encoded):
+        new_ids = output_ids[row, max_len:]
+        # 早く終わった行は残りがパディング（またはEOS）で埋まるため、最初のEOSまでを数える
+        if len(eos_token_ids):
+            eos_positions = torch.isin(new_ids, eos_token_ids.to(new_ids.device)).nonzero()
+            if len(eos_positions):
+                new_ids = new_ids[: int(eos_positions[0]) + 1]
+        text = tokenizer.decode(new_ids, skip_special_tokens=True).strip()
+        results.append(GenerationResult(
+            text=text,
+            prompt_tokens=int(ids.shape[-1]),
+            completion_tokens=int(new_ids.shape[-1]),
+            stop_reason=cancel_token.stop_reason if cancel_token is not None else None,
+        ))
+    return results
+
+
+def extract_assistant_response(outputs):
+    """text-generationパイプライン形式の出力からアシスタントの応答を取り出す
+
+    return_full_text=False で生成した出力（新しいテキストのみ）と、
+    メッセージ形式の出力（最後のassistantメッセージ）の両方に対応する。
+    取り出せない場合は空文字列を返す。
+    """
+    if not outputs or not isinstance(outputs, list):
+        return ""
+    generated = outputs[0].get("generated_text") if isinstance(outputs[0], dict) else None
+    if isinstance(generated, list):
+        # メッセージ形式の場合
+        if generated and isinstance(generated[-1], dict) and generated[-1].get("role") == "assistant":
+            return generated[-1].get("content", "").strip()
+        return ""
+    if isinstance(generated, str):
+        return generated.strip()
+    return ""
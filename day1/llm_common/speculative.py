@@ -0,0 +1,117 @@
+# speculative.py
+# 小さなドラフトモデルを使った投機的デコーディング（transformersのassisted generation）
+#
+# ドラフトモデルが数トークン先まで候補を提案し、メインモデルは1回の順伝播でまとめて検証する。
+# 受理された候補の分だけメインモデルの順伝播回数が減るため、CPUでも生成が速くなる。
+# メインモデルとドラフトモデルは同じトークナイザー（語彙）を使う必要がある。
+import threading
+import time
+import weakref
+import torch
+from .cancellation import add_cancellation
+from .generation import GenerationResult, encode_prompt
+
+
+# 数えている途中の {id(model): 回数}（スレッドごと）
+_forward_counts = threading.local()
+# フックを登録済みのモデル（モデルごとに1回だけ登録し、外さない）
+_hooked_models = weakref.WeakSet()
+_hook_lock = threading.Lock()
+
+
+def _count_forward(module, inputs, output):
+    counts = getattr(_forward_counts, "counts", None)
+    if counts is not None and id(module) in counts:
+        counts[id(module)] += 1
+
+
+class ForwardCounter:
+    """このスレッドでのモデルの順伝播（forward）の呼び出し回数を数える
+
+    同じモデルを別のスレッドで同時に使う生成（通常の /generate など）の順伝播は数えない。
+    """
+
+    def __init__(self, model):
+        with _hook_lock:
+            if model not in _hooked_models:
+                model.register_forward_hook(_count_forward)
+                _hooked_models.add(model)
+        if getattr(_forward_counts, "counts", None) is None:
+            _forward_counts.counts = {}
+        self._key = id(model)
+        self._final = None
+        _forward_counts.counts[self._key] = 0
+
+    @property
+    def count(self):
+        if self._final is not None:
+            return self._final
+        return _forward_counts.counts.get(self._key, 0)
+
+    def remove(self):
+        """数えるのをやめる（count は最後の値のまま）"""
+        self._final = _forward_counts.counts.pop(self._key, 0)
+
+
+def check_draft_compatible(tokenizer, draft_tokenizer):
+    """ドラフトモデルがメインモデルと同じ語彙を使っているか確認する"""
+    if tokenizer.get_vocab() != draft_tokenizer.get_vocab():
+        raise ValueError("ドラフトモデルのトークナイザーがメインモデルと一致しません。同じ語彙のモデルを指定してください。")
+
+
+def generate_speculative(model, draft_model, tokenizer, inputs, cancel_token=None, **generate_kwargs):
+    """ドラフトモデルを使って生成し、新しいトークンだけをデコードする
+
+    Returns:
+        GenerationResult: stats に受理率や実効スループットを含む
+    """
+    input_ids = encode_prompt(tokenizer, inputs).to(model.device)
+    attention_mask = torch.ones_like(input_ids)
+    generate_kwargs.pop("return_full_text", None)
+    if tokenizer.pad_token_id is not None:
+        generate_kwargs.setdefault("pad_token_id", tokenizer.pad_token_id)
+    else:
+        generate_kwargs.setdefault("pad_token_id", tokenizer.eos_token_id)
+    add_cancellation(generate_kwargs, cancel_token)
+
+    # 順伝播はこのスレッドで実行されたものだけを数えるため、同時に実行しても混ざらない
+    main_counter = ForwardCounter(model)
+    draft_counter = ForwardCounter(draft_model)
+    try:
+        start = time.perf_counter()
+        with torch.inference_mode():
+            output_ids = model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                assistant_model=draft_model,
+                **generate_kwargs,
+            )
+        elapsed = time.perf_counter() - start
+    finally:
+        main_counter.remove()
+        draft_counter.remove()
+
+    prompt_tokens = input_ids.shape[-1]
+    new_ids = output_ids[0, prompt_tokens:]
+    completion_tokens = int(new_ids.shape[-1])
+    text = tokenizer.decode(new_ids, skip_special_tokens=True).strip()
+
+    # メインモデルは1回の順伝播ごとに「受理された候補 + 自身の1トークン」を確定させる。
+    # したがって 受理数 = 生成トークン数 - メインモデルの順伝播回数、
+    # 提案数 = ドラフトモデルの順伝播回数（1回の順伝播で1トークンを提案する）となる。
+    main_passes = main_counter.count
+    draft_passes = draft_counter.count
+    accepted = max(completion_tokens - main_passes, 0)
+    stats = {
+        "main_forward_passes": main_passes,
+        "draft_forward_passes": draft_passes,
+        "proposed_tokens": draft_passes,
+        "accepted_tokens": accepted,
+        "acceptance_rate": accepted / draft_passes if draft_passes else 0.0,
+        "tokens_per_forward": completion_tokens / main_passes if main_passes else 0.0,
+        "tokens_per_sec": completion_tokens / elapsed if elapsed else 0.0,
+    }
+    return GenerationResult(
+        text=text, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, stats=stats,
+        stop_reason=cancel_token.stop_reason if cancel_token is not None else None,
+    )
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# llm_common をパッケージとして読み込めるよう、day1 ディレクトリをパスに追加する
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
@@ -0,0 +1,36 @@
+import pytest
+from llm_common.backends import load_backend
+from llm_common.benchmark_speculative import DEFAULT_PROMPTS, build_tiny_models
+from llm_common.generation import generate_new_tokens
+
+# 小さなランダムモデルを使うため、モデルのダウンロードなしで（CIでも）実行できる
+
+
+@pytest.fixture(scope="module")
+def tiny_backend(tmp_path_factory):
+    """同じ語彙の小さなメインモデルとドラフトモデルを読み込んだバックエンド"""
+    main_path, draft_path = build_tiny_models(str(tmp_path_factory.mktemp("tiny")))
+    return load_backend(main_path, "hf").load_draft(draft_path)
+
+
+@pytest.mark.parametrize("prompt", DEFAULT_PROMPTS)
+def test_speculative_matches_greedy(tiny_backend, prompt):
+    """貪欲法では、投機的デコーディングの出力が通常のデコーディングと一致する"""
+    gen_kwargs = dict(max_new_tokens=16, do_sample=False)
+    baseline = generate_new_tokens(
+        tiny_backend.pipe.model, tiny_backend.tokenizer, prompt, **gen_kwargs
+    )
+    speculative = tiny_backend.generate_text(prompt, speculative=True, **gen_kwargs)
+
+    assert speculative.text == baseline.text
+    assert speculative.completion_tokens == baseline.completion_tokens
+
+
+def test_speculative_accepts_draft_tokens(tiny_backend):
+    """ドラフトモデルが提案したトークンの一部が受理される"""
+    result = tiny_backend.generate_text(
+        DEFAULT_PROMPTS[0], speculative=True, max_new_tokens=16, do_sample=False
+    )
+    stats = result.stats
+    assert stats["proposed_tokens"] > 0
+    assert 0 < stats["accepted_tokens"] <= stats["proposed_tokens"]
@@ -0,0 +1,4 @@
+# ml_common
+# 演習1・演習2・演習3 で共有するモジュール（データのキャッシュ・モデルの保存・推論時間の計測・評価指標の記録）
+from .artifact_store import ArtifactStore, data_hash
+from .data_cache import DataCache, file_hash
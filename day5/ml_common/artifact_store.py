@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import tempfile
+import joblib
+import pandas as pd
+import sklearn
+
+# アーティファクトストアの保存先（models/store/<名前>/<バージョン>/）
+DEFAULT_STORE_DIR = "models/store"
+MODEL_FILENAME = "model.joblib"
+METADATA_FILENAME = "metadata.json"
+LATEST_FILENAME = "LATEST"
+
+
+def data_hash(data):
+    """DataFrame / Series の内容からハッシュ値を計算する（学習データの識別に使う）"""
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        values = pd.util.hash_pandas_object(data, index=True).values
+        return hashlib.sha256(values.tobytes()).hexdigest()[:16]
+    return hashlib.sha256(repr(data).encode()).hexdigest()[:16]
+
+
+def _file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _model_params(model):
+    """メタデータに記録するハイパーパラメータ（Pipelineの場合は最後の推定器）"""
+    estimator = model.steps[-1][1] if hasattr(model, "steps") else model
+    if not hasattr(estimator, "get_params"):
+        return {}
+    return {
+        key: value
+        for key, value in estimator.get_params(deep=False).items()
+        if isinstance(value, (int, float, str, bool, type(None)))
+    }
+
+
+class ArtifactStore:
+    """モデルをjoblib形式で、内容のハッシュをバージョンとしたパスに保存する
+
+    - 保存先: <root>/<名前>/<バージョン>/model.joblib と metadata.json
+    - バージョンはファイル内容のSHA-256の先頭16文字（同じモデルは同じパスになる）
+
+    モデルをmmapで読み込んでプロセス間で共有することは対象外とした。sklearnの決定木は
+    読み込み時に配列をプロセスごとのメモリにコピーするため、mmap_mode="r" で読み込んでも
+    配列は共有されず、読み込みは遅くなる（演習2の benchmark_artifacts.py で確認できる）。
+    """
+
+    def __init__(self, root=DEFAULT_STORE_DIR):
+        self.root = root
+
+    def _version_dir(self, name, version):
+        return os.path.join(self.root, name, version)
+
+    def save(self, model, name="titanic_model", metrics=None, data=None, compress=0):
+        """モデルとメタデータを保存し、メタデータを返す
+
+        Args:
+            model: 保存するモデル
+            name (str): モデル名
+            metrics (dict, optional): 精度などの評価指標
+            data (optional): 学習データ（ハッシュ値をメタデータに記録する）
+            compress (int, optional): joblibの圧縮レベル（0なら圧縮しない）
+        """
+        os.makedirs(os.path.join(self.root, name), exist_ok=True)
+        # 一時ファイルに書き出してからハッシュを計算し、バージョンのディレクトリへ移動する
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, name))
+        os.close(fd)
+        try:
+            joblib.dump(model, tmp_path, compress=compress)
+            sha256 = _file_sha256(tmp_path)
+            version = sha256[:16]
+            version_dir = self._version_dir(name, version)
+            os.makedirs(version_dir, exist_ok=True)
+            model_path = os.path.join(version_dir, MODEL_FILENAME)
+            size_bytes = os.path.getsize(tmp_path)
+            os.replace(tmp_path, model_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        metadata = {
+            "name": name,
+            "version": version,
+            "sha256": sha256,
+            "size_bytes": size_bytes,
+            "compress": compress,
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "sklearn_version": sklearn.__version__,
+            "model_class": type(model).__name__,
+            "params": _model_params(model),
+            "metrics": metrics or {},
+            "data_hash": data_hash(data) if data is not None else None,
+        }
+        with open(os.path.join(version_dir, METADATA_FILENAME), "w") as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2, default=str)
+
+        # 最新バージョンの記録を置き換える
+        latest_tmp = os.path.join(self.root, name, LATEST_FILENAME + ".tmp")
+        with open(latest_tmp, "w") as f:
+            f.write(version)
+        os.replace(latest_tmp, os.path.join(self.root, name, LATEST_FILENAME))
+        return metadata
+
+    def latest_version(self, name="titanic_model"):
+        """最新のバージョン（保存されていなければNone）"""
+        path = os.path.join(self.root, name, LATEST_FILENAME)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return f.read().strip()
+
+    def versions(self, name="titanic_model"):
+        """保存されているバージョンのメタデータを作成日時の順に返す"""
+        model_dir = os.path.join(self.root, name)
+        if not os.path.isdir(model_dir):
+            return []
+        result = []
+        for version in os.listdir(model_dir):
+            metadata_path = os.path.join(model_dir, version, METADATA_FILENAME)
+            if os.path.exists(metadata_path):
+                with open(metadata_path) as f:
+                    result.append(json.load(f))
+        return sorted(result, key=lambda m: m["created_at"])
+
+    def metadata(self, name="titanic_model", version=None):
+        """メタデータを返す（version省略時は最新）"""
+        version = version or self.latest_version(name)
+        if version is None:
+            raise FileNotFoundError(f"モデル '{name}' は保存されていません")
+        with open(
+            os.path.join(self._version_dir(name, version), METADATA_FILENAME)
+        ) as f:
+            return json.load(f)
+
+    def path(self, name="titanic_model", version=None):
+        """モデルファイルのパス（version省略時は最新）"""
+        version = version or self.latest_version(name)
+        if version is None:
+            raise FileNotFoundError(f"モデル '{name}' は保存されていません")
+        return os.path.join(self._version_dir(name, version), MODEL_FILENAME)
+
+    def load(self, name="titanic_model", version=None):
+        """モデルを読み込む（version省略時は最新）"""
+        return joblib.load(self.path(name, version))
+
+    def export(self, path, name="titanic_model", version=None):
+        """保存したモデルを従来のpickle形式で path（models/titanic_model.pkl など）に書き出す"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        model = self.load(name, version)
+        with open(path, "wb") as f:
+            pickle.dump(model, f)
+        return path
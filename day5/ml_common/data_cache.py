@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import types
+import shutil
+import hashlib
+import inspect
+import tempfile
+import numpy as np
+import pandas as pd
+
+# 前処理済みデータのキャッシュの保存先（data/cache/<名前>/<キー>/）
+DEFAULT_CACHE_DIR = "data/cache"
+MANIFEST_FILENAME = "manifest.json"
+# 保存形式を変えたときに上げる（古いキャッシュは自動的に使われなくなる）
+CACHE_FORMAT_VERSION = 1
+# 元のCSVのサイズ・更新時刻とハッシュの記録（変わっていなければCSV全体を読み直さない）
+SOURCES_FILENAME = "sources.json"
+
+
+def file_hash(path):
+    """ファイル内容のSHA-256（先頭16文字）"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()[:16]
+
+
+def _local_modules(module, roots, found):
+    """module と、そこから（再帰的に）参照している roots のディレクトリにあるモジュールのファイル"""
+    path = getattr(module, "__file__", None)
+    if not path or module.__name__ in found:
+        return found
+    path = os.path.abspath(path)
+    if os.path.dirname(path) not in roots:
+        return found
+    found[module.__name__] = path
+    for value in list(vars(module).values()):
+        if isinstance(value, types.ModuleType):
+            dependency = value
+        else:
+            dependency = sys.modules.get(getattr(value, "__module__", None) or "")
+        if dependency is not None:
+            _local_modules(dependency, roots, found)
+    return found
+
+
+def code_hash(func):
+    """関数のソースと、それが使うモジュール（同じディレクトリと ml_common）全体のハッシュ
+
+    関数から呼ばれる関数（main.build_features など）が変わった場合もハッシュが変わるよう、
+    関数のモジュールが参照しているモジュールの内容も含める。
+    """
+    func = inspect.unwrap(func)
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = f"{func.__module__}.{func.__qualname__}"
+    sha = hashlib.sha256(source.encode())
+    module = sys.modules.get(getattr(func, "__module__", None) or "")
+    path = getattr(module, "__file__", None)
+    if path:
+        roots = {
+            os.path.dirname(os.path.abspath(path)),
+            os.path.dirname(os.path.abspath(__file__)),
+        }
+        # python main.py で実行したとき（__main__）とimportしたときで同じ値になるよう、
+        # モジュール名ではなくファイルの内容だけを使う
+        for module_path in sorted(set(_local_modules(module, roots, {}).values())):
+            sha.update(file_hash(module_path).encode())
+    return sha.hexdigest()[:16]
+
+
+def _normalize_missing(frame):
+    """Parquetから読み込んだobject列の欠損値（None）を、CSVと同じNaNに揃える"""
+    for col in frame.columns[frame.dtypes == object]:
+        frame[col] = frame[col].where(frame[col].notna(), np.nan)
+    return frame
+
+
+def _is_uniform_numeric(frame):
+    """全ての列が同じ数値型なら、値をそのまま1つの .npy に保存できる"""
+    dtypes = set(frame.dtypes)
+    return len(dtypes) == 1 and all(
+        isinstance(dtype, np.dtype) and dtype.kind in "biuf" for dtype in dtypes
+    )
+
+
+class DataCache:
+    """CSVから作った前処理済みのDataFrame / Seriesをファイルに保存して使い回す
+
+    - キーは元のCSVの内容のハッシュ・前処理の設定・前処理関数とそのモジュールのコードから決まる。
+      どれかが変わると別のキーになり、古いキャッシュは新しいキャッシュの保存時に削除する
+    - CSVのサイズと更新時刻が前回と同じなら、記録しておいたハッシュを使う
+    - 全ての列が同じ数値型のDataFrame（とSeries）は .npy で保存し、mmapで読み込む
+      （読み込み時にコピーせず、複数のプロセスからページキャッシュを共有できる）
+    - それ以外（文字列の列を含むなど）はParquetで保存する
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, mmap=True):
+        self.root = root
+        self.mmap = mmap
+
+    def key(self, source, build, config=None):
+        """キャッシュのキー"""
+        fingerprint = {
+            "source": self._source_hash(source),
+            "config": config or {},
+            "code": code_hash(build),
+            "format": CACHE_FORMAT_VERSION,
+        }
+        payload = json.dumps(fingerprint, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+    def load_or_build(self, name, source, build, config=None):
+        """キャッシュがあれば読み込み、なければ build(source, **config) の結果を保存して返す
+
+        Args:
+            name (str): キャッシュの名前
+            source (str): 元のCSVのパス
+            build (callable): 前処理関数。DataFrame / Series またはそのタプルを返す
+            config (dict, optional): 前処理関数に渡す設定（キーの一部になる）
+        """
+        config = config or {}
+        entry_dir = os.path.join(self.root, name, self.key(source, build, config))
+        if os.path.exists(os.path.join(entry_dir, MANIFEST_FILENAME)):
+            return self._load(entry_dir)
+        result = build(source, **config)
+        self._save(entry_dir, result)
+        self._remove_stale(name, os.path.basename(entry_dir))
+        return result
+
+    def clear(self, name=None):
+        shutil.rmtree(os.path.join(self.root, name) if name else self.root, True)
+
+    # --- 内部処理 ---
+    def _source_hash(self, source):
+        """元のCSVのハッシュ（サイズと更新時刻が前回と同じなら記録を使う）"""
+        path = os.path.abspath(source)
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        index_path = os.path.join(self.root, SOURCES_FILENAME)
+        try:
+            with open(index_path) as f:
+                sources = json.load(f)
+        except (OSError, ValueError):
+            sources = {}
+        entry = sources.get(path)
+        if entry and entry["stat"] == signature:
+            return entry["hash"]
+        digest = file_hash(path)
+        sources[path] = {"stat": signature, "hash": digest}
+        os.makedirs(self.root, exist_ok=True)
+        # 一時ファイルに書き出してから置き換える（並列に実行しても壊れない）
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=self.root)
+        with os.fdopen(fd, "w") as f:
+            json.dump(sources, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, index_path)
+        return digest
+
+    def _save(self, entry_dir, result):
+        parent = os.path.dirname(entry_dir)
+        os.makedirs(parent, exist_ok=True)
+        # 一時ディレクトリに書き出してから移動する（並列に実行しても壊れない）
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+        try:
+            items = result if isinstance(result, tuple) else (result,)
+            manifest = {
+                "tuple": isinstance(result, tuple),
+                "items": [
+                    self._save_item(tmp_dir, f"item{i}", item)
+                    for i, item in enumerate(items)
+                ],
+            }
+            with open(os.path.join(tmp_dir, MANIFEST_FILENAME), "w") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            try:
+                os.rename(tmp_dir, entry_dir)
+            except OSError:
+                pass  # 別のプロセスが先に同じキャッシュを保存した
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _save_item(self, directory, stem, item):
+        if isinstance(item, pd.Series):
+            kind, frame = "series", item.to_frame()
+        elif isinstance(item, pd.DataFrame):
+            kind, frame = "frame", item
+        else:
+            raise TypeError(f"キャッシュできない型です: {type(item).__name__}")
+        meta = {
+            "kind": kind,
+            "name": item.name if kind == "series" else None,
+            "columns": [str(col) for col in frame.columns],
+        }
+        if _is_uniform_numeric(frame):
+            meta["format"] = "npy"
+            values = frame.to_numpy()
+            np.save(
+                os.path.join(directory, f"{stem}.npy"),
+                values[:, 0] if kind == "series" else values,
+            )
+            np.save(
+                os.path.join(directory, f"{stem}.index.npy"), frame.index.to_numpy()
+            )
+        else:
+            meta["format"] = "parquet"
+            frame.to_parquet(os.path.join(directory, f"{stem}.parquet"))
+        meta["stem"] = stem
+        return meta
+
+    def _load(self, entry_dir):
+        with open(os.path.join(entry_dir, MANIFEST_FILENAME)) as f:
+            manifest = json.load(f)
+        items = tuple(self._load_item(entry_dir, meta) for meta in manifest["items"])
+        return items if manifest["tuple"] else items[0]
+
+    def _load_item(self, directory, meta):
+        path = os.path.join(directory, meta["stem"])
+        if meta["format"] == "parquet":
+            frame = _normalize_missing(
+                pd.read_parquet(path + ".parquet", memory_map=self.mmap)
+            )
+            return (
+                frame.iloc[:, 0].rename(meta["name"])
+                if meta["kind"] == "series"
+                else frame
+            )
+        mmap_mode = "r" if self.mmap else None
+        # np.memmap のサブクラスではなく、ファイルを参照する通常のndarrayとして扱う
+        values = np.asarray(np.load(path + ".npy", mmap_mode=mmap_mode))
+        index = pd.Index(np.load(path + ".index.npy", allow_pickle=True))
+        if meta["kind"] == "series":
+            return pd.Series(values, index=index, name=meta["name"], copy=False)
+        return pd.DataFrame(values, index=index, columns=meta["columns"], copy=False)
+
+    def _remove_stale(self, name, current_key):
+        """同じ名前の古いキャッシュ（元のCSVや前処理が変わる前のもの）を削除する"""
+        name_dir = os.path.join(self.root, name)
+        for entry in os.listdir(name_dir):
+            if entry != current_key and not entry.startswith(".tmp-"):
+                shutil.rmtree(os.path.join(name_dir, entry), ignore_errors=True)
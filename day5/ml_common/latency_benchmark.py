@@ -0,0 +1,271 @@
+"""推論レイテンシのベンチマーク（パーセンタイルの計測とベースラインとの比較）
+
+time.time() で1回だけ計測した予測時間は、タイマーの分解能・初回呼び出しのオーバーヘッド・
+他のプロセスの影響でばらつき、1行あたりの時間やバッチサイズによる変化もわからない。
+ここでは time.perf_counter_ns で次のように計測する。
+
+- 計測の前に何回か呼び出す（ウォームアップ。遅延初期化やキャッシュの影響を除く）
+- バッチサイズ（1, 32, 1,000, 100,000行）ごとに、最低 min_repeats 回かつ合計 min_time 秒まで繰り返す
+- p50 / p90 / p99・1行あたりの時間（p50 / バッチサイズ）・rows/sec を求める
+
+共有のCIランナーや仮想マシンでは、同じコードでもプロセスごとに速さが3割以上変わる。
+そのため毎回の計測の直前に決まった計算（calibrate）の時間も測り、その比の中央値
+（relative_p50）も求める。マシン全体が遅くなった場合は両方が遅くなるため、比はほとんど
+変わらない（この環境では生の p50 が±30%変わっても比は±8%程度）。
+
+結果はJSONのベースラインとして保存する。ベースラインは実行環境（OS・Python・ライブラリの
+バージョン）ごとに別のファイルになり、同じ環境のベースラインの relative_p50 より tolerance を
+超えて遅くなったバッチサイズを回帰として報告する。CIのランナーごとに変わるCPUの種類や
+コア数は実行環境に含めない（マシンの速さの違いは relative_p50 で打ち消す）。
+
+使用例（演習2・演習3のディレクトリで実行）:
+    python ../ml_common/latency_benchmark.py --model models/titanic_model.pkl
+    python ../ml_common/latency_benchmark.py --model models/titanic_model.pkl \
+        --update-baseline
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import platform
+import numpy as np
+import pandas as pd
+
+BATCH_SIZES = [1, 32, 1_000, 100_000]
+# relative_p50 がベースラインよりこの割合を超えて遅くなったら回帰とする
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_BASELINE_DIR = "benchmarks"
+PERCENTILES = [50, 90, 99]
+# 比較の基準にする計算に使う配列（毎回同じ値）
+_CALIBRATION_ARRAY = np.random.default_rng(0).random(20_000)
+
+
+def calibrate():
+    """マシンの速さの基準にする、決まった量の計算（Pythonのループと NumPy のソート）"""
+    total = 0
+    for i in range(20_000):
+        total += i * i
+    np.sort(_CALIBRATION_ARRAY)
+    return total
+
+
+def environment():
+    """計測した環境（ベースラインはこの環境ごとに分ける）"""
+    import sklearn
+
+    return {
+        "os": platform.system(),
+        "machine": platform.machine(),
+        "python": f"{sys.version_info.major}.{sys.version_info.minor}",
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "sklearn": sklearn.__version__,
+    }
+
+
+def environment_key(env=None):
+    payload = json.dumps(env or environment(), sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:12]
+
+
+def make_batch(X, batch_size, seed=0):
+    """X から batch_size 行を取り出す（足りない場合は重複を許して取り出す）"""
+    batch = X.sample(batch_size, replace=batch_size > len(X), random_state=seed)
+    return batch.reset_index(drop=True)
+
+
+def time_calls(
+    func,
+    arg,
+    warmup=3,
+    min_repeats=5,
+    max_repeats=1000,
+    min_time=0.5,
+    calibrated=False,
+):
+    """func(arg) の1回ごとの実行時間（ナノ秒）の配列
+
+    calibrated=True なら、毎回の直前に計測した calibrate() の時間の配列も返す。
+    """
+    for _ in range(warmup):
+        func(arg)
+        if calibrated:
+            calibrate()
+    times, calibration = [], []
+    deadline = time.perf_counter_ns() + int(min_time * 1e9)
+    while len(times) < max_repeats and (
+        len(times) < min_repeats or time.perf_counter_ns() < deadline
+    ):
+        if calibrated:
+            start = time.perf_counter_ns()
+            calibrate()
+            calibration.append(time.perf_counter_ns() - start)
+        start = time.perf_counter_ns()
+        func(arg)
+        times.append(time.perf_counter_ns() - start)
+    if calibrated:
+        return np.array(times), np.array(calibration)
+    return np.array(times)
+
+
+def summarize(times_ns, batch_size, calibration_ns=None):
+    """実行時間（ナノ秒）のパーセンタイルと1行あたりの時間（秒）"""
+    seconds = times_ns / 1e9
+    stats = {f"p{p}": float(np.percentile(seconds, p)) for p in PERCENTILES}
+    stats.update(
+        mean=float(seconds.mean()),
+        min=float(seconds.min()),
+        repeats=int(len(seconds)),
+        per_row=stats["p50"] / batch_size,
+        rows_per_sec=batch_size / stats["p50"],
+    )
+    if calibration_ns is not None:
+        # 直前に計測した基準の計算との比（マシン全体の速さの変化を打ち消す）
+        stats["relative_p50"] = float(np.median(times_ns / calibration_ns))
+    return stats
+
+
+def time_relative(func, repeats=3):
+    """func() を repeats 回実行し、実行時間（秒）と calibrate() との比の中央値を求める
+
+    学習のように1回が長く、何度も繰り返せない処理の計測に使う。
+
+    Returns:
+        tuple: (最後の func() の戻り値, {"seconds": 秒, "relative": 比})
+    """
+    seconds, ratios = [], []
+    for _ in range(repeats):
+        start = time.perf_counter_ns()
+        calibrate()
+        calibration = time.perf_counter_ns() - start
+        start = time.perf_counter_ns()
+        result = func()
+        elapsed = time.perf_counter_ns() - start
+        seconds.append(elapsed / 1e9)
+        ratios.append(elapsed / calibration)
+    return result, {
+        "seconds": float(np.median(seconds)),
+        "relative": float(np.median(ratios)),
+    }
+
+
+def run_benchmark(predict, X, batch_sizes=BATCH_SIZES, warmup=3, min_time=0.5):
+    """バッチサイズごとに predict の実行時間を計測する
+
+    Returns:
+        dict: {"environment": 実行環境, "results": {バッチサイズ(文字列): 統計値}}
+    """
+    results = {}
+    for batch_size in batch_sizes:
+        batch = make_batch(X, batch_size)
+        times, calibration = time_calls(
+            predict, batch, warmup=warmup, min_time=min_time, calibrated=True
+        )
+        results[str(batch_size)] = summarize(times, batch_size, calibration)
+    return {"environment": environment(), "results": results}
+
+
+def baseline_path(directory, name, env=None):
+    return os.path.join(directory, f"{name}-{environment_key(env)}.json")
+
+
+def save_baseline(path, report):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_with_baseline(
+    report, baseline, tolerance=DEFAULT_TOLERANCE, stat="relative_p50"
+):
+    """ベースラインより tolerance を超えて遅くなったバッチサイズのリスト"""
+    regressions = []
+    for batch_size, current in report["results"].items():
+        previous = baseline["results"].get(batch_size)
+        if previous is None:
+            continue
+        ratio = current[stat] / previous[stat]
+        if ratio > 1 + tolerance:
+            regressions.append(
+                {
+                    "batch_size": int(batch_size),
+                    "stat": stat,
+                    "baseline": previous[stat],
+                    "current": current[stat],
+                    "ratio": ratio,
+                }
+            )
+    return regressions
+
+
+def format_report(report, baseline=None):
+    lines = [
+        f"{'batch':>8}{'p50(ms)':>11}{'p90(ms)':>11}{'p99(ms)':>11}"
+        f"{'µs/row':>10}{'rows/sec':>12}{'repeats':>9}{'relative':>10}"
+        + (f"{'vs base':>9}" if baseline else "")
+    ]
+    for batch_size, s in report["results"].items():
+        line = (
+            f"{int(batch_size):>8,}{s['p50'] * 1e3:>11.3f}{s['p90'] * 1e3:>11.3f}"
+            f"{s['p99'] * 1e3:>11.3f}{s['per_row'] * 1e6:>10.2f}"
+            f"{s['rows_per_sec']:>12,.0f}{s['repeats']:>9}"
+            f"{s.get('relative_p50', float('nan')):>10.2f}"
+        )
+        previous = (baseline or {}).get("results", {}).get(batch_size)
+        if previous and "relative_p50" in previous and "relative_p50" in s:
+            line += f"{s['relative_p50'] / previous['relative_p50']:>8.2f}x"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main():
+    import joblib
+
+    parser = argparse.ArgumentParser(description="推論レイテンシのベンチマーク")
+    parser.add_argument("--model", default="models/titanic_model.pkl")
+    parser.add_argument("--data", default="data/Titanic.csv")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--baseline-dir", default=DEFAULT_BASELINE_DIR)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="比較せずに今回の結果をベースラインとして保存する",
+    )
+    args = parser.parse_args()
+
+    model = joblib.load(args.model)
+    X = pd.read_csv(args.data).drop(columns=["Survived"], errors="ignore")
+    report = run_benchmark(model.predict, X, batch_sizes=args.batch_sizes)
+
+    name = os.path.splitext(os.path.basename(args.model))[0]
+    path = baseline_path(args.baseline_dir, name)
+    baseline = None if args.update_baseline else load_baseline(path)
+    print(format_report(report, baseline))
+    if baseline is None:
+        save_baseline(path, report)
+        print(f"ベースラインを保存しました: {path}")
+        return
+    regressions = compare_with_baseline(report, baseline, args.tolerance)
+    for r in regressions:
+        print(
+            f"回帰: {r['batch_size']:,}行の{r['stat']}が"
+            f"{r['baseline']:.2f} → {r['current']:.2f} ({r['ratio']:.2f}倍)"
+        )
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""モデルの評価指標の記録とベースラインとの比較（SQLite）
+
+実行ごとに精度・推論時間のパーセンタイル・モデルのサイズ・学習時間を、git のコミットと
+学習データのハッシュと一緒に SQLite のファイルへ記録する。承認（accept）した実行が
+ベースラインになり、新しい実行は同じモデル名・同じ実行環境で最後に承認された実行と比べて、
+REGRESSION_RULES のどれかの指標で許容範囲を超えて悪くなっていれば回帰として報告する。
+同じモデル名・同じ実行環境で承認された実行がまだなければ、check() は今回の実行を承認する
+（最初の実行や、ライブラリの更新で実行環境が変わった直後は比べずにベースラインにする）。
+
+時間の指標は、マシン全体の速さの変化を打ち消すため latency_benchmark の calibrate() との比
+（relative_p50, train_time_relative）で比べる。生の秒数も記録するが比較には使わない。
+
+使用例（演習2・演習3のディレクトリで実行）:
+    python ../ml_common/metrics_store.py history
+    python ../ml_common/metrics_store.py compare 12
+    python ../ml_common/metrics_store.py accept 12
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import argparse
+import datetime
+import fnmatch
+import subprocess
+
+DEFAULT_DB_PATH = "benchmarks/metrics.db"
+DEFAULT_NAME = "titanic_model"
+# 回帰の判定: (指標名のパターン, 良い方向, 許容する変化, 変化の種類)
+REGRESSION_RULES = [
+    ("accuracy", "higher", 0.01, "absolute"),
+    ("latency.*.relative_p50", "lower", 0.20, "relative"),
+    ("model_size", "lower", 0.20, "relative"),
+    ("train_time_relative", "lower", 0.30, "relative"),
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    name TEXT NOT NULL,
+    git_commit TEXT,
+    data_hash TEXT,
+    environment TEXT,
+    params TEXT,
+    accepted INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (run_id, name)
+);
+CREATE INDEX IF NOT EXISTS runs_baseline ON runs(name, environment, accepted, id);
+"""
+
+
+def git_commit():
+    """現在のコミット（作業ツリーに変更があれば末尾に -dirty を付ける）"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if status.strip() else "")
+
+
+def file_hash(path):
+    """ファイル内容のSHA-256（先頭16文字）"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()[:16]
+
+
+def flatten_latency(report):
+    """latency_benchmark.run_benchmark の結果を記録用の指標名に展開する"""
+    metrics = {}
+    for batch_size, stats in report["results"].items():
+        for stat in ("p50", "p90", "p99", "per_row", "relative_p50"):
+            if stat in stats:
+                metrics[f"latency.{batch_size}.{stat}"] = stats[stat]
+    return metrics
+
+
+def find_regressions(current, baseline, rules=REGRESSION_RULES):
+    """ベースラインより許容範囲を超えて悪くなった指標のリスト"""
+    regressions = []
+    for name in sorted(current):
+        if name not in baseline:
+            continue
+        for pattern, better, tolerance, kind in rules:
+            if not fnmatch.fnmatchcase(name, pattern):
+                continue
+            before, after = baseline[name], current[name]
+            # 悪くなった量（正なら悪化）
+            change = after - before if better == "lower" else before - after
+            if kind == "relative":
+                change = change / before if before else 0.0
+            if change > tolerance:
+                regressions.append(
+                    {
+                        "metric": name,
+                        "baseline": before,
+                        "current": after,
+                        "change": change,
+                        "tolerance": tolerance,
+                        "kind": kind,
+                    }
+                )
+            break
+    return regressions
+
+
+def format_regressions(regressions):
+    lines = []
+    for r in regressions:
+        change = (
+            f"{r['change']:+.1%}" if r["kind"] == "relative" else f"{r['change']:+.4f}"
+        )
+        lines.append(
+            f"{r['metric']}: {r['baseline']:.6g} → {r['current']:.6g} "
+            f"(悪化 {change}, 許容 {r['tolerance']:g})"
+        )
+    return "\n".join(lines)
+
+
+class MetricsStore:
+    """実行ごとの評価指標を SQLite に記録し、承認したベースラインと比べる"""
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        # 並列のテストワーカーから同時に書き込んでも待ち合わせる
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def record(
+        self,
+        metrics,
+        name=DEFAULT_NAME,
+        commit=None,
+        data_hash=None,
+        environment=None,
+        params=None,
+        accepted=False,
+    ):
+        """評価指標を記録し、実行のIDを返す（commit を省略すると現在のコミット）"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO runs (created_at, name, git_commit, data_hash,"
+                " environment, params, accepted) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    name,
+                    commit if commit is not None else git_commit(),
+                    data_hash,
+                    environment,
+                    json.dumps(params, sort_keys=True, default=str),
+                    int(accepted),
+                ),
+            )
+            run_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO metrics (run_id, name, value) VALUES (?, ?, ?)",
+                [(run_id, key, float(value)) for key, value in metrics.items()],
+            )
+        return run_id
+
+    def accept(self, run_id):
+        """実行をベースラインとして承認する"""
+        with self._connect() as conn:
+            conn.execute("UPDATE runs SET accepted = 1 WHERE id = ?", (run_id,))
+
+    def run(self, run_id):
+        """実行の情報と評価指標（"metrics"）"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+            if row is None:
+                return None
+            metrics = conn.execute(
+                "SELECT name, value FROM metrics WHERE run_id = ?", (run_id,)
+            ).fetchall()
+        run = dict(row)
+        run["params"] = json.loads(run["params"]) if run["params"] else None
+        run["metrics"] = {m["name"]: m["value"] for m in metrics}
+        return run
+
+    def baseline(self, name=DEFAULT_NAME, environment=None, before=None):
+        """最後に承認された実行（environment を指定すると同じ実行環境のもの）"""
+        query = "SELECT id FROM runs WHERE name = ? AND accepted = 1"
+        args = [name]
+        if environment is not None:
+            query += " AND environment = ?"
+            args.append(environment)
+        if before is not None:
+            query += " AND id < ?"
+            args.append(before)
+        with self._connect() as conn:
+            row = conn.execute(query + " ORDER BY id DESC LIMIT 1", args).fetchone()
+        return self.run(row["id"]) if row else None
+
+    def compare(self, run_id, rules=REGRESSION_RULES):
+        """実行を、それより前に承認された同じ名前・同じ環境のベースラインと比べる
+
+        Returns:
+            tuple: (ベースラインの実行（なければ None）, 回帰のリスト)
+        """
+        run = self.run(run_id)
+        baseline = self.baseline(run["name"], run["environment"], before=run_id)
+        if baseline is None:
+            return None, []
+        return baseline, find_regressions(run["metrics"], baseline["metrics"], rules)
+
+    def check(self, run_id, accept=False, rules=REGRESSION_RULES):
+        """実行をベースラインと比べ、比べるベースラインがなければ今回の実行を承認する
+
+        accept=True なら比べずに承認する。
+
+        Returns:
+            tuple: (ベースラインの実行（承認した場合は None）, 回帰のリスト)
+        """
+        baseline, regressions = (None, []) if accept else self.compare(run_id, rules)
+        if baseline is None:
+            self.accept(run_id)
+        return baseline, regressions
+
+    def history(self, name=None, limit=20):
+        query = "SELECT * FROM runs"
+        args = []
+        if name is not None:
+            query += " WHERE name = ?"
+            args.append(name)
+        with self._connect() as conn:
+            rows = conn.execute(
+                query + " ORDER BY id DESC LIMIT ?", args + [limit]
+            ).fetchall()
+        return [self.run(row["id"]) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="評価指標の記録とベースラインとの比較")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    history = subparsers.add_parser("history", help="最近の実行の一覧")
+    history.add_argument("--limit", type=int, default=20)
+    for command in ("compare", "accept"):
+        sub = subparsers.add_parser(command)
+        sub.add_argument("run_id", type=int)
+    args = parser.parse_args()
+
+    store = MetricsStore(args.db)
+    if args.command == "history":
+        for run in store.history(limit=args.limit):
+            metrics = run["metrics"]
+            print(
+                f"#{run['id']:<5}{run['created_at'][:19]}  {run['name']:<16}"
+                f"{(run['git_commit'] or '-')[:12]:<14}"
+                f"{'承認' if run['accepted'] else '':<4}"
+                f"accuracy={metrics.get('accuracy', float('nan')):.4f}"
+            )
+    elif args.command == "accept":
+        store.accept(args.run_id)
+        print(f"#{args.run_id} をベースラインとして承認しました")
+    else:
+        baseline, regressions = store.compare(args.run_id)
+        if baseline is None:
+            print("比較できるベースラインがありません")
+            return
+        print(f"ベースライン: #{baseline['id']} ({baseline['git_commit']})")
+        print(format_regressions(regressions) or "回帰はありません")
+        raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,62 @@
 import os
+import sys
 import mlflow
 import mlflow.sklearn
 import pandas as pd
 import numpy as np
 import random
-import pickle
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score
 from sklearn.preprocessing import LabelEncoder
 from mlflow.models.signature import infer_signature
+# 演習1・演習2・演習3 で共有するモジュール（day5/ml_common）を読み込めるようにする
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ml_common.artifact_store import ArtifactStore
+from ml_common.data_cache import DataCache
 
+# 使用する特徴量と目的変数
+FEATURES = ["Pclass", "Sex", "Age", "Fare"]
+TARGET = "Survived"
 
-# データ準備
-def prepare_data(test_size=0.2, random_state=42):
+
+# 前処理（CSVから特徴量と目的変数を作る）
+def build_features(path, features=FEATURES, target=TARGET):
     # Titanicデータセットの読み込み
-    path = "data/Titanic.csv"
     data = pd.read_csv(path)
 
     # 必要な特徴量の選択と前処理
-    data = data[["Pclass", "Sex", "Age", "Fare", "Survived"]].dropna()
+    data = data[features + [target]].dropna()
     data["Sex"] = LabelEncoder().fit_transform(data["Sex"])  # 性別を数値に変換
 
     # 整数型の列を浮動小数点型に変換
-    data["Pclass"] = data["Pclass"].astype(float)
-    data["Sex"] = data["Sex"].astype(float)
-    data["Age"] = data["Age"].astype(float)
-    data["Fare"] = data["Fare"].astype(float)
-    data["Survived"] = data["Survived"].astype(float)
+    data = data.astype(float)
+
+    X = data[features]
+    y = data[target]
+    return X, y
+
+
+# データ読み込みと前処理
+def load_dataset(path="data/Titanic.csv", use_cache=True):
+    """前処理済みの (X, y) を返す
+
+    結果は data/cache に保存し、CSVの内容・特徴量の設定・build_features のコードが
+    変わらない限り、次回からは保存したファイルをmmapで読み込む。
+    """
+    if not use_cache:
+        return build_features(path)
+    return DataCache().load_or_build(
+        "titanic_features",
+        path,
+        build_features,
+        config={"features": FEATURES, "target": TARGET},
+    )
 
-    X = data[["Pclass", "Sex", "Age", "Fare"]]
-    y = data["Survived"]
+
+# データ準備
+def prepare_data(test_size=0.2, random_state=42):
+    X, y = load_dataset()
 
     # データ分割
     X_train, X_test, y_train, y_test = train_test_split(
@@ -41,10 +67,20 @@ def prepare_data(test_size=0.2, random_state=42):
 
 # 学習と評価
 def train_and_evaluate(
-    X_train, X_test, y_train, y_test, n_estimators=100, max_depth=None, random_state=42
+    X_train,
+    X_test,
+    y_train,
+    y_test,
+    n_estimators=100,
+    max_depth=None,
+    random_state=42,
+    n_jobs=None,
 ):
     model = RandomForestClassifier(
-        n_estimators=n_estimators, max_depth=max_depth, random_state=random_state
+        n_estimators=n_estimators,
+        max_depth=max_depth,
+        random_state=random_state,
+        n_jobs=n_jobs,
     )
     model.fit(X_train, y_train)
     predictions = model.predict(X_test)
@@ -115,9 +151,12 @@ if __name__ == "__main__":
     # モデル保存
     log_model(model, accuracy, params)
 
-    model_dir = "models"
-    os.makedirs(model_dir, exist_ok=True)
-    model_path = os.path.join(model_dir, f"titanic_model.pkl")
-    with open(model_path, "wb") as f:
-        pickle.dump(model, f)
-    print(f"モデルを {model_path} に保存しました")
+    # アーティファクトストアに保存し、従来のパスにもコピーする
+    store = ArtifactStore("models/store")
+    metadata = store.save(
+        model, metrics={"accuracy": accuracy}, data=X_train, compress=0
+    )
+    model_path = store.export(
+        os.path.join("models", "titanic_model.pkl"), version=metadata["version"]
+    )
+    print(f"モデルを {model_path} に保存しました (バージョン: {metadata['version']})")
@@ -1,17 +1,43 @@
-from kedro.io import MemoryDataset, KedroDataCatalog
-from kedro.pipeline import Pipeline, node
-from kedro.runner import SequentialRunner
+from kedro.io import MemoryDataset
+from kedro.pipeline import Pipeline
+from kedro.runner import ParallelRunner, SequentialRunner, ThreadRunner
 from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestClassifier
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import accuracy_score
-from sklearn.preprocessing import LabelEncoder
-import pandas as pd
 import mlflow
 import mlflow.sklearn
 from mlflow.models.signature import infer_signature
 import os
+import time
 import random
+import statistics
+import argparse
 import logging
+from main import load_dataset
+from pipeline_support import (
+    JoblibDataset,
+    JSONDataset,
+    ParquetDataset,
+    SEQUENTIAL_TAG,
+    SourceFileDataset,
+    format_report,
+    format_selection,
+    run_pipeline,
+    timed_node,
+)
+
+try:
+    from kedro.io import KedroDataCatalog as DataCatalog
+except ImportError:  # Kedro 1.0以降は DataCatalog に統合された
+    from kedro.io import DataCatalog
+try:
+    # Kedro 1.0以降の ParallelRunner は共有メモリに対応したカタログが必要
+    from kedro.io import SharedMemoryDataCatalog
+except ImportError:
+    SharedMemoryDataCatalog = DataCatalog
 
 # ロガーの設定
 logging.basicConfig(
@@ -19,33 +45,32 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ノードの出力の保存先
+PIPELINE_DIR = "data/pipeline"
+RUNNERS = {
+    "sequential": SequentialRunner,
+    "thread": ThreadRunner,
+    "parallel": ParallelRunner,
+}
+# 比較するモデル（同じ分割で学習・評価し、select_model で1つを選ぶ）
+CANDIDATES = ["random_forest", "gradient_boosting", "logistic_regression"]
+# モデルの選び方: 最も高い精度から accuracy_tolerance 以内のモデルのうち、
+# 1行あたりの推論時間 → 学習時間 → 精度の順に比べて選ぶ（上限を超えるモデルは除外）
+SELECTION_POLICY = {
+    "accuracy_tolerance": 0.01,
+    "max_inference_time_per_row": None,
+    "max_train_time": None,
+}
+# 推論時間の計測の繰り返し回数（中央値を使う）
+INFERENCE_REPEATS = 5
+
 
 # データ準備
-def prepare_data():
+def prepare_data(path):
     try:
-        # Titanicデータセットの読み込み
-        path = "data/Titanic.csv"
-        if not os.path.exists(path):
-            raise FileNotFoundError(f"データファイルが見つかりません: {path}")
-
-        data = pd.read_csv(path)
-        logger.info(f"データを読み込みました。行数: {len(data)}")
-
-        # 必要な特徴量の選択と前処理
-        data = data[["Pclass", "Sex", "Age", "Fare", "Survived"]].dropna()
-        logger.info(f"欠損値削除後の行数: {len(data)}")
-
-        data["Sex"] = LabelEncoder().fit_transform(data["Sex"])  # 性別を数値に変換
-
-        # 整数型の列を浮動小数点型に変換
-        data["Pclass"] = data["Pclass"].astype(float)
-        data["Sex"] = data["Sex"].astype(float)
-        data["Age"] = data["Age"].astype(float)
-        data["Fare"] = data["Fare"].astype(float)
-        data["Survived"] = data["Survived"].astype(float)
-
-        X = data[["Pclass", "Sex", "Age", "Fare"]]
-        y = data["Survived"]
+        # 前処理済みのデータはキャッシュ（data/cache）から読み込む
+        X, y = load_dataset(path)
+        logger.info(f"前処理済みのデータを読み込みました。行数: {len(X)}")
 
         # データ分割
         X_train, X_test, y_train, y_test = train_test_split(
@@ -60,47 +85,162 @@ def prepare_data():
         raise
 
 
-# 学習と評価
-def train_and_evaluate(X_train, X_test, y_train, y_test):
-    try:
-        # ハイパーパラメータの設定
-        params = {
-            "n_estimators": random.randint(50, 200),
-            "max_depth": random.choice([None, 3, 5, 10, 15]),
-            "min_samples_split": 2,
+# ハイパーパラメータの設定
+def sample_model_params(seed=None):
+    rng = random.Random(seed)
+    return {
+        "n_estimators": rng.randint(50, 200),
+        "max_depth": rng.choice([None, 3, 5, 10, 15]),
+        "min_samples_split": 2,
+        "random_state": 42,
+    }
+
+
+def candidate_params(seed=None):
+    """各モデルのハイパーパラメータ（ランダムフォレストは seed から決める）"""
+    return {
+        "random_forest": sample_model_params(seed),
+        "gradient_boosting": {
+            "n_estimators": 100,
+            "learning_rate": 0.1,
+            "max_depth": 3,
             "random_state": 42,
-        }
+        },
+        "logistic_regression": {"C": 1.0, "max_iter": 1000},
+    }
 
-        model = RandomForestClassifier(**params)
-        model.fit(X_train, y_train)
+
+def build_model(family, params):
+    if family == "random_forest":
+        return RandomForestClassifier(**params)
+    if family == "gradient_boosting":
+        return GradientBoostingClassifier(**params)
+    if family == "logistic_regression":
+        # 線形モデルは特徴量のスケールを揃える
+        return make_pipeline(StandardScaler(), LogisticRegression(**params))
+    raise ValueError(f"未対応のモデルです: {family}")
+
+
+# 評価（推論時間は繰り返し計測した中央値）
+def evaluate_model(model, X_test, y_test, repeats=INFERENCE_REPEATS):
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
         predictions = model.predict(X_test)
-        accuracy = accuracy_score(y_test, predictions)
-        logger.info(f"モデルの精度: {accuracy:.4f}")
-        return model, accuracy, params
+        times.append(time.perf_counter() - start_time)
+    inference_time = statistics.median(times)
+    accuracy = accuracy_score(y_test, predictions)
+    return {
+        "accuracy": accuracy,
+        "inference_time": inference_time,
+        "inference_time_per_row": inference_time / len(X_test),
+    }
+
+
+# 学習と評価（候補のモデルごとに1つのノード）
+def train_candidate(X_train, X_test, y_train, y_test, candidate):
+    try:
+        model = build_model(candidate["family"], candidate["params"])
+        start_time = time.perf_counter()
+        model.fit(X_train, y_train)
+        train_time = time.perf_counter() - start_time
+
+        metrics = evaluate_model(model, X_test, y_test)
+        metrics.update(family=candidate["family"], train_time=train_time)
+        logger.info(
+            f"{candidate['family']}: 精度 {metrics['accuracy']:.4f}, "
+            f"学習 {train_time:.3f}秒, "
+            f"推論 {metrics['inference_time_per_row'] * 1e6:.2f}µs/行"
+        )
+        return model, metrics
     except Exception as e:
         logger.error(f"モデル学習中にエラーが発生しました: {str(e)}")
         raise
 
 
-# モデル保存
-def log_model(model, accuracy, params, X_train, X_test):
+# モデルの選択
+def select_model(policy, **candidates):
+    """評価指標を集計し、SELECTION_POLICY に従って1つのモデルを選ぶ
+
+    Returns:
+        dict: {"winner": 選んだモデルの名前, "policy": 選び方, "candidates": 各モデルの
+        評価指標と順位（"rank"）、除外された理由（"rejected"）}
+    """
+    table = {name: dict(metrics) for name, metrics in candidates.items()}
+    limits = {
+        "inference_time_per_row": policy.get("max_inference_time_per_row"),
+        "train_time": policy.get("max_train_time"),
+    }
+    for metrics in table.values():
+        over = [
+            key
+            for key, limit in limits.items()
+            if limit is not None and metrics[key] > limit
+        ]
+        metrics["rejected"] = over or None
+
+    eligible = [name for name, m in table.items() if not m["rejected"]]
+    if not eligible:
+        raise ValueError("選択の条件を満たすモデルがありません")
+    best_accuracy = max(table[name]["accuracy"] for name in eligible)
+    threshold = best_accuracy - policy.get("accuracy_tolerance", 0.0)
+
+    def sort_key(name):
+        m = table[name]
+        return (
+            m["accuracy"] < threshold,  # 精度が許容範囲内のモデルを優先する
+            m["inference_time_per_row"],
+            m["train_time"],
+            -m["accuracy"],
+            name,
+        )
+
+    ranking = sorted(eligible, key=sort_key)
+    for rank, name in enumerate(ranking, start=1):
+        table[name]["rank"] = rank
+    winner = ranking[0]
+    logger.info(f"選択したモデル: {winner} (精度 {table[winner]['accuracy']:.4f})")
+    return {"winner": winner, "policy": policy, "candidates": table}
+
+
+# モデル保存（選択したモデルを記録する）
+def log_model(selection, params, X_train, X_test, **models):
     try:
+        winner = selection["winner"]
+        model = models[winner]
+        metrics = selection["candidates"][winner]
+
         # 実験名の設定
         mlflow.set_experiment("titanic-survival-prediction")
 
-        with mlflow.start_run():
+        with mlflow.start_run(run_name=winner):
             # メトリクスのロギング
-            mlflow.log_metric("accuracy", accuracy)
+            mlflow.log_metrics(
+                {
+                    key: metrics[key]
+                    for key in (
+                        "accuracy",
+                        "train_time",
+                        "inference_time",
+                        "inference_time_per_row",
+                    )
+                }
+            )
 
             # ハイパーパラメータのロギング
-            mlflow.log_params(params)
+            mlflow.log_param("model_family", winner)
+            mlflow.log_params(params[winner])
 
-            # 重要な特徴量のロギング
-            feature_importances = model.feature_importances_
-            for i, feature in enumerate(X_train.columns):
-                mlflow.log_metric(
-                    f"feature_importance_{feature}", feature_importances[i]
-                )
+            # 全ての候補の評価指標と選択の条件
+            mlflow.log_dict(selection, "selection.json")
+
+            # 重要な特徴量のロギング（決定木系のモデルのみ）
+            estimator = model[-1] if hasattr(model, "steps") else model
+            if hasattr(estimator, "feature_importances_"):
+                for feature, importance in zip(
+                    X_train.columns, estimator.feature_importances_
+                ):
+                    mlflow.log_metric(f"feature_importance_{feature}", importance)
 
             # モデルのシグネチャを推論
             signature = infer_signature(X_train, model.predict(X_train))
@@ -111,67 +251,148 @@ def log_model(model, accuracy, params, X_train, X_test):
                 "model",
                 signature=signature,
                 input_example=X_test.iloc[:5],  # 入力例を指定
+                serialization_format=mlflow.sklearn.SERIALIZATION_FORMAT_CLOUDPICKLE,
             )
 
             # アーティファクトの場所を取得してログに出力
             run_id = mlflow.active_run().info.run_id
             logger.info(f"モデルを記録しました。Run ID: {run_id}")
-            logger.info(f"精度: {accuracy:.4f}")
+            logger.info(f"精度: {metrics['accuracy']:.4f}")
     except Exception as e:
         logger.error(f"MLflowでのモデル記録中にエラーが発生しました: {str(e)}")
         raise
 
 
 # Kedro パイプラインの定義
-def create_pipeline():
-    return Pipeline(
-        [
-            node(
-                prepare_data,
-                inputs=None,
-                outputs=["X_train", "X_test", "y_train", "y_test"],
-                name="prepare_data",
-            ),
-            node(
-                train_and_evaluate,
-                inputs=["X_train", "X_test", "y_train", "y_test"],
-                outputs=["model", "accuracy", "params"],
-                name="train_and_evaluate",
-            ),
-            node(
-                log_model,
-                inputs=["model", "accuracy", "params", "X_train", "X_test"],
-                outputs=None,
-                name="log_model",
-            ),
-        ]
+def create_pipeline(candidates=CANDIDATES):
+    # 候補ごとの学習ノードは学習時間・推論時間を比べるため、ランナーに関係なく1つずつ実行する
+    split = ["X_train", "X_test", "y_train", "y_test"]
+    nodes = [
+        timed_node(
+            prepare_data,
+            inputs="titanic_csv",
+            outputs=split,
+            name="prepare_data",
+        )
+    ]
+    for name in candidates:
+        nodes.append(
+            timed_node(
+                train_candidate,
+                inputs=split + [f"params:candidate.{name}"],
+                outputs=[f"model.{name}", f"metrics.{name}"],
+                name=f"train_{name}",
+                tags=[SEQUENTIAL_TAG],
+            )
+        )
+    nodes.append(
+        timed_node(
+            select_model,
+            inputs={
+                "policy": "params:selection",
+                **{name: f"metrics.{name}" for name in candidates},
+            },
+            outputs="selection",
+            name="select_model",
+        )
     )
+    nodes.append(
+        timed_node(
+            log_model,
+            inputs={
+                "selection": "selection",
+                "params": "params:model",
+                "X_train": "X_train",
+                "X_test": "X_test",
+                **{name: f"model.{name}" for name in candidates},
+            },
+            outputs=None,
+            name="log_model",
+        )
+    )
+    return Pipeline(nodes)
+
+
+# データカタログの定義（ノードの出力はファイルに保存する）
+def create_datasets(
+    model_params,
+    selection_policy=SELECTION_POLICY,
+    data_path="data/Titanic.csv",
+    base_dir=PIPELINE_DIR,
+):
+    datasets = {
+        "titanic_csv": SourceFileDataset(data_path),
+        "params:model": MemoryDataset(model_params),
+        "params:selection": MemoryDataset(selection_policy),
+        "X_train": ParquetDataset(os.path.join(base_dir, "X_train.parquet")),
+        "X_test": ParquetDataset(os.path.join(base_dir, "X_test.parquet")),
+        "y_train": ParquetDataset(
+            os.path.join(base_dir, "y_train.parquet"), series=True
+        ),
+        "y_test": ParquetDataset(os.path.join(base_dir, "y_test.parquet"), series=True),
+        "selection": JSONDataset(os.path.join(base_dir, "selection.json")),
+    }
+    for name, params in model_params.items():
+        datasets[f"params:candidate.{name}"] = MemoryDataset(
+            {"family": name, "params": params}
+        )
+        datasets[f"model.{name}"] = JoblibDataset(
+            os.path.join(base_dir, "models", f"{name}.joblib")
+        )
+        datasets[f"metrics.{name}"] = JSONDataset(
+            os.path.join(base_dir, "metrics", f"{name}.json")
+        )
+    return datasets
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kedroパイプラインの実行")
+    parser.add_argument("--runner", choices=sorted(RUNNERS), default="thread")
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        choices=CANDIDATES,
+        default=CANDIDATES,
+        help="比較するモデル",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="ハイパーパラメータの乱数のシード（同じシードなら学習を省略できる）",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="全てのノードを実行し直す"
+    )
+    args = parser.parse_args()
+
     try:
         # パイプラインの作成
-        pipeline = create_pipeline()
+        pipeline = create_pipeline(args.models)
 
         # データカタログの作成
-        catalog = KedroDataCatalog(
-            {
-                "X_train": MemoryDataset(),
-                "X_test": MemoryDataset(),
-                "y_train": MemoryDataset(),
-                "y_test": MemoryDataset(),
-                "model": MemoryDataset(),
-                "accuracy": MemoryDataset(),
-                "params": MemoryDataset(),
-            }
+        model_params = candidate_params(args.seed)
+        datasets = create_datasets({name: model_params[name] for name in args.models})
+        catalog_class = (
+            SharedMemoryDataCatalog if args.runner == "parallel" else DataCatalog
         )
+        catalog = catalog_class(datasets)
 
         # Kedro ランナーの作成
-        runner = SequentialRunner()
+        runner = RUNNERS[args.runner]()
 
-        # パイプラインの実行
+        # パイプラインの実行（入力が前回と同じノードは省略する）
         logger.info("パイプラインの実行を開始します。")
-        runner.run(pipeline, catalog)
+        report = run_pipeline(
+            pipeline,
+            catalog,
+            runner,
+            datasets,
+            state_path=os.path.join(PIPELINE_DIR, "node_state.json"),
+            use_cache=not args.no_cache,
+        )
         logger.info("パイプラインの実行が完了しました。")
+        print(format_report(report))
+        print(format_selection(datasets["selection"].load()))
     except Exception as e:
         logger.error(f"パイプラインの実行中にエラーが発生しました: {str(e)}")
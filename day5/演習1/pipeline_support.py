@@ -0,0 +1,296 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import functools
+import joblib
+import pandas as pd
+from kedro.io import AbstractDataset, DatasetError, MemoryDataset
+from kedro.pipeline import node as kedro_node
+from kedro.runner import SequentialRunner
+
+# 演習1・演習2・演習3 で共有するモジュール（day5/ml_common）を読み込めるようにする
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ml_common.data_cache import code_hash, file_hash
+
+# ノードごとの実行時間の記録先（ParallelRunnerの別プロセスからも書き込む）
+TIMINGS_DIR = "data/pipeline/.timings"
+# 実行時間を計測して比べるノードに付けるタグ（ランナーに関係なく1つずつ実行する）
+SEQUENTIAL_TAG = "sequential"
+
+
+# --- ファイルに保存するデータセット ---
+class ParquetDataset(AbstractDataset):
+    """DataFrame（series=True ならSeries）をParquetで保存する"""
+
+    def __init__(self, filepath, series=False):
+        self._filepath = filepath
+        self._series = series
+
+    def load(self):
+        frame = pd.read_parquet(self._filepath)
+        return frame.iloc[:, 0] if self._series else frame
+
+    def save(self, data):
+        os.makedirs(os.path.dirname(self._filepath) or ".", exist_ok=True)
+        (data.to_frame() if self._series else data).to_parquet(self._filepath)
+
+    def _exists(self):
+        return os.path.exists(self._filepath)
+
+    def _describe(self):
+        return {"filepath": self._filepath, "series": self._series}
+
+    def fingerprint(self):
+        return file_hash(self._filepath) if self._exists() else None
+
+
+class JoblibDataset(AbstractDataset):
+    """モデルなどのPythonオブジェクトをjoblibで保存する"""
+
+    def __init__(self, filepath):
+        self._filepath = filepath
+
+    def load(self):
+        return joblib.load(self._filepath)
+
+    def save(self, data):
+        os.makedirs(os.path.dirname(self._filepath) or ".", exist_ok=True)
+        joblib.dump(data, self._filepath)
+
+    def _exists(self):
+        return os.path.exists(self._filepath)
+
+    def _describe(self):
+        return {"filepath": self._filepath}
+
+    def fingerprint(self):
+        return file_hash(self._filepath) if self._exists() else None
+
+
+class JSONDataset(JoblibDataset):
+    """評価指標などの辞書をJSONで保存する"""
+
+    def load(self):
+        with open(self._filepath) as f:
+            return json.load(f)
+
+    def save(self, data):
+        os.makedirs(os.path.dirname(self._filepath) or ".", exist_ok=True)
+        with open(self._filepath, "w") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+
+
+class SourceFileDataset(JoblibDataset):
+    """元データのファイル（読み込むとパスを返す。内容のハッシュで変更を検出する）"""
+
+    def load(self):
+        if not self._exists():
+            raise DatasetError(f"データファイルが見つかりません: {self._filepath}")
+        return self._filepath
+
+    def save(self, data):
+        raise DatasetError("元データのファイルには保存できません")
+
+
+# --- ノードの実行時間 ---
+class TimedNode:
+    """ノードの関数を包み、実行時間を TIMINGS_DIR に記録する
+
+    ParallelRunnerでは別プロセスで実行されるため、結果はファイルに書き出す。
+    関数のシグネチャは元の関数のものを引き継ぐ（Kedroの入力チェックに使われる）。
+    """
+
+    def __init__(self, func, name):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.node_name = name
+
+    def __call__(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            end = time.time()
+            os.makedirs(TIMINGS_DIR, exist_ok=True)
+            record = {"node": self.node_name, "start": start, "end": end}
+            record.update(seconds=end - start, pid=os.getpid())
+            with open(os.path.join(TIMINGS_DIR, f"{self.node_name}.json"), "w") as f:
+                json.dump(record, f)
+
+
+def timed_node(func, inputs, outputs, name, tags=None):
+    """実行時間を記録するKedroのノードを作る"""
+    return kedro_node(
+        TimedNode(func, name), inputs=inputs, outputs=outputs, name=name, tags=tags
+    )
+
+
+def _clear_timings():
+    if os.path.isdir(TIMINGS_DIR):
+        for name in os.listdir(TIMINGS_DIR):
+            os.remove(os.path.join(TIMINGS_DIR, name))
+
+
+def _read_timings():
+    timings = {}
+    if os.path.isdir(TIMINGS_DIR):
+        for name in os.listdir(TIMINGS_DIR):
+            with open(os.path.join(TIMINGS_DIR, name)) as f:
+                record = json.load(f)
+            timings[record["node"]] = record
+    return timings
+
+
+# --- 入力が変わっていないノードの省略 ---
+class NodeCache:
+    """入力とコードが前回の実行と同じノードを省略する
+
+    ノードの指紋は、関数のソースコードと関数が使うモジュールの内容、各入力の指紋
+    （ファイルの内容のハッシュ、パラメータは値のハッシュ）から作る。前回実行時の指紋と同じで、出力が全て
+    ファイルに残っていれば、そのノードは実行せず保存済みの出力を使う。
+    今回実行するノードの出力を入力に持つノードは、常に実行する。
+    """
+
+    def __init__(self, state_path, datasets):
+        self.state_path = state_path
+        self.datasets = datasets
+        self._state = {}
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self._state = json.load(f)
+
+    def _input_fingerprint(self, name):
+        dataset = self.datasets.get(name)
+        if hasattr(dataset, "fingerprint"):
+            return dataset.fingerprint()
+        if isinstance(dataset, MemoryDataset) and name.startswith("params:"):
+            return joblib.hash(dataset.load())
+        return None  # 内容を確認できない入力は、変わったものとして扱う
+
+    def fingerprint(self, node):
+        inputs = {name: self._input_fingerprint(name) for name in node.inputs}
+        if None in inputs.values():
+            return None
+        payload = json.dumps({"code": code_hash(node.func), "inputs": inputs})
+        return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+    def plan(self, pipeline):
+        """実行するノードと省略するノードの名前を返す"""
+        to_run, skipped, changed = [], [], set()
+        for node in pipeline.nodes:  # 依存関係の順に並んでいる
+            fingerprint = None
+            if not changed.intersection(node.inputs):
+                fingerprint = self.fingerprint(node)
+            outputs_saved = all(
+                hasattr(self.datasets.get(name), "fingerprint")
+                and self.datasets[name].exists()
+                for name in node.outputs
+            )
+            if (
+                fingerprint
+                and fingerprint == self._state.get(node.name)
+                and outputs_saved
+            ):
+                skipped.append(node.name)
+            else:
+                to_run.append(node.name)
+                changed.update(node.outputs)
+        return to_run, skipped
+
+    def record(self, pipeline, node_names):
+        """実行したノードの指紋を（実行後の入力ファイルから）保存する"""
+        for node in pipeline.nodes:
+            if node.name in node_names:
+                self._state[node.name] = self.fingerprint(node)
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        with open(self.state_path, "w") as f:
+            json.dump(self._state, f, indent=2)
+
+
+def _stages(pipeline):
+    """SEQUENTIAL_TAG のノードより前・SEQUENTIAL_TAG のノード・残りの順に分ける
+
+    Returns:
+        list: [(パイプライン, 1つずつ実行するか)]
+    """
+    sequential = pipeline.only_nodes_with_tags(SEQUENTIAL_TAG)
+    if not sequential.nodes:
+        return [(pipeline, False)]
+    before = pipeline.to_nodes(*[node.name for node in sequential.nodes]) - sequential
+    after = pipeline - before - sequential
+    return [(before, False), (sequential, True), (after, False)]
+
+
+def run_pipeline(pipeline, catalog, runner, datasets, state_path, use_cache=True):
+    """入力が変わっていないノードを省略してパイプラインを実行し、ノードごとの時間を返す
+
+    SEQUENTIAL_TAG のノードは、同時に動く他のノードが計測に影響しないよう
+    runner に関係なく SequentialRunner で1つずつ実行する。
+
+    Returns:
+        dict: {"wall_time": 秒, "nodes": [{"node", "status", "seconds", ...}]}
+    """
+    cache = NodeCache(state_path, datasets)
+    if use_cache:
+        to_run, skipped = cache.plan(pipeline)
+    else:
+        to_run, skipped = [node.name for node in pipeline.nodes], []
+
+    _clear_timings()
+    start = time.time()
+    if to_run:
+        for stage, sequential in _stages(pipeline.only_nodes(*to_run)):
+            if stage.nodes:
+                (SequentialRunner() if sequential else runner).run(stage, catalog)
+    wall_time = time.time() - start
+    cache.record(pipeline, to_run)
+
+    timings = _read_timings()
+    nodes = []
+    for node in pipeline.nodes:
+        record = timings.get(node.name, {})
+        nodes.append(
+            {
+                "node": node.name,
+                "status": "skipped" if node.name in skipped else "run",
+                "seconds": record.get("seconds"),
+                # パイプラインの開始からの相対時刻（並列に動いたかを確認できる）
+                "start": record["start"] - start if record else None,
+                "pid": record.get("pid"),
+            }
+        )
+    return {"runner": type(runner).__name__, "wall_time": wall_time, "nodes": nodes}
+
+
+def format_report(report):
+    lines = [
+        f"{'node':<28}{'status':<9}{'start(s)':>9}{'time(s)':>9}{'pid':>8}",
+    ]
+    for n in report["nodes"]:
+        start = f"{n['start']:.2f}" if n["start"] is not None else "-"
+        seconds = f"{n['seconds']:.2f}" if n["seconds"] is not None else "-"
+        lines.append(
+            f"{n['node']:<28}{n['status']:<9}{start:>9}{seconds:>9}{n['pid'] or '-':>8}"
+        )
+    lines.append(f"合計: {report['wall_time']:.2f}秒 ({report['runner']})")
+    return "\n".join(lines)
+
+
+def format_selection(selection):
+    lines = [
+        f"{'model':<28}{'rank':>5}{'accuracy':>10}{'train(s)':>10}{'µs/row':>9}",
+    ]
+    candidates = selection["candidates"]
+    order = sorted(candidates, key=lambda name: candidates[name].get("rank") or 1e9)
+    for name in order:
+        m = candidates[name]
+        rank = m.get("rank") or "-"
+        lines.append(
+            f"{name:<28}{rank:>5}{m['accuracy']:>10.4f}{m['train_time']:>10.3f}"
+            f"{m['inference_time_per_row'] * 1e6:>9.2f}"
+            + (f"  除外: {', '.join(m['rejected'])}" if m.get("rejected") else "")
+        )
+    lines.append(f"選択したモデル: {selection['winner']}")
+    return "\n".join(lines)
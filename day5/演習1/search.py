@@ -0,0 +1,289 @@
+"""ハイパーパラメータ探索（複数の試行をプロセスプールで並列に実行する）
+
+main.py は1回の実行で1つのパラメータを試すが、ここでは n_estimators と max_depth の
+組み合わせを seed から決まる乱数で複数作り、プロセスプールで同時に学習・評価する。
+
+- 読み込んで前処理したデータは共有メモリに置き、各ワーカーはそれを参照する
+  （試行ごとにデータを読み直したりpickleで送ったりしない）
+- 全ての試行で同じ分割（test_size, data_random_state）を使い、精度を比べられるようにする
+- 探索全体を親のMLflowラン、各試行を入れ子（nested）のランとしてローカルのファイル
+  ストア（mlruns）に記録する
+- 同じ seed なら、ワーカー数に関係なく同じパラメータ・同じ結果になる
+
+使用例（演習1ディレクトリで実行）:
+    python search.py --trials 32 --workers 4 --seed 0
+    python search.py --trials 32 --workers 4 --compare-sequential
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import mlflow
+import mlflow.sklearn
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import resource_tracker, shared_memory
+from mlflow.models.signature import infer_signature
+from sklearn.model_selection import train_test_split
+from main import load_dataset, train_and_evaluate
+
+# MLflowの記録先（MLFLOW_TRACKING_URI がなければローカルのファイルストア）
+TRACKING_URI = os.environ.get(
+    "MLFLOW_TRACKING_URI", "file:" + os.path.abspath("mlruns")
+)
+EXPERIMENT_NAME = "titanic-hyperparameter-search"
+
+# 探索空間（main.py のランダムな設定と同じ範囲）
+N_ESTIMATORS_RANGE = (50, 200)
+MAX_DEPTH_CHOICES = [None, 3, 5, 10, 15]
+
+
+class SharedArray:
+    """numpy配列を共有メモリに置き、名前を渡して別のプロセスから参照する"""
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+        self._shm = None
+
+    @classmethod
+    def create(cls, array):
+        array = np.ascontiguousarray(array)
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = cls(shm.name, array.shape, array.dtype.str)
+        shared._shm = shm
+        shared.array()[:] = array
+        return shared
+
+    def __getstate__(self):
+        # 共有メモリのオブジェクトは送らず、名前だけを渡す
+        return {"name": self.name, "shape": self.shape, "dtype": self.dtype}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, _shm=None)
+
+    def array(self):
+        if self._shm is None:
+            self._shm = _attach(self.name)
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    def close(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def unlink(self):
+        shm = self._shm or _attach(self.name)
+        shm.close()
+        shm.unlink()
+        self._shm = None
+
+
+def _attach(name):
+    """既存の共有メモリを参照する（作成したプロセスだけが削除の責任を持つ）"""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    # Python 3.12以前は参照しただけのプロセスも終了時に削除しようとするため登録を外す
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+# --- ワーカープロセス ---
+_DATASET = None
+
+
+def _init_worker(shared_X, shared_y, columns):
+    """ワーカーの起動時に1回だけ、共有メモリのデータを参照するDataFrameを作る"""
+    global _DATASET
+    X = pd.DataFrame(shared_X.array(), columns=columns, copy=False)
+    y = pd.Series(shared_y.array(), name="Survived", copy=False)
+    _DATASET = (X, y, shared_X, shared_y)
+
+
+def run_trial(trial):
+    """1つの試行（パラメータ）を学習・評価する"""
+    X, y = _DATASET[:2]
+    start = time.perf_counter()
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=trial["test_size"], random_state=trial["data_random_state"]
+    )
+    _, accuracy = train_and_evaluate(
+        X_train,
+        X_test,
+        y_train,
+        y_test,
+        n_estimators=trial["n_estimators"],
+        max_depth=trial["max_depth"],
+        random_state=trial["model_random_state"],
+        n_jobs=1,  # 並列化は試行単位で行う
+    )
+    return {**trial, "accuracy": accuracy, "duration": time.perf_counter() - start}
+
+
+# --- 探索 ---
+def sample_trials(n_trials, seed, test_size=0.2, data_random_state=42):
+    """seed から試行のパラメータを作る（i番目の試行は seed と i だけで決まる）"""
+    trials = []
+    for i, child in enumerate(np.random.SeedSequence(seed).spawn(n_trials)):
+        rng = np.random.default_rng(child)
+        trials.append(
+            {
+                "trial": i,
+                "n_estimators": int(rng.integers(*N_ESTIMATORS_RANGE, endpoint=True)),
+                "max_depth": MAX_DEPTH_CHOICES[rng.integers(len(MAX_DEPTH_CHOICES))],
+                "model_random_state": int(rng.integers(1, 100, endpoint=True)),
+                "test_size": test_size,
+                "data_random_state": data_random_state,
+            }
+        )
+    return trials
+
+
+def best_trial(results):
+    """精度が最も高い試行（同じ精度なら番号の小さい試行）"""
+    return max(results, key=lambda r: (r["accuracy"], -r["trial"]))
+
+
+def _log_trial(result):
+    with mlflow.start_run(run_name=f"trial-{result['trial']:03d}", nested=True):
+        mlflow.log_params(
+            {
+                key: "None" if value is None else value
+                for key, value in result.items()
+                if key not in ("accuracy", "duration")
+            }
+        )
+        mlflow.log_metric("accuracy", result["accuracy"])
+        mlflow.log_metric("duration", result["duration"])
+
+
+def run_search(X, y, trials, workers):
+    """試行をプロセスプールで実行し、完了した順にMLflowへ記録する"""
+    shared_X = SharedArray.create(X.to_numpy(dtype=np.float64))
+    shared_y = SharedArray.create(y.to_numpy(dtype=np.float64))
+    results = []
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(shared_X, shared_y, list(X.columns)),
+        ) as pool:
+            futures = [pool.submit(run_trial, trial) for trial in trials]
+            for future in as_completed(futures):
+                result = future.result()
+                _log_trial(result)
+                results.append(result)
+    finally:
+        shared_X.unlink()
+        shared_y.unlink()
+    return sorted(results, key=lambda r: r["trial"])
+
+
+def run_sequential(X, y, trials):
+    """比較用: 同じ試行を1つのプロセスで順に実行する（MLflowには記録しない）"""
+    global _DATASET
+    _DATASET = (X, y)
+    try:
+        return [run_trial(trial) for trial in trials]
+    finally:
+        _DATASET = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ハイパーパラメータ探索")
+    parser.add_argument("--trials", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument(
+        "--compare-sequential",
+        action="store_true",
+        help="同じ試行を順に実行した時間も計測する",
+    )
+    args = parser.parse_args()
+
+    X, y = load_dataset()
+    trials = sample_trials(args.trials, args.seed, test_size=args.test_size)
+
+    # 新しいMLflowはファイルストアを使うのに明示的な許可が必要
+    os.environ.setdefault("MLFLOW_ALLOW_FILE_STORE", "true")
+    mlflow.set_tracking_uri(TRACKING_URI)
+    mlflow.set_experiment(EXPERIMENT_NAME)
+    with mlflow.start_run(run_name=f"search-seed{args.seed}"):
+        mlflow.log_params(
+            {"seed": args.seed, "trials": args.trials, "workers": args.workers}
+        )
+        start = time.perf_counter()
+        results = run_search(X, y, trials, args.workers)
+        wall_time = time.perf_counter() - start
+
+        best = best_trial(results)
+        trial_time = sum(r["duration"] for r in results)
+        mlflow.log_params(
+            {
+                f"best_{key}": "None" if best[key] is None else best[key]
+                for key in ("trial", "n_estimators", "max_depth", "model_random_state")
+            }
+        )
+        mlflow.log_metric("best_accuracy", best["accuracy"])
+        mlflow.log_metric("wall_time", wall_time)
+
+        sequential_time = None
+        if args.compare_sequential:
+            start = time.perf_counter()
+            sequential = run_sequential(X, y, trials)
+            sequential_time = time.perf_counter() - start
+            # 並列でも順に実行しても同じ結果になることを確認する
+            assert [r["accuracy"] for r in sequential] == [
+                r["accuracy"] for r in results
+            ], "並列実行と逐次実行の結果が一致しません"
+            mlflow.log_metric("sequential_time", sequential_time)
+            mlflow.log_metric("speedup", sequential_time / wall_time)
+
+        # 最良のパラメータで学習し直したモデルを親のランに記録する
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=best["test_size"], random_state=best["data_random_state"]
+        )
+        model, _ = train_and_evaluate(
+            X_train,
+            X_test,
+            y_train,
+            y_test,
+            n_estimators=best["n_estimators"],
+            max_depth=best["max_depth"],
+            random_state=best["model_random_state"],
+        )
+        mlflow.sklearn.log_model(
+            model,
+            "model",
+            signature=infer_signature(X_train, model.predict(X_train)),
+            input_example=X_test.iloc[:5],
+            serialization_format=mlflow.sklearn.SERIALIZATION_FORMAT_CLOUDPICKLE,
+        )
+
+    print(
+        f"\n=== ハイパーパラメータ探索 ({args.trials}試行, "
+        f"{args.workers}ワーカー, seed={args.seed}) ==="
+    )
+    print(
+        f"最良の試行: #{best['trial']} n_estimators={best['n_estimators']} "
+        f"max_depth={best['max_depth']} "
+        f"model_random_state={best['model_random_state']} "
+        f"accuracy={best['accuracy']:.4f}"
+    )
+    print(f"実行時間: {wall_time:.2f}秒 (各試行の合計 {trial_time:.2f}秒)")
+    if sequential_time is not None:
+        print(
+            f"逐次実行: {sequential_time:.2f}秒 → "
+            f"{sequential_time / wall_time:.2f}倍の高速化"
+        )
+    else:
+        print(f"試行の合計時間に対して {trial_time / wall_time:.2f}倍")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""モデルの保存形式ごとの読み込み時間とメモリ使用量（RSS）を比較する
+
+複数の推論プロセスが同じモデルを読み込む状況を想定し、形式ごとにプロセスを
+起動して読み込み時間と、読み込みで増えたRSS（プロセス固有のメモリ RssAnon と
+ページキャッシュと共有できるファイルマップ RssFile）を計測する。
+
+joblib-mmap でも決定木の配列は読み込み時にプロセスごとのメモリ（anon）にコピーされ、
+ページキャッシュとは共有されない（mmapによる共有は ArtifactStore の対象外とした）。
+
+使用例（演習2ディレクトリで実行）:
+    python benchmark_artifacts.py --n-estimators 300 --processes 4
+"""
+
+import os
+import sys
+import time
+import pickle
+import argparse
+import tempfile
+import multiprocessing as mp
+import joblib
+from sklearn.model_selection import train_test_split
+from main import DataLoader, ModelTester
+
+# 演習1・演習2・演習3 で共有するモジュール（day5/ml_common）を読み込めるようにする
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ml_common.artifact_store import ArtifactStore
+
+
+def _rss_kb():
+    """/proc/self/status から RSS の内訳（KB）を読む（Linuxのみ）"""
+    fields = {"VmRSS": 0, "RssAnon": 0, "RssFile": 0}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key = line.split(":")[0]
+                if key in fields:
+                    fields[key] = int(line.split()[1])
+    except OSError:
+        pass
+    return fields
+
+
+def _load_worker(fmt, path, batch, queue):
+    """別プロセスでモデルを読み込み、読み込み時間とRSSの増加量を返す
+
+    mmapで読み込んだ配列は触れたページだけがRSSに数えられるため、batch を1回予測してから測る。
+    """
+    before = _rss_kb()
+    start = time.perf_counter()
+    if fmt == "pickle":
+        with open(path, "rb") as f:
+            model = pickle.load(f)
+    elif fmt == "joblib-mmap":
+        model = joblib.load(path, mmap_mode="r")
+    else:
+        model = joblib.load(path)
+    elapsed = time.perf_counter() - start
+    model.predict(batch)
+    after = _rss_kb()
+    queue.put(
+        {
+            "load_time": elapsed,
+            "rss_kb": after["VmRSS"] - before["VmRSS"],
+            "anon_kb": after["RssAnon"] - before["RssAnon"],
+            "file_kb": after["RssFile"] - before["RssFile"],
+        }
+    )
+
+
+def measure(fmt, path, batch, processes):
+    """processes 個のプロセスで同時に読み込み、各プロセスの計測結果を返す"""
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    workers = [
+        ctx.Process(target=_load_worker, args=(fmt, path, batch, queue))
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    results = [queue.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モデルの保存形式の比較")
+    parser.add_argument("--n-estimators", type=int, default=300)
+    parser.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+
+    data = DataLoader.load_titanic_data()
+    X, y = DataLoader.preprocess_titanic_data(data)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=42
+    )
+    model = ModelTester.train_model(
+        X_train, y_train, {"n_estimators": args.n_estimators, "random_state": 42}
+    )
+    metrics = ModelTester.evaluate_model(model, X_test, y_test)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pickle_path = os.path.join(tmp_dir, "model.pkl")
+        with open(pickle_path, "wb") as f:
+            pickle.dump(model, f)
+        store = ArtifactStore(os.path.join(tmp_dir, "store"))
+        raw = store.save(model, metrics=metrics, data=X_train, compress=0)
+        compressed = store.save(
+            model, name="titanic_model_z", metrics=metrics, data=X_train, compress=3
+        )
+        paths = {
+            "pickle": pickle_path,
+            "joblib": store.path(version=raw["version"]),
+            "joblib-mmap": store.path(version=raw["version"]),
+            "joblib-z3": store.path("titanic_model_z", compressed["version"]),
+        }
+
+        print(
+            f"\n=== モデルの読み込み比較 (n_estimators={args.n_estimators}, "
+            f"{args.processes}プロセス) ==="
+        )
+        print(
+            f"{'format':<14}{'size(KB)':>10}{'load(ms)':>10}"
+            f"{'RSS(KB)':>10}{'anon(KB)':>10}{'file(KB)':>10}"
+        )
+        for fmt, path in paths.items():
+            results = measure(fmt, path, X_test, args.processes)
+            n = len(results)
+            print(
+                f"{fmt:<14}{os.path.getsize(path) / 1024:>10.0f}"
+                f"{sum(r['load_time'] for r in results) / n * 1000:>10.1f}"
+                f"{sum(r['rss_kb'] for r in results) / n:>10.0f}"
+                f"{sum(r['anon_kb'] for r in results) / n:>10.0f}"
+                f"{sum(r['file_kb'] for r in results) / n:>10.0f}"
+            )
+        print(
+            "\nanon はプロセスごとに確保されるメモリ、file はページキャッシュと"
+            "共有されるメモリ（プロセス間で重複しない）"
+        )
+
+
+if __name__ == "__main__":
+    main()
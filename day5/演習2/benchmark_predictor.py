@@ -0,0 +1,76 @@
+"""sklearnのPipelineと高速予測（fast_predictor）の予測時間を比較する
+
+1行ずつの予測のレイテンシと、10,000行をまとめて予測する時間を計測する。
+
+使用例（演習2ディレクトリで実行）:
+    python benchmark_predictor.py --n-estimators 100 --rows 1000
+"""
+
+import time
+import argparse
+import numpy as np
+from sklearn.model_selection import train_test_split
+from main import DataLoader, ModelTester
+from fast_predictor import compile_pipeline
+
+
+def _time_per_call(predict, inputs, repeat=1):
+    """inputs の各要素で predict を呼び、1回あたりの時間（秒）を返す"""
+    times = []
+    for _ in range(repeat):
+        for x in inputs:
+            start = time.perf_counter()
+            predict(x)
+            times.append(time.perf_counter() - start)
+    return np.array(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="予測時間の比較")
+    parser.add_argument("--n-estimators", type=int, default=100)
+    parser.add_argument("--rows", type=int, default=1000, help="1行予測の回数")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    data = DataLoader.load_titanic_data()
+    X, y = DataLoader.preprocess_titanic_data(data)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=42
+    )
+    model = ModelTester.train_model(
+        X_train, y_train, {"n_estimators": args.n_estimators, "random_state": 42}
+    )
+    compiled = compile_pipeline(model)
+
+    rows = [X.iloc[[i % len(X)]] for i in range(args.rows)]
+    batch = X.sample(args.batch_size, replace=True, random_state=0)
+    assert np.array_equal(compiled.predict_proba(batch), model.predict_proba(batch))
+
+    print(
+        f"\n=== 予測時間の比較 (n_estimators={args.n_estimators}, "
+        f"1行×{args.rows}回, {args.batch_size}行のバッチ) ==="
+    )
+    print(
+        f"{'predictor':<12}{'row p50(ms)':>13}{'row p99(ms)':>13}"
+        f"{'batch(ms)':>11}{'rows/sec':>12}"
+    )
+    results = {}
+    for name, predictor in [("sklearn", model), ("compiled", compiled)]:
+        per_row = _time_per_call(predictor.predict_proba, rows) * 1000
+        per_batch = _time_per_call(predictor.predict_proba, [batch], repeat=5)
+        batch_time = float(np.median(per_batch))
+        results[name] = (np.percentile(per_row, 50), batch_time)
+        print(
+            f"{name:<12}{np.percentile(per_row, 50):>13.3f}"
+            f"{np.percentile(per_row, 99):>13.3f}"
+            f"{batch_time * 1000:>11.1f}{args.batch_size / batch_time:>12.0f}"
+        )
+    print(
+        f"\n1行: {results['sklearn'][0] / results['compiled'][0]:.1f}倍, "
+        f"{args.batch_size}行: {results['sklearn'][1] / results['compiled'][1]:.1f}倍"
+        "（予測確率はsklearnと完全に一致）"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""データ検証の時間を比較する
+
+- legacy: 呼び出しごとにコンテキストを作り、期待値を1つずつ batch.validate で検証する（以前の方法）
+- suite: 一度だけ作ったコンテキストとスイートを使い、1回の検証ですべての期待値を判定する
+- numpy: 同じ期待値をNumPyで判定する（各カラムを1回だけ走査する）
+
+使用例（演習2ディレクトリで実行）:
+    python benchmark_validation.py --rows 10000000
+"""
+
+import time
+import argparse
+import great_expectations as gx
+from main import (
+    GX_EXPECTATION_CLASSES,
+    TITANIC_EXPECTATIONS,
+    DataLoader,
+    DataValidator,
+)
+
+
+def validate_legacy(data):
+    """以前の validate_titanic_data と同じ方法で検証する"""
+    context = gx.get_context(mode="ephemeral")
+    data_source = context.data_sources.add_pandas("pandas")
+    data_asset = data_source.add_dataframe_asset(name="pd dataframe asset")
+    batch_definition = data_asset.add_batch_definition_whole_dataframe(
+        "batch definition"
+    )
+    batch = batch_definition.get_batch(batch_parameters={"dataframe": data})
+    results = [
+        batch.validate(GX_EXPECTATION_CLASSES[spec["type"]](**spec["kwargs"]))
+        for spec in TITANIC_EXPECTATIONS
+    ]
+    return all(result.success for result in results), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="データ検証の時間の比較")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    X, _ = DataLoader.preprocess_titanic_data(DataLoader.load_titanic_data())
+    data = X.sample(args.rows, replace=True, random_state=0).reset_index(drop=True)
+
+    validators = {
+        "legacy": validate_legacy,
+        "suite": DataValidator.validate_titanic_data,
+        "numpy": lambda d: DataValidator.validate_titanic_data(d, engine="numpy"),
+    }
+    print(
+        f"\n=== データ検証の時間の比較 ({args.rows:,}行, {args.repeat}回の最小値) ==="
+    )
+    verdicts = {}
+    for name, validate in validators.items():
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            success, results = validate(data)
+            times.append(time.perf_counter() - start)
+        verdicts[name] = [result["success"] for result in results]
+        print(f"{name:<8}{min(times):>9.3f}秒  {'成功' if success else '失敗'}")
+    assert len({tuple(v) for v in verdicts.values()}) == 1, "判定が一致しません"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""学習済みパイプラインをNumPy配列だけで予測できる形に変換する（高速予測）
+
+sklearnのPipelineによる予測は、ColumnTransformer・SimpleImputer・StandardScaler・
+OneHotEncoder をDataFrame単位で順に呼び出し、そのあと決定木を1本ずつたどる。
+1行の予測ではこの呼び出しのオーバーヘッドがほとんどを占める。
+
+compile_pipeline() は学習済みのパイプラインから次の配列を取り出す。
+- 前処理: 欠損値の補完値（中央値・最頻値）、標準化の平均と標準偏差、カテゴリの一覧
+- ランダムフォレスト: 全ての木のノードを1つの配列にまとめたもの
+  （分岐に使う特徴量・しきい値・左右の子ノード・葉のクラス確率）
+予測では全サンプル×全木のノード位置を配列で持ち、葉に着くまで深さ方向に1段ずつ
+まとめて進める（行数が多い場合は木ごとにsklearnのCython実装でたどる）。演算の順序と型（特徴量はfloat32、確率はfloat64で木の順に加算）を
+sklearnと揃えているため、predict_proba と完全に同じ値になる。
+
+使用例（演習2ディレクトリで実行）:
+    compiled = compile_pipeline(model)
+    compiled.predict_proba(X)
+    export_compiled(model, "models/titanic_model.compiled.joblib")
+    pytest fast_predictor.py                 # sklearnとの一致を確認
+"""
+
+import os
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from sklearn.model_selection import train_test_split
+
+# 木の配列で葉を表す値（sklearn の _tree.TREE_LEAF）
+TREE_LEAF = -1
+# これより少ない行数はNumPyの配列でまとめて木をたどる。多い場合は1本ずつの木を
+# sklearnのCython実装（Tree.apply）でたどった方が速い（100本の木で16行前後が境目）
+SMALL_BATCH_ROWS = 16
+
+
+def _is_missing(values):
+    """SimpleImputer(missing_values=np.nan) と同じ判定（NaNのみを欠損とみなす）"""
+    return values != values
+
+
+class CompiledBlock:
+    """ColumnTransformerの1つの変換（列の組と、その列に順に適用する処理）"""
+
+    def __init__(self, columns, steps):
+        self.columns = list(columns)
+        # [("impute", 補完値), ("scale", 平均, 標準偏差), ("onehot", [カテゴリの配列])]
+        self.steps = steps
+        self.categorical = any(step[0] == "onehot" for step in steps)
+
+    @property
+    def n_features_out(self):
+        for step in self.steps:
+            if step[0] == "onehot":
+                return sum(len(categories) for categories in step[1])
+        return len(self.columns)
+
+    def transform(self, X):
+        dtype = object if self.categorical else np.float64
+        values = np.column_stack(
+            [np.asarray(X[col], dtype=dtype) for col in self.columns]
+        )
+        for step in self.steps:
+            if step[0] == "impute":
+                missing = _is_missing(values)
+                if missing.any():
+                    values = values.copy()
+                    rows, cols = np.nonzero(missing)
+                    values[rows, cols] = step[1][cols]
+            elif step[0] == "scale":
+                # StandardScaler.transform と同じ順序（平均を引いてから割る）
+                values = values - step[1]
+                values /= step[2]
+            elif step[0] == "onehot":
+                values = _one_hot(values, step[1])
+        return values
+
+
+def _one_hot(values, categories):
+    """OneHotEncoder(handle_unknown="ignore") と同じく、未知のカテゴリは全て0にする"""
+    out = np.zeros((values.shape[0], sum(len(c) for c in categories)), dtype=np.float64)
+    rows = np.arange(values.shape[0])
+    offset = 0
+    for j, column_categories in enumerate(categories):
+        index = pd.Index(column_categories).get_indexer(values[:, j])
+        known = index >= 0
+        out[rows[known], offset + index[known]] = 1.0
+        offset += len(column_categories)
+    return out
+
+
+def _compile_step(step):
+    if isinstance(step, SimpleImputer):
+        if not (
+            isinstance(step.missing_values, float) and np.isnan(step.missing_values)
+        ):
+            raise ValueError("missing_values=np.nan 以外のSimpleImputerには未対応です")
+        if step.add_indicator:
+            raise ValueError("add_indicator=True のSimpleImputerには未対応です")
+        return ("impute", np.asarray(step.statistics_))
+    if isinstance(step, StandardScaler):
+        mean = step.mean_ if step.with_mean else np.zeros(step.n_features_in_)
+        scale = step.scale_ if step.with_std else np.ones(step.n_features_in_)
+        return ("scale", np.asarray(mean, dtype=np.float64), np.asarray(scale))
+    if isinstance(step, OneHotEncoder):
+        if step.drop is not None or getattr(step, "_infrequent_enabled", False):
+            raise ValueError(
+                "drop や infrequent カテゴリを使うOneHotEncoderには未対応です"
+            )
+        if step.handle_unknown != "ignore":
+            raise ValueError(
+                "handle_unknown='ignore' 以外のOneHotEncoderには未対応です"
+            )
+        return ("onehot", [np.asarray(c) for c in step.categories_])
+    raise ValueError(f"未対応の前処理です: {type(step).__name__}")
+
+
+def _compile_preprocessor(preprocessor):
+    if not isinstance(preprocessor, ColumnTransformer):
+        raise ValueError("前処理はColumnTransformerである必要があります")
+    blocks = []
+    for _, transformer, columns in preprocessor.transformers_:
+        if transformer == "drop" or len(columns) == 0:
+            continue
+        if transformer == "passthrough":
+            blocks.append(CompiledBlock(columns, []))
+            continue
+        steps = (
+            [step for _, step in transformer.steps]
+            if isinstance(transformer, Pipeline)
+            else [transformer]
+        )
+        blocks.append(
+            CompiledBlock(
+                columns, [_compile_step(s) for s in steps if s != "passthrough"]
+            )
+        )
+    return blocks
+
+
+class CompiledForest:
+    """ランダムフォレストの全ての木のノードを連結した配列"""
+
+    def __init__(self, forest):
+        if forest.n_outputs_ != 1:
+            raise ValueError("出力が1つのRandomForestClassifierのみ対応しています")
+        features, thresholds, children, values, roots = [], [], [], [], []
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            is_leaf = tree.children_left == TREE_LEAF
+            node_ids = np.arange(tree.node_count)
+            roots.append(offset)
+            # 葉は自分自身を子とし、何と比べても位置が変わらないようにする
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            left = np.where(is_leaf, node_ids, tree.children_left)
+            right = np.where(is_leaf, node_ids, tree.children_right)
+            # ノード i の左の子を 2i、右の子を 2i+1 の位置に置く
+            children.append(np.column_stack([left, right]).ravel() + offset)
+            # sklearn 1.4以降の分類木は葉のクラスの割合を value に持つ
+            values.append(tree.value[:, 0, : forest.n_classes_])
+            offset += tree.node_count
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds).astype(np.float64)
+        self.children = np.concatenate(children).astype(np.intp)
+        self.is_leaf = self.children[::2] == np.arange(offset)
+        self.value = np.concatenate(values).astype(np.float64)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.classes_ = forest.classes_
+        self.n_features = forest.n_features_in_
+        # 行数が多い場合に使う（葉の番号を得るためだけに使い、確率の計算は共通）
+        self._trees = [estimator.tree_ for estimator in forest.estimators_]
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def _apply(self, X):
+        """NumPyの配列で全ての木をたどり、葉のノード番号を返す（形状: 木の数×サンプル数）"""
+        n_samples, n_features = X.shape
+        flat_X = X.ravel()
+        leaves = np.empty(self.n_trees * n_samples, dtype=np.intp)
+        # 木ごとにサンプルを並べた (木, サンプル) の組を、葉に着くまで1段ずつ進める
+        node = np.repeat(self.roots, n_samples)
+        x_start = np.tile(np.arange(n_samples) * n_features, self.n_trees)
+        position = np.arange(node.size)
+        while True:
+            done = self.is_leaf[node]
+            n_done = np.count_nonzero(done)
+            if n_done == node.size:
+                leaves[position] = node
+                break
+            # 葉に着いた組がある程度たまったら取り除く（葉に残っていても結果は変わらない）
+            if n_done * 4 > node.size:
+                leaves[position[done]] = node[done]
+                keep = ~done
+                node, x_start, position = node[keep], x_start[keep], position[keep]
+            go_right = flat_X[x_start + self.feature[node]] > self.threshold[node]
+            node = self.children[2 * node + go_right]
+        return leaves.reshape(self.n_trees, n_samples)
+
+    def predict_proba(self, X):
+        """RandomForestClassifier.predict_proba と同じ値を返す
+
+        X はfloat32に変換する（sklearnの決定木と同じ）。確率は木の順に足していく。
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.shape[0] < SMALL_BATCH_ROWS:
+            leaf_values = self.value[self._apply(X)]
+            # cumsum は木の順に足すので、sklearnの out += prediction と同じ丸めになる
+            proba = np.cumsum(leaf_values, axis=0)[-1]
+        else:
+            proba = np.zeros((X.shape[0], self.value.shape[1]), dtype=np.float64)
+            for tree, root in zip(self._trees, self.roots):
+                proba += self.value[tree.apply(X) + root]
+        proba /= self.n_trees
+        return proba
+
+
+class CompiledPipeline:
+    """前処理とランダムフォレストを配列に変換したもの（Pipelineと同じように使える）"""
+
+    def __init__(self, blocks, forest):
+        self.blocks = blocks
+        self.forest = forest
+        n_features = sum(block.n_features_out for block in blocks)
+        if n_features != forest.n_features:
+            raise ValueError(
+                f"前処理の出力 ({n_features}列) がモデルの入力 "
+                f"({forest.n_features}列) と一致しません"
+            )
+
+    @property
+    def classes_(self):
+        return self.forest.classes_
+
+    def transform(self, X):
+        """前処理（ColumnTransformer.transform と同じ値）"""
+        return np.hstack([block.transform(X) for block in self.blocks])
+
+    def predict_proba(self, X):
+        return self.forest.predict_proba(self.transform(X))
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def compile_pipeline(model):
+    """学習済みの Pipeline(ColumnTransformer → RandomForestClassifier) を変換する
+
+    Raises:
+        ValueError: 未対応の前処理やモデルが含まれる場合
+    """
+    if not isinstance(model, Pipeline) or len(model.steps) != 2:
+        raise ValueError(
+            "Pipeline(前処理, RandomForestClassifier) である必要があります"
+        )
+    (_, preprocessor), (_, forest) = model.steps
+    if not isinstance(forest, RandomForestClassifier):
+        raise ValueError("モデルはRandomForestClassifierである必要があります")
+    return CompiledPipeline(_compile_preprocessor(preprocessor), CompiledForest(forest))
+
+
+def export_compiled(model, path="models/titanic_model.compiled.joblib"):
+    """変換した予測器を保存する（配列のみなのでmmapで読み込める）"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    joblib.dump(compile_pipeline(model), path)
+    return path
+
+
+def load_compiled(path="models/titanic_model.compiled.joblib", mmap_mode="r"):
+    return joblib.load(path, mmap_mode=mmap_mode)
+
+
+# テスト関数（pytestで実行可能）
+def _train_titanic(model_params=None):
+    from main import DataLoader, ModelTester
+
+    data = DataLoader.load_titanic_data()
+    X, y = DataLoader.preprocess_titanic_data(data)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=42
+    )
+    return ModelTester.train_model(X_train, y_train, model_params), X, X_test
+
+
+def test_fast_predictor_parity(monkeypatch):
+    """変換した予測器の確率がsklearnと完全に一致する"""
+    model, X, X_test = _train_titanic()
+    compiled = compile_pipeline(model)
+
+    # 行数が多い場合（Tree.apply）と、全ての行数をNumPyの配列でたどる場合の両方
+    for small_batch_rows in [SMALL_BATCH_ROWS, len(X) + 1]:
+        monkeypatch.setitem(globals(), "SMALL_BATCH_ROWS", small_batch_rows)
+        for data in [X_test, X, X.head(5), X.iloc[[0]]]:
+            expected = model.predict_proba(data)
+            actual = compiled.predict_proba(data)
+            assert actual.dtype == expected.dtype
+            assert np.array_equal(actual, expected), "予測確率がsklearnと一致しません"
+            assert np.array_equal(compiled.predict(data), model.predict(data))
+
+
+def test_fast_predictor_parity_missing_and_unknown():
+    """欠損値・未知のカテゴリ・深さ制限のある木でも一致する"""
+    model, X, _ = _train_titanic({"n_estimators": 30, "max_depth": 5})
+    compiled = compile_pipeline(model)
+
+    data = X.head(50).copy()
+    data.loc[data.index[:10], ["Age", "Fare", "Embarked"]] = np.nan
+    data.loc[data.index[10:20], "Pclass"] = 4
+    data.loc[data.index[20:30], "Embarked"] = "X"
+    assert np.array_equal(compiled.predict_proba(data), model.predict_proba(data))
+    for i in range(30):
+        row = data.iloc[[i]]
+        assert np.array_equal(compiled.predict_proba(row), model.predict_proba(row))
+
+
+def test_fast_predictor_export(tmp_path):
+    """保存して読み込んだ予測器でも同じ結果になる"""
+    model, _, X_test = _train_titanic({"n_estimators": 20, "random_state": 0})
+    path = export_compiled(model, str(tmp_path / "compiled.joblib"))
+    compiled = load_compiled(path)
+    assert np.array_equal(compiled.predict_proba(X_test), model.predict_proba(X_test))
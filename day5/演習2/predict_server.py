@@ -0,0 +1,367 @@
+"""Titanicモデルの予測サーバー
+
+学習済みのパイプライン（models/titanic_model.pkl）を起動時に1回だけ読み込み、
+1行ずつの予測と列形式のバッチ予測を提供する。
+
+sklearnのPipelineは呼び出しごとにColumnTransformerなどのオーバーヘッドがあり、
+1行の予測ではこれが大部分を占める。同時に届いた1行ずつのリクエストは短い時間だけ
+まとめてから1回の predict_proba で予測する（マイクロバッチ）。
+
+使用例（演習2ディレクトリで実行）:
+    python predict_server.py                 # http://localhost:8000 で起動
+    python predict_server.py --bench         # マイクロバッチの有無でレイテンシを比較
+"""
+
+import io
+import os
+import time
+import asyncio
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Union
+import joblib
+import numpy as np
+import pandas as pd
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from pydantic import BaseModel, ValidationError
+from fast_predictor import compile_pipeline
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow / Parquet 形式の入力は pyarrow がある場合のみ
+    pa = None
+
+# --- 設定 ---
+MODEL_PATH = os.environ.get("MODEL_PATH", "models/titanic_model.pkl")
+# 1回の predict_proba にまとめる最大行数
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "64"))
+# 最初のリクエストが届いてから、まとめるために待つ最大時間（ミリ秒）
+MAX_WAIT_MS = float(os.environ.get("MAX_WAIT_MS", "2"))
+# 1にすると、パイプラインをNumPy配列に変換した高速予測（fast_predictor）を使う
+FAST_PREDICTOR = os.environ.get("FAST_PREDICTOR", "0") == "1"
+# レイテンシの統計に使う直近のリクエスト数
+LATENCY_WINDOW = 10000
+
+FEATURE_COLUMNS = ["Pclass", "Sex", "Age", "SibSp", "Parch", "Fare", "Embarked"]
+
+
+# --- データモデル定義 ---
+class Passenger(BaseModel):
+    Pclass: int
+    Sex: str
+    Age: Optional[float] = None
+    SibSp: int = 0
+    Parch: int = 0
+    Fare: Optional[float] = None
+    Embarked: Optional[str] = None
+
+
+class ColumnarBatch(BaseModel):
+    # {"Pclass": [1, 3], "Sex": ["female", "male"], ...}
+    columns: Dict[str, List[Union[float, int, str, None]]]
+
+
+class Prediction(BaseModel):
+    survived: int
+    probability: float
+    batch_size: int  # 同じ predict_proba でまとめて予測した行数
+
+
+class BatchPrediction(BaseModel):
+    survived: List[int]
+    probability: List[float]
+    rows: int
+
+
+# --- 統計 ---
+class LatencyStats:
+    """エンドポイントごとのレイテンシと処理行数を記録する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.latencies = {}
+        self.rows = {}
+        self.batch_sizes = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, name, latency, rows=1):
+        with self._lock:
+            self.latencies.setdefault(name, deque(maxlen=LATENCY_WINDOW)).append(
+                latency
+            )
+            self.rows[name] = self.rows.get(name, 0) + rows
+
+    def record_batch(self, size):
+        with self._lock:
+            self.batch_sizes.append(size)
+
+    def summary(self):
+        with self._lock:
+            elapsed = time.time() - self.started
+            result = {"uptime_seconds": elapsed, "endpoints": {}}
+            for name, values in self.latencies.items():
+                values = np.array(values) * 1000
+                result["endpoints"][name] = {
+                    "requests": len(values),
+                    "rows": self.rows[name],
+                    "p50_ms": float(np.percentile(values, 50)),
+                    "p99_ms": float(np.percentile(values, 99)),
+                    "rows_per_sec": self.rows[name] / elapsed if elapsed else 0.0,
+                }
+            if self.batch_sizes:
+                result["micro_batch_mean_size"] = float(np.mean(self.batch_sizes))
+            return result
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.latencies.clear()
+            self.rows.clear()
+            self.batch_sizes.clear()
+
+
+# --- マイクロバッチ ---
+class MicroBatcher:
+    """同時に届いた1行ずつの予測を、まとめて1回の predict_proba で処理する
+
+    最初のリクエストから max_wait_ms 待つか max_batch_size 行たまった時点で予測する。
+    予測は専用のスレッド1つで行い、その間もイベントループは次のリクエストを受け付ける。
+    """
+
+    def __init__(self, model, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = None
+        self._task = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def predict(self, row):
+        """1行分の特徴量の辞書から (生存確率, まとめた行数) を返す"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(items) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            frame = pd.DataFrame([row for row, _ in items], columns=FEATURE_COLUMNS)
+            try:
+                proba = await loop.run_in_executor(
+                    self._executor, predict_survival_proba, self.model, frame
+                )
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            stats.record_batch(len(items))
+            for (_, future), p in zip(items, proba):
+                if not future.done():
+                    future.set_result((float(p), len(items)))
+
+
+def predict_survival_proba(model, frame):
+    """生存（クラス1）の確率を返す"""
+    return model.predict_proba(frame)[:, 1]
+
+
+def read_columnar(body, content_type):
+    """リクエスト本文（JSON / Arrow IPC / Parquet）をDataFrameに変換する
+
+    Raises:
+        HTTPException: pyarrowがない場合は415、JSONの形式が正しくない・列の長さが
+            揃っていない場合は422、Arrow/Parquetとして読み込めない場合は400
+    """
+    if content_type in ("application/vnd.apache.arrow.stream", "application/x-parquet"):
+        if pa is None:
+            raise HTTPException(
+                status_code=415, detail="Arrow/Parquet形式にはpyarrowが必要です"
+            )
+        try:
+            if content_type == "application/x-parquet":
+                return pd.read_parquet(io.BytesIO(body))
+            return pa.ipc.open_stream(body).read_pandas()
+        except (pa.ArrowInvalid, OSError) as e:
+            raise HTTPException(
+                status_code=400, detail=f"本文を{content_type}として読み込めません: {e}"
+            )
+    try:
+        batch = ColumnarBatch.model_validate_json(body)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=422, detail=e.errors(include_url=False, include_input=False)
+        )
+    try:
+        return pd.DataFrame(batch.columns)
+    except ValueError as e:  # 列の長さが揃っていない
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+# --- FastAPIアプリケーション定義 ---
+app = FastAPI(title="Titanic予測API", version="1.0.0")
+stats = LatencyStats()
+model = None
+batcher = None
+
+
+@app.on_event("startup")
+async def startup_event():
+    """起動時にモデルを1回だけ読み込む"""
+    global model, batcher
+    start = time.perf_counter()
+    model = joblib.load(MODEL_PATH)
+    if FAST_PREDICTOR:
+        model = compile_pipeline(model)
+    batcher = MicroBatcher(model)
+    batcher.start()
+    print(f"モデルを読み込みました: {MODEL_PATH} ({time.perf_counter() - start:.2f}秒)")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if batcher is not None:
+        await batcher.stop()
+
+
+@app.get("/health")
+async def health_check():
+    return {
+        "status": "ok" if model is not None else "loading",
+        "model": MODEL_PATH,
+        "fast_predictor": FAST_PREDICTOR,
+    }
+
+
+@app.post("/predict", response_model=Prediction)
+async def predict(passenger: Passenger):
+    """1人分の特徴量から生存を予測する（同時リクエストはマイクロバッチで処理）"""
+    start = time.perf_counter()
+    probability, batch_size = await batcher.predict(passenger.model_dump())
+    stats.record("predict", time.perf_counter() - start)
+    return Prediction(
+        survived=int(probability >= 0.5),
+        probability=probability,
+        batch_size=batch_size,
+    )
+
+
+@app.post("/predict/batch", response_model=BatchPrediction)
+async def predict_batch(request: Request):
+    """列形式のデータ（JSON、Arrow IPC、Parquet）をまとめて予測する"""
+    start = time.perf_counter()
+    body = await request.body()
+    content_type = request.headers.get("content-type", "application/json")
+    frame = read_columnar(body, content_type.split(";")[0].strip())
+    missing = [col for col in FEATURE_COLUMNS if col not in frame.columns]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"カラムがありません: {missing}")
+    if frame.empty:
+        return BatchPrediction(survived=[], probability=[], rows=0)
+    try:
+        proba = await asyncio.get_running_loop().run_in_executor(
+            None, predict_survival_proba, model, frame[FEATURE_COLUMNS]
+        )
+    except ValueError as e:  # 数値の列に文字列があるなど、予測できない値
+        raise HTTPException(status_code=422, detail=str(e))
+    stats.record("predict_batch", time.perf_counter() - start, rows=len(frame))
+    return BatchPrediction(
+        survived=(proba >= 0.5).astype(int).tolist(),
+        probability=proba.tolist(),
+        rows=len(frame),
+    )
+
+
+@app.get("/metrics")
+async def metrics():
+    """p50/p99レイテンシと処理行数（rows/sec）を返す"""
+    return stats.summary()
+
+
+# --- ベンチマーク ---
+async def _bench(rows, concurrency):
+    """同時実行の1行予測を送り、統計を返す"""
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(row):
+            async with semaphore:
+                response = await c.post("/predict", json=row)
+                response.raise_for_status()
+
+        stats.reset()
+        await asyncio.gather(*(send(row) for row in rows))
+        return stats.summary()
+
+
+def run_benchmark(requests=2000, concurrency=32):
+    data = pd.read_csv("data/Titanic.csv")[FEATURE_COLUMNS]
+    rows = [
+        {k: (None if pd.isna(v) else v) for k, v in row.items()}
+        for row in data.sample(requests, replace=True, random_state=0).to_dict(
+            "records"
+        )
+    ]
+
+    async def main():
+        global batcher
+        await startup_event()
+        for max_batch_size in [1, MAX_BATCH_SIZE]:
+            await batcher.stop()
+            batcher = MicroBatcher(model, max_batch_size=max_batch_size)
+            batcher.start()
+            summary = await _bench(rows, concurrency)
+            single = summary["endpoints"]["predict"]
+            print(
+                f"max_batch_size={max_batch_size:<4} "
+                f"p50={single['p50_ms']:.2f}ms p99={single['p99_ms']:.2f}ms "
+                f"{single['rows_per_sec']:.0f} rows/sec "
+                f"(平均バッチ {summary['micro_batch_mean_size']:.1f}行)"
+            )
+        await batcher.stop()
+
+    print(f"\n=== 1行予測のベンチマーク ({requests}件, 同時実行数 {concurrency}) ===")
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Titanic予測サーバー")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--bench", action="store_true", help="ベンチマークを実行する")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    if args.bench:
+        run_benchmark(args.requests, args.concurrency)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=args.port)
@@ -0,0 +1,483 @@
+"""大きなCSVファイルをチャンクに分けて読み込みながら検証する（ストリーミング検証）
+
+DataValidator.validate_titanic_data はDataFrame全体をメモリに載せて検証するが、
+ここではCSVを一定の行数（pyarrowでは一定のバイト数）ずつ読み、main.py の
+TITANIC_EXPECTATIONS を1チャンクずつ判定して結果を積み上げる。
+
+- 値の集合の期待値: これまでに出てきた重複のない値の集合
+- 値の範囲の期待値: これまでの最小値と最大値
+- 欠損率: カラムごとの欠損値の数（max_null_rates を指定すると上限を判定する）
+
+違反した行はファイル先頭からの行番号（ヘッダーを除き0始まり）で報告する。
+保持するのはチャンク1つと集計値・違反の例（max_examples 件まで）だけなので、
+メモリ使用量はファイルの大きさによらない。fail_fast=True なら違反が見つかった
+チャンクで読み込みを止める。判定はDataFrame全体で検証した場合と同じになる。
+
+使用例（演習2ディレクトリで実行）:
+    python stream_validation.py data/Titanic.csv --chunksize 100000
+    python stream_validation.py big.csv --reader pyarrow --fail-fast
+    python stream_validation.py data/Titanic.csv --max-null-rate Age=0.25
+    pytest stream_validation.py
+"""
+
+import time
+import argparse
+import csv as stdlib_csv
+import numpy as np
+import pandas as pd
+from main import REQUIRED_COLUMNS, TITANIC_EXPECTATIONS, DataLoader, DataValidator
+
+# 1チャンクの行数（pandas）とバイト数（pyarrow）
+DEFAULT_CHUNKSIZE = 100_000
+DEFAULT_BLOCK_SIZE = 16 << 20
+# 期待値ごとに記録する違反の例の数
+DEFAULT_MAX_EXAMPLES = 20
+
+
+def _is_numeric_set(value_set):
+    return all(
+        isinstance(v, (int, float)) and not isinstance(v, bool) for v in value_set
+    )
+
+
+class _Check:
+    """1つの期待値の判定をチャンクごとに積み上げる"""
+
+    def __init__(self, spec, max_examples):
+        self.spec = spec
+        self.column = spec["kwargs"]["column"]
+        self.max_examples = max_examples
+        self.unexpected_count = 0
+        self.unexpected_rows = []
+
+    def _record(self, rows, values):
+        """違反した行を記録する（例は max_examples 件まで）"""
+        self.unexpected_count += len(rows)
+        room = self.max_examples - len(self.unexpected_rows)
+        for row, value in zip(rows[:room], values[:room]):
+            self.unexpected_rows.append({"row": int(row), "value": value})
+
+    def result(self):
+        return {
+            "success": self.unexpected_count == 0,
+            "expectation_config": self.spec,
+            "result": {
+                **self.observed(),
+                "unexpected_count": self.unexpected_count,
+                "unexpected_rows": self.unexpected_rows,
+            },
+        }
+
+
+class _DistinctSetCheck(_Check):
+    """expect_column_distinct_values_to_be_in_set
+
+    メモリがファイルの大きさによらないよう、集合に含まれない値は max_examples 種類まで
+    しか記録しない（壊れた列に値の種類が多くても増え続けない）。
+    """
+
+    def __init__(self, spec, max_examples):
+        super().__init__(spec, max_examples)
+        self.value_set = set(spec["kwargs"]["value_set"])
+        self.numeric = _is_numeric_set(self.value_set)
+        self.expected_seen = set()  # 集合に含まれる値（value_set より大きくならない）
+        self.unexpected_seen = set()  # 集合に含まれない値（max_examples 種類まで）
+        self.truncated = False
+
+    def update(self, column, offset):
+        raw = column.to_numpy()
+        present = ~pd.isna(raw)
+        values = raw
+        if self.numeric:
+            # 数値に変換できない値は集合に含まれない値として扱う
+            values = pd.to_numeric(column, errors="coerce").to_numpy()
+            values = np.where(pd.isna(values), raw, values)
+        uniques = [v for v in pd.unique(values[present])]
+        self.expected_seen.update(v for v in uniques if v in self.value_set)
+        unexpected = [v for v in uniques if v not in self.value_set]
+        if unexpected:
+            new = [v for v in unexpected if v not in self.unexpected_seen]
+            room = self.max_examples - len(self.unexpected_seen)
+            self.unexpected_seen.update(new[: max(room, 0)])
+            self.truncated = self.truncated or len(new) > room
+            mask = present & pd.Series(values).isin(unexpected).to_numpy()
+            rows = np.flatnonzero(mask)
+            self._record(rows + offset, raw[rows].tolist())
+
+    def observed(self):
+        distinct = self.expected_seen | self.unexpected_seen
+        observed = {"observed_value": sorted(distinct, key=str)}
+        if self.truncated:
+            # 集合に含まれない値が max_examples 種類を超え、一部を記録していない
+            observed["observed_value_truncated"] = True
+        return observed
+
+
+class _RangeCheck(_Check):
+    """expect_column_values_to_be_between"""
+
+    def __init__(self, spec, max_examples):
+        super().__init__(spec, max_examples)
+        self.min_value = spec["kwargs"]["min_value"]
+        self.max_value = spec["kwargs"]["max_value"]
+        self.low = np.inf
+        self.high = -np.inf
+
+    def update(self, column, offset):
+        raw = column.to_numpy()
+        values = pd.to_numeric(column, errors="coerce").to_numpy(dtype=np.float64)
+        present = ~pd.isna(raw)
+        numeric = ~np.isnan(values)
+        if numeric.any():
+            self.low = min(self.low, values[numeric].min())
+            self.high = max(self.high, values[numeric].max())
+        with np.errstate(invalid="ignore"):
+            outside = (values < self.min_value) | (values > self.max_value)
+        # 数値に変換できない値も違反とする
+        rows = np.flatnonzero(outside | (present & ~numeric))
+        if len(rows):
+            self._record(rows + offset, raw[rows].tolist())
+
+    def observed(self):
+        if self.low > self.high:  # 全て欠損値
+            return {"min": None, "max": None}
+        return {"min": float(self.low), "max": float(self.high)}
+
+
+CHECK_CLASSES = {
+    "expect_column_distinct_values_to_be_in_set": _DistinctSetCheck,
+    "expect_column_values_to_be_between": _RangeCheck,
+}
+
+
+def _pandas_chunks(path, columns, chunksize, block_size):
+    yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+
+
+def _pyarrow_chunks(path, columns, chunksize, block_size):
+    import pyarrow as pa
+    from pyarrow import csv
+
+    # 数値のカラムはfloat64で読む（チャンクごとに型が変わらないようにする）
+    numeric = {
+        spec["kwargs"]["column"]
+        for spec in TITANIC_EXPECTATIONS
+        if spec["type"] == "expect_column_values_to_be_between"
+        or _is_numeric_set(spec["kwargs"]["value_set"])
+    }
+    convert_options = csv.ConvertOptions(
+        include_columns=columns,
+        column_types={
+            col: pa.float64() if col in numeric else pa.string() for col in columns
+        },
+        strings_can_be_null=True,  # pandasと同じく空文字列を欠損値にする
+    )
+    # csv.open_csv はファイルの残りを先読みしてメモリに溜めるため、ファイルを
+    # 行の区切りで block_size バイトずつに分け、1ブロックずつ read_csv で読む
+    # （値の中に改行を含むCSVには対応しない。その場合は reader="pandas" を使う）
+    with open(path, "rb") as f:
+        header = f.readline()
+        read_options = csv.ReadOptions(
+            column_names=next(stdlib_csv.reader([header.decode("utf-8-sig")]))
+        )
+        rest = b""
+        while True:
+            block = f.read(block_size)
+            data = rest + block
+            if block:
+                cut = data.rfind(b"\n") + 1
+                data, rest = data[:cut], data[cut:]
+            if data.strip():
+                table = csv.read_csv(
+                    pa.py_buffer(data),
+                    read_options=read_options,
+                    convert_options=convert_options,
+                )
+                yield table.to_pandas()
+            if not block:
+                break
+
+
+READERS = {"pandas": _pandas_chunks, "pyarrow": _pyarrow_chunks}
+
+
+def validate_csv(
+    path,
+    chunksize=DEFAULT_CHUNKSIZE,
+    reader="pandas",
+    fail_fast=False,
+    max_null_rates=None,
+    max_examples=DEFAULT_MAX_EXAMPLES,
+    block_size=DEFAULT_BLOCK_SIZE,
+):
+    """CSVファイルをチャンクごとに読み込みながら検証する
+
+    Args:
+        path (str): CSVファイルのパス
+        chunksize (int): 1チャンクの行数（reader="pandas"）
+        reader (str): "pandas" または "pyarrow"（pyarrowのCSVリーダー）
+        fail_fast (bool): 違反が見つかったチャンクで読み込みを止める
+        max_null_rates (dict, optional): カラムごとの欠損率の上限（REQUIRED_COLUMNS のカラム）
+        max_examples (int): 期待値ごとに記録する違反した行（と集合に含まれない値の種類）の数
+        block_size (int): 1チャンクのバイト数（reader="pyarrow"）
+
+    Returns:
+        dict: {"success", "rows", "chunks", "stopped_early", "null_rates",
+        "results": 期待値ごとの結果, "error": 読み込めなかった場合の理由}
+
+    Raises:
+        ValueError: max_null_rates に REQUIRED_COLUMNS 以外のカラムがある場合
+    """
+    unknown_columns = sorted(set(max_null_rates or {}) - set(REQUIRED_COLUMNS))
+    if unknown_columns:
+        raise ValueError(f"欠損率を判定できないカラムです: {unknown_columns}")
+    report = {
+        "success": False,
+        "rows": 0,
+        "chunks": 0,
+        "stopped_early": False,
+        "null_rates": {},
+        "results": [],
+    }
+    try:
+        header = pd.read_csv(path, nrows=0).columns
+    except Exception as e:
+        # ファイルがない・空のファイルなど、ヘッダーを読めないエラー
+        report["error"] = f"ヘッダーの読み込みに失敗しました: {e}"
+        report["stopped_early"] = True
+        return report
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in header]
+    if missing_columns:
+        report["error"] = f"以下のカラムがありません: {missing_columns}"
+        report["stopped_early"] = True
+        return report
+
+    checks = [
+        CHECK_CLASSES[spec["type"]](spec, max_examples) for spec in TITANIC_EXPECTATIONS
+    ]
+    null_counts = dict.fromkeys(REQUIRED_COLUMNS, 0)
+    offset = 0
+    try:
+        for chunk in READERS[reader](path, REQUIRED_COLUMNS, chunksize, block_size):
+            for check in checks:
+                check.update(chunk[check.column], offset)
+            for col, count in chunk.isna().sum().items():
+                null_counts[col] += int(count)
+            offset += len(chunk)
+            report["chunks"] += 1
+            if fail_fast and any(check.unexpected_count for check in checks):
+                report["stopped_early"] = True
+                break
+    except Exception as e:
+        # 壊れた行など、読み込みを続けられないエラー
+        report["error"] = f"{offset}行目以降の読み込みに失敗しました: {e}"
+        report["stopped_early"] = True
+
+    report["rows"] = offset
+    report["results"] = [check.result() for check in checks]
+    report["null_rates"] = {
+        col: count / offset if offset else 0.0 for col, count in null_counts.items()
+    }
+    for col, limit in (max_null_rates or {}).items():
+        rate = report["null_rates"][col]
+        report["results"].append(
+            {
+                "success": rate <= limit,
+                "expectation_config": {
+                    "type": "expect_column_null_rate_to_be_at_most",
+                    "kwargs": {"column": col, "max_null_rate": limit},
+                },
+                "result": {"observed_value": rate},
+            }
+        )
+    report["success"] = "error" not in report and all(
+        result["success"] for result in report["results"]
+    )
+    return report
+
+
+def _format_report(report):
+    lines = [
+        f"行数: {report['rows']:,} (チャンク数: {report['chunks']})"
+        + (" ※途中で終了" if report["stopped_early"] else "")
+    ]
+    if "error" in report:
+        lines.append(f"エラー: {report['error']}")
+    for result in report["results"]:
+        config = result["expectation_config"]
+        status = "OK" if result["success"] else "NG"
+        line = f"{status}  {config['type']}({config['kwargs']['column']})"
+        examples = result["result"].get("unexpected_rows")
+        if examples:
+            count = result["result"]["unexpected_count"]
+            shown = ", ".join(f"{e['row']}行目={e['value']!r}" for e in examples[:5])
+            line += f"  違反 {count}件: {shown}"
+        lines.append(line)
+    lines.append(f"検証結果: {'成功' if report['success'] else '失敗'}")
+    return "\n".join(lines)
+
+
+def _null_rate_limit(text):
+    """--max-null-rate の値（カラム名=上限）を (カラム名, 上限) にする"""
+    column, sep, limit = text.partition("=")
+    try:
+        if not sep:
+            raise ValueError
+        return column, float(limit)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"カラム名=上限 の形式で指定してください: {text}"
+        ) from None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CSVファイルのストリーミング検証")
+    parser.add_argument("path", nargs="?", default="data/Titanic.csv")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument("--reader", choices=sorted(READERS), default="pandas")
+    parser.add_argument("--fail-fast", action="store_true")
+    parser.add_argument(
+        "--max-null-rate",
+        type=_null_rate_limit,
+        action="append",
+        default=[],
+        metavar="COLUMN=RATE",
+        help="カラムの欠損率の上限（複数回指定できる）",
+    )
+    args = parser.parse_args()
+    max_null_rates = dict(args.max_null_rate)
+    unknown_columns = sorted(set(max_null_rates) - set(REQUIRED_COLUMNS))
+    if unknown_columns:
+        parser.error(f"欠損率を判定できないカラムです: {unknown_columns}")
+
+    start = time.perf_counter()
+    report = validate_csv(
+        args.path,
+        chunksize=args.chunksize,
+        reader=args.reader,
+        fail_fast=args.fail_fast,
+        max_null_rates=max_null_rates,
+        block_size=args.block_size,
+    )
+    elapsed = time.perf_counter() - start
+    print(_format_report(report))
+    try:
+        import resource  # Unixのみ
+    except ImportError:
+        print(f"実行時間: {elapsed:.2f}秒")
+    else:
+        # Linuxの ru_maxrss はKB単位
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"実行時間: {elapsed:.2f}秒, 最大メモリ使用量: {peak:.0f}MB")
+    raise SystemExit(0 if report["success"] else 1)
+
+
+# テスト関数（pytestで実行可能）
+def _write_variants(tmp_path):
+    """元のCSVと、値を1つずつ壊したCSVを書き出す"""
+    data = DataLoader.read_csv("data/Titanic.csv")
+    variants = {"正常": data}
+    for row, column, value in [
+        (0, "Pclass", 5),
+        (700, "Sex", "unknown"),
+        (450, "Age", -1.0),
+        (890, "Fare", 1000.0),
+        (300, "Embarked", "X"),
+    ]:
+        bad_data = data.copy()
+        bad_data[column] = bad_data[column].astype(object)
+        bad_data.loc[row, column] = value
+        variants[f"{column}_{row}"] = bad_data
+    paths = {}
+    for name, frame in variants.items():
+        paths[name] = tmp_path / f"{name}.csv"
+        frame.to_csv(paths[name], index=False)
+    return paths
+
+
+def test_stream_validation_matches_in_memory(tmp_path):
+    """チャンクごとの検証がDataFrame全体の検証と同じ判定になり、違反した行がわかる"""
+    for name, path in _write_variants(tmp_path).items():
+        expected, expected_results = DataValidator.validate_titanic_data(
+            pd.read_csv(path), engine="numpy"
+        )
+        for reader in READERS:
+            report = validate_csv(path, chunksize=100, reader=reader, block_size=4096)
+            assert report["chunks"] > 1
+            assert report["rows"] == 891
+            assert report["success"] == expected, (name, reader)
+            assert [r["success"] for r in report["results"]] == [
+                r["success"] for r in expected_results
+            ], (name, reader)
+            if name != "正常":
+                (failed,) = [r for r in report["results"] if not r["success"]]
+                assert failed["result"]["unexpected_count"] == 1
+                assert failed["result"]["unexpected_rows"][0]["row"] == int(
+                    name.split("_")[1]
+                )
+
+
+def test_stream_validation_fail_fast_and_null_rates(tmp_path):
+    """fail_fast では違反のあるチャンクで止まり、欠損率の上限も判定できる"""
+    import pytest
+
+    path = _write_variants(tmp_path)["Pclass_0"]
+    report = validate_csv(path, chunksize=100, fail_fast=True)
+    assert not report["success"]
+    assert report["stopped_early"]
+    assert report["rows"] == 100
+
+    report = validate_csv(
+        "data/Titanic.csv", chunksize=100, max_null_rates={"Age": 0.1}
+    )
+    assert (
+        report["null_rates"]["Age"]
+        == pd.read_csv("data/Titanic.csv")["Age"].isna().mean()
+    )
+    assert not report["success"]
+    assert not report["results"][-1]["success"]
+
+    # 必須カラムがない場合は読み込まずに失敗する
+    pd.read_csv("data/Titanic.csv").drop(columns="Fare").to_csv(
+        tmp_path / "missing.csv", index=False
+    )
+    report = validate_csv(tmp_path / "missing.csv")
+    assert not report["success"]
+    assert "Fare" in report["error"]
+
+    # ヘッダーを読めないファイルも report["error"] で報告する
+    (tmp_path / "empty.csv").write_text("")
+    for path in [tmp_path / "empty.csv", tmp_path / "not_found.csv"]:
+        report = validate_csv(path)
+        assert not report["success"]
+        assert "ヘッダー" in report["error"]
+
+    # 検証しないカラムの欠損率の上限は、読み込む前にエラーにする
+    with pytest.raises(ValueError, match="Cabin"):
+        validate_csv("data/Titanic.csv", max_null_rates={"Cabin": 0.5})
+
+
+def test_stream_validation_caps_unexpected_distinct_values(tmp_path):
+    """値の種類が多い壊れた列でも、記録する値は max_examples 種類まで"""
+    data = pd.read_csv("data/Titanic.csv")
+    data["Sex"] = [f"broken-{i}" for i in range(len(data))]
+    data.to_csv(tmp_path / "broken.csv", index=False)
+
+    for reader in ["pandas", "pyarrow"]:
+        report = validate_csv(
+            tmp_path / "broken.csv", chunksize=100, reader=reader, max_examples=5
+        )
+        result = next(
+            r
+            for r in report["results"]
+            if r["expectation_config"]["kwargs"].get("column") == "Sex"
+        )["result"]
+        assert not report["success"]
+        assert result["unexpected_count"] == len(data)
+        assert len(result["observed_value"]) == 5
+        assert result["observed_value_truncated"]
+
+
+if __name__ == "__main__":
+    main()
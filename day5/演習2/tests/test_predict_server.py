@@ -0,0 +1,60 @@
+import os
+import sys
+import pytest
+from fastapi.testclient import TestClient
+
+# 演習2のモジュール（predict_server.py など）を読み込めるようにする
+EXERCISE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(EXERCISE_DIR)
+import predict_server
+from fast_predictor import _train_titanic
+
+
+@pytest.fixture(autouse=True)
+def exercise_dir(monkeypatch):
+    """演習2のファイル（data/Titanic.csv など）は演習2ディレクトリからの相対パスで読み込む"""
+    monkeypatch.chdir(EXERCISE_DIR)
+
+
+def test_predict_batch_rejects_malformed_bodies(monkeypatch):
+    """読み込めない本文は4xxになり、0行のバッチは空の結果になる"""
+    trained, X, _ = _train_titanic({"n_estimators": 10, "random_state": 42})
+    monkeypatch.setattr(predict_server, "model", trained)
+    client = TestClient(predict_server.app)
+
+    columns = {
+        col: X[col].head(3).where(X[col].head(3).notna(), None).tolist()
+        for col in predict_server.FEATURE_COLUMNS
+    }
+    response = client.post("/predict/batch", json={"columns": columns})
+    assert response.status_code == 200 and response.json()["rows"] == 3
+
+    empty = {col: [] for col in predict_server.FEATURE_COLUMNS}
+    response = client.post("/predict/batch", json={"columns": empty})
+    assert response.status_code == 200
+    assert response.json() == {"survived": [], "probability": [], "rows": 0}
+
+    uneven = dict(columns, Age=[22.0])
+    cases = [
+        ("application/json", b'{"columns": {"Pclass": [1', 422),
+        ("application/json", b"[]", 422),
+        (
+            "application/json",
+            predict_server.ColumnarBatch(columns=uneven).model_dump_json(),
+            422,
+        ),
+        (
+            "application/json",
+            predict_server.ColumnarBatch(
+                columns=dict(columns, Age=["x"] * 3)
+            ).model_dump_json(),
+            422,
+        ),
+        ("application/x-parquet", b"garbage", 400),
+        ("application/vnd.apache.arrow.stream", b"garbage", 400),
+    ]
+    for content_type, body, status_code in cases:
+        response = client.post(
+            "/predict/batch", content=body, headers={"content-type": content_type}
+        )
+        assert response.status_code == status_code, (content_type, body)
@@ -0,0 +1,295 @@
+import os
+import sys
+import json
+import time
+import pickle
+import hashlib
+import inspect
+import tempfile
+from contextlib import contextmanager
+import pytest
+import pandas as pd
+import sklearn
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+
+# 演習1・演習2・演習3 で共有するモジュール（day5/ml_common）を読み込めるようにする
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+from ml_common.latency_benchmark import run_benchmark, time_relative
+from ml_common.metrics_store import MetricsStore
+
+# テスト用データとモデルパスを定義
+DATA_PATH = os.path.join(os.path.dirname(__file__), "../data/Titanic.csv")
+MODEL_DIR = os.path.join(os.path.dirname(__file__), "../models")
+MODEL_PATH = os.path.join(MODEL_DIR, "titanic_model.pkl")
+# 評価指標のデータベース（metrics.db）の保存先
+BENCHMARK_DIR = os.path.join(os.path.dirname(__file__), "../benchmarks")
+
+# テストで学習するモデルのパラメータとデータの分割
+MODEL_PARAMS = {"n_estimators": 100, "random_state": 42}
+SPLIT_PARAMS = {"test_size": 0.2, "random_state": 42}
+
+
+def _file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _dump_atomic(obj, path):
+    """一時ファイルに書き出してから置き換える（並列のワーカーが同時に書いても壊れない）"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(obj, f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@contextmanager
+def _file_lock(path, timeout=600, poll_interval=0.1):
+    """複数のワーカー（pytest-xdist）の間の排他ロック
+
+    ロックファイルを作れたワーカーだけが進み、他のワーカーは削除されるまで待つ。
+    異常終了したワーカーが残したロックは timeout 秒たったら無視する。
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > timeout:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"ロックを取得できません: {path}")
+            time.sleep(poll_interval)
+    try:
+        yield
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _load_pickle(path):
+    """キャッシュを読み込む（ない・壊れている場合は None）"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+def _load_or_build(cache_path, build):
+    """cache_path のキャッシュを読み込み、なければ build() の結果を保存する
+
+    並列のワーカー（pytest-xdist）のうちロックを取った1つだけが build() を実行し、
+    他のワーカーはその結果を読み込む。
+
+    Returns:
+        tuple: (値, このプロセスで build() を実行したか)
+    """
+    cached = _load_pickle(cache_path)
+    if cached is not None:
+        return cached, False
+    with _file_lock(cache_path + ".lock"):
+        # 待っている間に他のワーカーが保存した場合はそれを読み込む
+        cached = _load_pickle(cache_path)
+        if cached is not None:
+            return cached, False
+        cached = build()
+        _dump_atomic(cached, cache_path)
+        return cached, True
+
+
+def create_preprocessor():
+    """前処理パイプラインを定義"""
+    # 数値カラムと文字列カラムを定義
+    numeric_features = ["Age", "Pclass", "SibSp", "Parch", "Fare"]
+    categorical_features = ["Sex", "Embarked"]
+
+    # 数値特徴量の前処理（欠損値補完と標準化）
+    numeric_transformer = Pipeline(
+        steps=[
+            ("imputer", SimpleImputer(strategy="median")),
+            ("scaler", StandardScaler()),
+        ]
+    )
+
+    # カテゴリカル特徴量の前処理（欠損値補完とOne-hotエンコーディング）
+    categorical_transformer = Pipeline(
+        steps=[
+            ("imputer", SimpleImputer(strategy="most_frequent")),
+            ("onehot", OneHotEncoder(handle_unknown="ignore")),
+        ]
+    )
+
+    # 前処理をまとめる
+    return ColumnTransformer(
+        transformers=[
+            ("num", numeric_transformer, numeric_features),
+            ("cat", categorical_transformer, categorical_features),
+        ]
+    )
+
+
+def create_model(params=MODEL_PARAMS):
+    """学習前のモデルパイプラインを作る"""
+    return Pipeline(
+        steps=[
+            ("preprocessor", create_preprocessor()),
+            ("classifier", RandomForestClassifier(**params)),
+        ]
+    )
+
+
+@pytest.fixture(scope="session")
+def sample_data():
+    """テスト用データセットを読み込む（テスト全体で1回だけ。変更しないこと）"""
+    if not os.path.exists(DATA_PATH):
+        from sklearn.datasets import fetch_openml
+
+        titanic = fetch_openml("titanic", version=1, as_frame=True)
+        df = titanic.data
+        df["Survived"] = titanic.target
+
+        # 必要なカラムのみ選択
+        df = df[
+            ["Pclass", "Sex", "Age", "SibSp", "Parch", "Fare", "Embarked", "Survived"]
+        ]
+
+        os.makedirs(os.path.dirname(DATA_PATH), exist_ok=True)
+        df.to_csv(DATA_PATH, index=False)
+
+    return pd.read_csv(DATA_PATH)
+
+
+@pytest.fixture
+def preprocessor():
+    """前処理パイプラインを定義"""
+    return create_preprocessor()
+
+
+@pytest.fixture(scope="session")
+def data_split(sample_data):
+    """データの分割とラベル変換 (X_train, X_test, y_train, y_test)"""
+    X = sample_data.drop("Survived", axis=1)
+    y = sample_data["Survived"].astype(int)
+    return train_test_split(X, y, **SPLIT_PARAMS)
+
+
+@pytest.fixture(scope="session")
+def model_cache_dir(request):
+    """学習済みモデルのキャッシュの保存先（pytestのキャッシュディレクトリ）"""
+    cache = getattr(request.config, "cache", None)
+    if cache is None:  # -p no:cacheprovider で実行された場合
+        return os.path.join(tempfile.gettempdir(), "titanic_model_cache")
+    return str(cache.mkdir("titanic_model"))
+
+
+@pytest.fixture(scope="session")
+def model_key(sample_data):
+    """学習済みモデルのキャッシュのキー
+
+    データの内容・パラメータ・モデルを作る関数のソース・scikit-learnのバージョンから決まる。
+    """
+    return hashlib.sha256(
+        json.dumps(
+            {
+                "data": _file_hash(DATA_PATH),
+                "model": MODEL_PARAMS,
+                "split": SPLIT_PARAMS,
+                "code": hashlib.sha256(
+                    (
+                        inspect.getsource(create_model)
+                        + inspect.getsource(create_preprocessor)
+                    ).encode()
+                ).hexdigest(),
+                "sklearn": sklearn.__version__,
+                "format": 2,
+            },
+            sort_keys=True,
+        ).encode()
+    ).hexdigest()[:16]
+
+
+@pytest.fixture(scope="session")
+def trained_model(data_split, model_cache_dir, model_key):
+    """学習済みモデルと学習時間（テスト全体で1回だけ）
+
+    学習済みモデルは model_key ごとにpytestのキャッシュディレクトリに保存し、次回以降の
+    テスト実行ではそれを読み込む（gitで管理している models/titanic_model.pkl は書き換えない）。
+    学習時間（latency_benchmark.time_relative の結果）も学習したときの値を一緒に保存する。
+
+    Returns:
+        dict: "model"、"training"（学習時間）、"trained"（このプロセスで学習したか。
+        False なら "training" は以前に学習したときの値）
+    """
+    X_train, X_test, y_train, y_test = data_split
+
+    def train():
+        # キャッシュがないときだけ実行されるため、学習は1回だけにしてその時間を記録する
+        model, training = time_relative(
+            lambda: create_model().fit(X_train, y_train), repeats=1
+        )
+        return {"model": model, "training": training}
+
+    cache_path = os.path.join(model_cache_dir, f"titanic_model-{model_key}.pkl")
+    cached, trained = _load_or_build(cache_path, train)
+    return {**cached, "trained": trained}
+
+
+@pytest.fixture(scope="session")
+def train_model(trained_model, data_split):
+    """学習済みモデルとテストデータ (model, X_test, y_test)"""
+    _, X_test, _, y_test = data_split
+    return trained_model["model"], X_test, y_test
+
+
+@pytest.fixture(scope="session")
+def latency_report(train_model, sample_data, model_cache_dir, model_key):
+    """バッチサイズごとの推論レイテンシ（latency_benchmark.run_benchmark の結果）
+
+    並列実行（pytest-xdist）では、同じテスト実行のワーカーの間で1回だけ計測して共有する。
+    """
+    model, _, _ = train_model
+
+    def benchmark():
+        return run_benchmark(model.predict, sample_data.drop("Survived", axis=1))
+
+    run_uid = os.environ.get("PYTEST_XDIST_TESTRUNUID")
+    if run_uid is None:
+        return benchmark()
+    prefix = f"latency-{model_key}-"
+    for name in os.listdir(model_cache_dir):
+        # 以前のテスト実行で計測した結果は使わない（削除する）
+        if name.startswith("latency-") and not name.startswith(prefix + run_uid):
+            try:
+                os.remove(os.path.join(model_cache_dir, name))
+            except FileNotFoundError:
+                pass
+    cache_path = os.path.join(model_cache_dir, f"{prefix}{run_uid}.pkl")
+    return _load_or_build(cache_path, benchmark)[0]
+
+
+@pytest.fixture(scope="session")
+def metrics_store():
+    """評価指標を記録するデータベース（METRICS_DB_PATH で変更できる）"""
+    return MetricsStore(
+        os.environ.get("METRICS_DB_PATH", os.path.join(BENCHMARK_DIR, "metrics.db"))
+    )
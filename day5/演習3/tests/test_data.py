@@ -1,4 +1,3 @@
-import os
 import pytest
 import pandas as pd
 import numpy as np
@@ -9,14 +8,7 @@ import warnings
 # 警告を抑制
 warnings.filterwarnings("ignore")
 
-# テスト用データパスを定義
-DATA_PATH = os.path.join(os.path.dirname(__file__), "../data/Titanic.csv")
-
-
-@pytest.fixture
-def sample_data():
-    """Titanicテスト用データセットを読み込む"""
-    return pd.read_csv(DATA_PATH)
+# テスト用データ（sample_data）は conftest.py で定義している
 
 
 def test_data_exists(sample_data):
@@ -76,36 +68,18 @@ def test_missing_values_acceptable(sample_data):
         ), f"カラム '{col}' の欠損率が80%を超えています: {missing_rate:.2%}"
 
 
-def test_value_ranges(sample_data):
-    """値の範囲を検証"""
-    context = gx.get_context()
+@pytest.fixture(scope="session")
+def titanic_validation():
+    """Great Expectationsのコンテキストと期待値スイートを作る（テスト全体で1回だけ）"""
+    context = gx.get_context(mode="ephemeral")
     data_source = context.data_sources.add_pandas("pandas")
     data_asset = data_source.add_dataframe_asset(name="pd dataframe asset")
 
     batch_definition = data_asset.add_batch_definition_whole_dataframe(
         "batch definition"
     )
-    batch = batch_definition.get_batch(batch_parameters={"dataframe": sample_data})
-
-    results = []
-
-    # 必須カラムの存在確認
-    required_columns = [
-        "Pclass",
-        "Sex",
-        "Age",
-        "SibSp",
-        "Parch",
-        "Fare",
-        "Embarked",
-    ]
-    missing_columns = [
-        col for col in required_columns if col not in sample_data.columns
-    ]
-    if missing_columns:
-        print(f"警告: 以下のカラムがありません: {missing_columns}")
-        return False, [{"success": False, "missing_columns": missing_columns}]
 
+    suite = context.suites.add(gx.ExpectationSuite(name="titanic value ranges"))
     expectations = [
         gx.expectations.ExpectColumnDistinctValuesToBeInSet(
             column="Pclass", value_set=[1, 2, 3]
@@ -123,9 +97,34 @@ def test_value_ranges(sample_data):
             column="Embarked", value_set=["C", "Q", "S", ""]
         ),
     ]
-
     for expectation in expectations:
-        result = batch.validate(expectation)
-        results.append(result)
-        is_successful = all(result.success for result in results)
-    assert is_successful, "データの値範囲が期待通りではありません"
+        suite.add_expectation(expectation)
+
+    return context.validation_definitions.add(
+        gx.ValidationDefinition(
+            name="titanic value ranges", data=batch_definition, suite=suite
+        )
+    )
+
+
+def test_value_ranges(sample_data, titanic_validation):
+    """値の範囲を検証"""
+    # 必須カラムの存在確認
+    required_columns = [
+        "Pclass",
+        "Sex",
+        "Age",
+        "SibSp",
+        "Parch",
+        "Fare",
+        "Embarked",
+    ]
+    missing_columns = [
+        col for col in required_columns if col not in sample_data.columns
+    ]
+    assert not missing_columns, f"以下のカラムがありません: {missing_columns}"
+
+    # すべての期待値を1回の検証で判定する
+    result = titanic_validation.run(batch_parameters={"dataframe": sample_data})
+    failed = [r.expectation_config.type for r in result.results if not r.success]
+    assert result.success, f"データの値範囲が期待通りではありません: {failed}"
@@ -1,105 +1,13 @@
 import os
+import pickle
 import pytest
-import pandas as pd
 import numpy as np
-import pickle
-import time
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score
-from sklearn.impute import SimpleImputer
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
-from sklearn.compose import ColumnTransformer
-from sklearn.pipeline import Pipeline
-
-# テスト用データとモデルパスを定義
-DATA_PATH = os.path.join(os.path.dirname(__file__), "../data/Titanic.csv")
-MODEL_DIR = os.path.join(os.path.dirname(__file__), "../models")
-MODEL_PATH = os.path.join(MODEL_DIR, "titanic_model.pkl")
-
-
-@pytest.fixture
-def sample_data():
-    """テスト用データセットを読み込む"""
-    if not os.path.exists(DATA_PATH):
-        from sklearn.datasets import fetch_openml
-
-        titanic = fetch_openml("titanic", version=1, as_frame=True)
-        df = titanic.data
-        df["Survived"] = titanic.target
-
-        # 必要なカラムのみ選択
-        df = df[
-            ["Pclass", "Sex", "Age", "SibSp", "Parch", "Fare", "Embarked", "Survived"]
-        ]
-
-        os.makedirs(os.path.dirname(DATA_PATH), exist_ok=True)
-        df.to_csv(DATA_PATH, index=False)
-
-    return pd.read_csv(DATA_PATH)
-
-
-@pytest.fixture
-def preprocessor():
-    """前処理パイプラインを定義"""
-    # 数値カラムと文字列カラムを定義
-    numeric_features = ["Age", "Pclass", "SibSp", "Parch", "Fare"]
-    categorical_features = ["Sex", "Embarked"]
-
-    # 数値特徴量の前処理（欠損値補完と標準化）
-    numeric_transformer = Pipeline(
-        steps=[
-            ("imputer", SimpleImputer(strategy="median")),
-            ("scaler", StandardScaler()),
-        ]
-    )
-
-    # カテゴリカル特徴量の前処理（欠損値補完とOne-hotエンコーディング）
-    categorical_transformer = Pipeline(
-        steps=[
-            ("imputer", SimpleImputer(strategy="most_frequent")),
-            ("onehot", OneHotEncoder(handle_unknown="ignore")),
-        ]
-    )
-
-    # 前処理をまとめる
-    preprocessor = ColumnTransformer(
-        transformers=[
-            ("num", numeric_transformer, numeric_features),
-            ("cat", categorical_transformer, categorical_features),
-        ]
-    )
-
-    return preprocessor
-
-
-@pytest.fixture
-def train_model(sample_data, preprocessor):
-    """モデルの学習とテストデータの準備"""
-    # データの分割とラベル変換
-    X = sample_data.drop("Survived", axis=1)
-    y = sample_data["Survived"].astype(int)
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42
-    )
-
-    # モデルパイプラインの作成
-    model = Pipeline(
-        steps=[
-            ("preprocessor", preprocessor),
-            ("classifier", RandomForestClassifier(n_estimators=100, random_state=42)),
-        ]
-    )
-
-    # モデルの学習
-    model.fit(X_train, y_train)
+from conftest import DATA_PATH, MODEL_PARAMS, MODEL_PATH, create_model
+from ml_common.latency_benchmark import BATCH_SIZES, environment_key, format_report
+from ml_common.metrics_store import file_hash, flatten_latency, format_regressions
 
-    # モデルの保存
-    os.makedirs(MODEL_DIR, exist_ok=True)
-    with open(MODEL_PATH, "wb") as f:
-        pickle.dump(model, f)
-
-    return model, X_test, y_test
+# 共有のフィクスチャ（sample_data・train_model など）は conftest.py で定義している
 
 
 def test_model_exists():
@@ -121,47 +29,72 @@ def test_model_accuracy(train_model):
     assert accuracy >= 0.75, f"モデルの精度が低すぎます: {accuracy}"
 
 
-def test_model_inference_time(train_model):
-    """モデルの推論時間を検証"""
-    model, X_test, _ = train_model
-
-    # 推論時間の計測
-    start_time = time.time()
-    model.predict(X_test)
-    end_time = time.time()
-
-    inference_time = end_time - start_time
-
-    # 推論時間が1秒未満であることを確認
-    assert inference_time < 1.0, f"推論時間が長すぎます: {inference_time}秒"
-
-
-def test_model_reproducibility(sample_data, preprocessor):
-    """モデルの再現性を検証"""
-    # データの分割
-    X = sample_data.drop("Survived", axis=1)
-    y = sample_data["Survived"].astype(int)
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42
+def test_model_inference_latency(latency_report):
+    """推論レイテンシを計測して表示する
+
+    ベースラインとの比較は test_model_metrics_regression で行う。
+    """
+    # バッチサイズごとにウォームアップの後で繰り返し計測した結果
+    print(format_report(latency_report))
+    assert list(latency_report["results"]) == [str(size) for size in BATCH_SIZES]
+    for stats in latency_report["results"].values():
+        assert stats["p50"] > 0 and stats["relative_p50"] > 0
+
+
+def test_model_metrics_regression(
+    trained_model, train_model, latency_report, metrics_store
+):
+    """評価指標を記録し、最後に承認されたベースラインより悪くなっていないか検証
+
+    精度・推論時間（バッチサイズごと）・モデルサイズ・学習時間を比べる。学習時間は
+    このテスト実行で学習した場合だけ記録する（キャッシュから読み込んだ値は比べない）。同じ環境で
+    承認された実行がない場合と ACCEPT_BASELINE=1 のときは、比べずに今回の実行を承認して
+    スキップする（失敗するのは回帰があった場合だけ）。
+    """
+    if int(os.environ.get("PYTEST_XDIST_WORKER_COUNT", "1")) > 1:
+        pytest.skip(
+            "並列実行（pytest-xdist）では他のテストと同時に計測されて値がぶれるため、"
+            "評価指標の記録と比較は1プロセスで実行したときだけ行います"
+        )
+    model, X_test, y_test = train_model
+    metrics = {
+        "accuracy": accuracy_score(y_test, model.predict(X_test)),
+        "model_size": len(pickle.dumps(model)),
+        **flatten_latency(latency_report),
+    }
+    if trained_model["trained"]:
+        metrics["train_time"] = trained_model["training"]["seconds"]
+        metrics["train_time_relative"] = trained_model["training"]["relative"]
+    run_id = metrics_store.record(
+        metrics,
+        data_hash=file_hash(DATA_PATH),
+        environment=environment_key(),
+        params=MODEL_PARAMS,
     )
 
-    # 同じパラメータで２つのモデルを作成
-    model1 = Pipeline(
-        steps=[
-            ("preprocessor", preprocessor),
-            ("classifier", RandomForestClassifier(n_estimators=100, random_state=42)),
-        ]
+    baseline, regressions = metrics_store.check(
+        run_id, accept=bool(os.environ.get("ACCEPT_BASELINE"))
     )
-
-    model2 = Pipeline(
-        steps=[
-            ("preprocessor", preprocessor),
-            ("classifier", RandomForestClassifier(n_estimators=100, random_state=42)),
-        ]
+    if baseline is None:
+        pytest.skip(
+            f"実行 #{run_id} をこの実行環境（{environment_key()}）のベースラインとして"
+            f"承認しました（{metrics_store.path}）。次の実行からこの実行と比べます。"
+        )
+
+    assert not regressions, (
+        f"ベースライン（実行 #{baseline['id']}, {baseline['git_commit']}）より"
+        f"悪くなった指標があります:\n{format_regressions(regressions)}"
     )
 
-    # 学習
-    model1.fit(X_train, y_train)
+
+def test_model_reproducibility(train_model, data_split):
+    """モデルの再現性を検証"""
+    # 同じパラメータで新たに学習したモデルと、共有のモデル（キャッシュから
+    # 読み込んだ場合は以前のテスト実行で学習したもの）を比べる
+    model1, X_test, _ = train_model
+    X_train, _, y_train, _ = data_split
+
+    model2 = create_model(MODEL_PARAMS)
     model2.fit(X_train, y_train)
 
     # 同じ予測結果になることを確認
@@ -171,3 +104,6 @@ def test_model_reproducibility(sample_data, preprocessor):
     assert np.array_equal(
         predictions1, predictions2
     ), "モデルの予測結果に再現性がありません"
+    assert np.array_equal(
+        model1.predict_proba(X_test), model2.predict_proba(X_test)
+    ), "モデルの予測確率に再現性がありません"